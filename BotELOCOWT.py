@@ -4,39 +4,163 @@
 
 
 import discord
+import numpy as np
 from discord import app_commands, ui
 from discord.ext import tasks
 import sqlite3
+import asyncio
+import functools
+import gzip
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 import os
+import shutil
 import uuid
+import re
 import time
 import math
-from typing import Optional, Any
+import bisect
+import heapq
+import itertools
+import sys
+import threading
+import traceback
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Optional, Any, Callable, Awaitable, NamedTuple
 
 # --- INITIAL CONFIGURATION AND GLOBAL VARIABLES ---
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+# The bot serves every guild it is in; each guild's channel, admin role and
+# K-factor live in the `guild_config` table (see /admin_configure). GUILD_ID and
+# CHANNEL_ID are only read by the migration that moves a single-guild database
+# to per-guild storage: existing players and matches are assigned to GUILD_ID.
 GUILD_ID_STR = os.getenv('GUILD_ID')
 GUILD_ID = int(GUILD_ID_STR) if GUILD_ID_STR and GUILD_ID_STR.isdigit() else 0
 CHANNEL_ID_STR = os.getenv('CHANNEL_ID')
 CHANNEL_ID = int(CHANNEL_ID_STR) if CHANNEL_ID_STR and CHANNEL_ID_STR.isdigit() else 0
+# Optional: run only some shards in this process, e.g. SHARD_COUNT=4 SHARD_IDS=0,1.
+# Left unset, one process runs every shard Discord recommends.
+SHARD_COUNT_STR = os.getenv('SHARD_COUNT', '')
+SHARD_COUNT = int(SHARD_COUNT_STR) if SHARD_COUNT_STR.isdigit() else None
+SHARD_IDS_STR = os.getenv('SHARD_IDS', '')
+SHARD_IDS = [int(s) for s in SHARD_IDS_STR.split(',') if s.strip().isdigit()] or None
 
 INITIAL_ELO = 1000
 K_FACTOR = 30
+# Rating system for this deployment: "elo" (default) or "glicko2".
+RATING_ENGINE_NAME = os.getenv('RATING_ENGINE', 'elo').strip().lower()
+# Glicko-2 settings. Ratings are recomputed in one batch at the end of each period.
+GLICKO2_INITIAL_RD = 350.0
+GLICKO2_INITIAL_VOLATILITY = 0.06
+GLICKO2_TAU = 0.5
+RATING_PERIOD_HOURS = 24
 REPORT_TIMEOUT_HOURS = 1
 # New constant for the challenge acceptance phase
 CHALLENGE_TIMEOUT_SECONDS = 240 # 4 minutes
+# /challenge throttling: a user can issue CHALLENGE_BURST challenges back to back,
+# then earns another one every CHALLENGE_REFILL_SECONDS.
+CHALLENGE_BURST = 3
+CHALLENGE_REFILL_SECONDS = 20
+# Tournaments: bracket size limits, and pairings announced per message (one select menu holds at most 25).
+TOURNAMENT_MIN_PLAYERS = 3
+TOURNAMENT_MAX_PLAYERS = 512
+TOURNAMENT_PAIRINGS_PER_MESSAGE = 20
 
 ADMIN_ROLE_NAME = "Administrador ELO"
 DATABASE_FILE = 'elo_bot.db'
+DB_BUSY_TIMEOUT_SECONDS = 5.0
+# Online backups: a gzipped, integrity-checked snapshot of the database is written
+# to BACKUP_DIR once the newest one is BACKUP_INTERVAL_HOURS old, and only the
+# newest BACKUP_KEEP are kept. BACKUP_INTERVAL_HOURS=0 disables scheduled backups.
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL_HOURS_STR = os.getenv('BACKUP_INTERVAL_HOURS', '6')
+BACKUP_INTERVAL_HOURS = int(BACKUP_INTERVAL_HOURS_STR) if BACKUP_INTERVAL_HOURS_STR.isdigit() else 6
+BACKUP_KEEP_STR = os.getenv('BACKUP_KEEP', '14')
+BACKUP_KEEP = max(int(BACKUP_KEEP_STR), 1) if BACKUP_KEEP_STR.isdigit() else 14
+# Pages copied per backup step, and the pause after each step that leaves the disk to live writes.
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE_SECONDS = 0.01
+# Inactivity decay: players who haven't finished a match in DECAY_AFTER_DAYS lose
+# DECAY_POINTS_PER_DAY a day, never going below DECAY_FLOOR. 0 disables decay.
+DECAY_AFTER_DAYS_STR = os.getenv('DECAY_AFTER_DAYS', '0')
+DECAY_AFTER_DAYS = int(DECAY_AFTER_DAYS_STR) if DECAY_AFTER_DAYS_STR.isdigit() else 0
+DECAY_POINTS_PER_DAY = 10
+DECAY_FLOOR = INITIAL_ELO
+# Seasons: every SEASON_LENGTH_DAYS the standings are archived and each rating keeps
+# SEASON_RATING_CARRYOVER of its distance from INITIAL_ELO. 0 leaves rollovers to /admin_new_season.
+SEASON_LENGTH_DAYS_STR = os.getenv('SEASON_LENGTH_DAYS', '0')
+SEASON_LENGTH_DAYS = int(SEASON_LENGTH_DAYS_STR) if SEASON_LENGTH_DAYS_STR.isdigit() else 0
+SEASON_RATING_CARRYOVER = 0.5
+# Decay and rollovers update this many players per transaction, and pause between transactions for live writes.
+MAINTENANCE_CHUNK_ROWS = 200
+MAINTENANCE_CHUNK_PAUSE_SECONDS = 0.01
+# Ratings are bucketed by whole ELO point in the in-memory rank index; anything
+# outside [0, RANK_INDEX_MAX_RATING] shares the nearest end bucket, ordered by exact rating within it.
+RANK_INDEX_MAX_RATING = 4000
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_CACHED_PAGES = 200
+# Rating history is stored in chunks of up to this many 6-byte points per player.
+RATING_HISTORY_CHUNK_POINTS = 256
+SPARKLINE_POINTS = 24
+# Matchmaking: queued players are paired when their rating gap fits inside both
+# players' windows. A window starts at MATCHMAKING_BASE_WINDOW and widens the
+# longer a player waits, up to MATCHMAKING_MAX_WINDOW.
+MATCHMAKING_BASE_WINDOW = 50
+MATCHMAKING_WINDOW_GROWTH_PER_MINUTE = 25
+MATCHMAKING_MAX_WINDOW = 400
+# Expired matches resolved against the database at once; Discord I/O is paced separately.
+CLEANUP_CONCURRENCY = 8
+DISCORD_MESSAGE_LIMIT = 2000
+# Prometheus-format metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; 0 disables the endpoint.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT_STR = os.getenv('METRICS_PORT', '0')
+METRICS_PORT = int(METRICS_PORT_STR) if METRICS_PORT_STR.isdigit() else 0
+# Discord drops interactions that are not acknowledged within this many seconds.
+INTERACTION_ACK_DEADLINE_SECONDS = 3.0
+# Slash commands are only pushed to Discord when their definitions change.
+# FORCE_COMMAND_SYNC=1 pushes them on startup regardless.
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '') == '1'
+# Opt-in event loop stall detector: a blocked loop is reported once it stalls for
+# longer than STALL_THRESHOLD_MS milliseconds. 0 disables the detector.
+STALL_THRESHOLD_MS_STR = os.getenv('STALL_THRESHOLD_MS', '0')
+STALL_THRESHOLD_MS = int(STALL_THRESHOLD_MS_STR) if STALL_THRESHOLD_MS_STR.isdigit() else 0
+LOOP_HEARTBEAT_SECONDS = 0.1
+# Lag samples kept for percentiles: 3000 heartbeats is about five minutes.
+LOOP_LAG_SAMPLES = 3000
+# Members that miss the gateway cache are kept this long before being re-fetched.
+MEMBER_CACHE_TTL_SECONDS = 600
+MEMBER_CACHE_MAX_SIZE = 5000
 
 # --- DATABASE MANAGEMENT MODULE ---
 # All functions now accept a `db_conn` object to reuse the single connection.
+# These helpers are blocking; the bot never calls them directly from a coroutine
+# but through `AsyncDatabase` below, which runs them on dedicated worker threads.
 
-def init_db(db_conn: sqlite3.Connection):
-    """Initializes the database and creates tables if they don't exist."""
-    print("Initializing database...")
-    c = db_conn.cursor()
+def open_connection(path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Opens a connection tuned for one writer plus concurrent readers (WAL mode)."""
+    # Shard processes share the file. Taking the write lock when a transaction
+    # begins makes a second writer wait out the busy timeout instead of failing
+    # halfway through its transaction.
+    db_conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_SECONDS, isolation_level="IMMEDIATE")
+    db_conn.row_factory = sqlite3.Row
+    db_conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL only fsyncs at checkpoints, which keeps commits cheap.
+    db_conn.execute("PRAGMA synchronous=NORMAL")
+    if read_only:
+        db_conn.execute("PRAGMA query_only=ON")
+    return db_conn
+
+# --- SCHEMA MIGRATIONS ---
+# Each step upgrades the schema by exactly one version and runs in its own
+# transaction. `schema_version` records what has been applied, so existing
+# `elo_bot.db` files are upgraded in place on startup. Never edit a released
+# step; append a new one instead.
+
+def _migration_initial_schema(c: sqlite3.Cursor):
+    """Version 1: the original tables, as created by earlier releases."""
     c.execute(f'''
         CREATE TABLE IF NOT EXISTS players (
             user_id TEXT PRIMARY KEY,
@@ -47,8 +171,6 @@ def init_db(db_conn: sqlite3.Connection):
             games_played INTEGER DEFAULT 0
         )
     ''')
-    # A new column `original_challenge_msg_id` has been added to handle
-    # the new two-step challenge process.
     c.execute('''
         CREATE TABLE IF NOT EXISTS matches (
             match_id TEXT PRIMARY KEY,
@@ -62,134 +184,3256 @@ def init_db(db_conn: sqlite3.Connection):
             status TEXT DEFAULT 'pending'
         )
     ''')
+
+def _migration_integer_ids(c: sqlite3.Cursor):
+    """Version 2: stores Discord IDs as INTEGER instead of TEXT."""
+    # SQLite can't change a column type in place, so both tables are rebuilt.
+    c.execute(f'''
+        CREATE TABLE players_new (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT NOT NULL,
+            elo_rating INTEGER DEFAULT {INITIAL_ELO},
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            games_played INTEGER DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        INSERT INTO players_new (user_id, user_name, elo_rating, wins, losses, games_played)
+        SELECT CAST(user_id AS INTEGER), user_name, elo_rating, wins, losses, games_played FROM players
+    ''')
+    c.execute('''
+        CREATE TABLE matches_new (
+            match_id TEXT PRIMARY KEY,
+            player1_id INTEGER NOT NULL,
+            player2_id INTEGER NOT NULL,
+            message_id INTEGER,
+            channel_id INTEGER,
+            timestamp INTEGER NOT NULL,
+            player1_report INTEGER,
+            player2_report INTEGER,
+            status TEXT DEFAULT 'pending'
+        )
+    ''')
+    c.execute('''
+        INSERT INTO matches_new (match_id, player1_id, player2_id, message_id, channel_id,
+                                 timestamp, player1_report, player2_report, status)
+        SELECT match_id, CAST(player1_id AS INTEGER), CAST(player2_id AS INTEGER),
+               CAST(message_id AS INTEGER), CAST(channel_id AS INTEGER),
+               timestamp, player1_report, player2_report, status
+        FROM matches
+    ''')
+    c.execute("DROP TABLE players")
+    c.execute("DROP TABLE matches")
+    c.execute("ALTER TABLE players_new RENAME TO players")
+    c.execute("ALTER TABLE matches_new RENAME TO matches")
+
+def _migration_query_indexes(c: sqlite3.Cursor):
+    """Version 3: indexes for the stale-match, pending-match and leaderboard queries."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_matches_status_timestamp ON matches (status, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_matches_player1_status ON matches (player1_id, status, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_matches_player2_status ON matches (player2_id, status, timestamp)")
+    # (elo_rating, user_id) gives the leaderboard a stable order it can walk backwards.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_players_elo ON players (elo_rating, user_id)")
+    c.execute("ANALYZE")
+
+def _migration_rating_ledger(c: sqlite3.Cursor):
+    """Version 4: records the winner of each match and an append-only ledger of rating changes."""
+    c.execute("ALTER TABLE matches ADD COLUMN winner_id INTEGER")
+    # Rating columns are NULL for history backfilled from before the ledger existed.
+    c.execute('''
+        CREATE TABLE rating_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            match_id TEXT,
+            timestamp INTEGER NOT NULL,
+            winner_id INTEGER NOT NULL,
+            loser_id INTEGER NOT NULL,
+            winner_before INTEGER,
+            loser_before INTEGER,
+            winner_after INTEGER,
+            loser_after INTEGER,
+            k_factor REAL
+        )
+    ''')
+    c.execute("CREATE INDEX idx_rating_ledger_match ON rating_ledger (match_id)")
+    for operation in ("UPDATE", "DELETE"):
+        c.execute(f'''
+            CREATE TRIGGER rating_ledger_no_{operation.lower()} BEFORE {operation} ON rating_ledger
+            BEGIN SELECT RAISE(ABORT, 'rating_ledger is append-only'); END
+        ''')
+    # Backfill confirmed matches whose winner follows from the reports. Matches an
+    # admin settled after conflicting or missing reports can't be recovered.
+    c.execute('''
+        INSERT INTO rating_ledger (match_id, timestamp, winner_id, loser_id)
+        SELECT match_id, timestamp,
+               CASE WHEN COALESCE(player1_report, 1 - player2_report) = 1 THEN player1_id ELSE player2_id END,
+               CASE WHEN COALESCE(player1_report, 1 - player2_report) = 1 THEN player2_id ELSE player1_id END
+        FROM matches
+        WHERE status = 'confirmed'
+          AND (player1_report IS NOT NULL OR player2_report IS NOT NULL)
+          AND (player1_report IS NULL OR player2_report IS NULL OR player1_report != player2_report)
+        ORDER BY timestamp
+    ''')
+    c.execute('''
+        UPDATE matches SET winner_id = (SELECT l.winner_id FROM rating_ledger l WHERE l.match_id = matches.match_id)
+        WHERE status = 'confirmed'
+    ''')
+
+def _migration_glicko2_state(c: sqlite3.Cursor):
+    """Version 5: per-player Glicko-2 state and the log of closed rating periods."""
+    # NULL until a player's first rating period; `elo_rating` stays the displayed rating.
+    c.execute("ALTER TABLE players ADD COLUMN glicko_rating REAL")
+    c.execute("ALTER TABLE players ADD COLUMN glicko_rd REAL")
+    c.execute("ALTER TABLE players ADD COLUMN glicko_volatility REAL")
+    # Each period covers the ledger entries after the previous period's last_entry_id.
+    c.execute('''
+        CREATE TABLE rating_periods (
+            period_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_entry_id INTEGER NOT NULL,
+            matches INTEGER NOT NULL,
+            engine TEXT NOT NULL,
+            closed_at INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_guild_partitioning(c: sqlite3.Cursor):
+    """Version 6: per-guild configuration, and players, matches and rating history keyed by guild."""
+    # Everything recorded so far belongs to the guild the bot was configured for.
+    legacy_guild = GUILD_ID
+    c.execute("SELECT COUNT(*) FROM players")
+    if c.fetchone()[0] and not legacy_guild:
+        print("Warning: GUILD_ID is not set; existing players and matches are assigned to guild 0.")
+
+    c.execute('''
+        CREATE TABLE guild_config (
+            guild_id INTEGER PRIMARY KEY,
+            elo_channel_id INTEGER,
+            admin_role_id INTEGER,
+            k_factor REAL
+        )
+    ''')
+    if legacy_guild:
+        c.execute("INSERT INTO guild_config (guild_id, elo_channel_id) VALUES (?, ?)", (legacy_guild, CHANNEL_ID or None))
+
+    # The players key becomes (guild_id, user_id), so the table is rebuilt.
+    c.execute(f'''
+        CREATE TABLE players_new (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT NOT NULL,
+            elo_rating INTEGER DEFAULT {INITIAL_ELO},
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            games_played INTEGER DEFAULT 0,
+            glicko_rating REAL,
+            glicko_rd REAL,
+            glicko_volatility REAL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    c.execute('''
+        INSERT INTO players_new (guild_id, user_id, user_name, elo_rating, wins, losses, games_played,
+                                 glicko_rating, glicko_rd, glicko_volatility)
+        SELECT ?, user_id, user_name, elo_rating, wins, losses, games_played, glicko_rating, glicko_rd, glicko_volatility
+        FROM players
+    ''', (legacy_guild,))
+    c.execute("DROP TABLE players")
+    c.execute("ALTER TABLE players_new RENAME TO players")
+    c.execute("CREATE INDEX idx_players_guild_elo ON players (guild_id, elo_rating, user_id)")
+
+    # Match IDs stay globally unique, so the other tables only gain a column. The
+    # default stamps existing rows without rewriting them (the ledger can't be updated).
+    for table in ("matches", "rating_ledger", "rating_periods"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN guild_id INTEGER NOT NULL DEFAULT {int(legacy_guild)}")
+    c.execute("DROP INDEX idx_matches_player1_status")
+    c.execute("DROP INDEX idx_matches_player2_status")
+    c.execute("CREATE INDEX idx_matches_guild_player1 ON matches (guild_id, player1_id, status, timestamp)")
+    c.execute("CREATE INDEX idx_matches_guild_player2 ON matches (guild_id, player2_id, status, timestamp)")
+    c.execute("CREATE INDEX idx_rating_ledger_guild ON rating_ledger (guild_id, entry_id)")
+    c.execute("ANALYZE")
+
+def _migration_head_to_head(c: sqlite3.Cursor):
+    """Version 7: per-pair win/loss aggregates, kept current as matches are confirmed."""
+    # One row per direction, so either player's record against the other is a key lookup.
+    c.execute('''
+        CREATE TABLE head_to_head (
+            guild_id INTEGER NOT NULL,
+            player_id INTEGER NOT NULL,
+            opponent_id INTEGER NOT NULL,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            last_played INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, player_id, opponent_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX idx_head_to_head_games ON head_to_head (guild_id, player_id, wins + losses)")
+    # The ledger holds every match with a known winner.
+    c.execute('''
+        INSERT INTO head_to_head (guild_id, player_id, opponent_id, wins, losses, last_played)
+        SELECT guild_id, player_id, opponent_id, SUM(won), SUM(1 - won), MAX(timestamp) FROM (
+            SELECT guild_id, winner_id AS player_id, loser_id AS opponent_id, 1 AS won, timestamp FROM rating_ledger
+            UNION ALL
+            SELECT guild_id, loser_id, winner_id, 0, timestamp FROM rating_ledger
+        )
+        GROUP BY guild_id, player_id, opponent_id
+    ''')
+
+def _migration_rating_history(c: sqlite3.Cursor):
+    """Version 8: packed per-player rating history (see RATING HISTORY)."""
+    # The data column goes last, so queries that only read the summaries skip its overflow pages.
+    c.execute('''
+        CREATE TABLE rating_history (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            chunk_start INTEGER NOT NULL,
+            last_timestamp INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            min_rating INTEGER NOT NULL,
+            max_rating INTEGER NOT NULL,
+            last_rating INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (guild_id, user_id, chunk_start)
+        ) WITHOUT ROWID
+    ''')
+    # Rebuild what the ledger knows. Glicko-2 period results and pre-ledger matches have no recorded ratings.
+    c.execute('''
+        SELECT guild_id, user_id, timestamp, rating FROM (
+            SELECT guild_id, winner_id AS user_id, timestamp, winner_after AS rating, entry_id FROM rating_ledger
+            WHERE winner_after IS NOT NULL
+            UNION ALL
+            SELECT guild_id, loser_id, timestamp, loser_after, entry_id FROM rating_ledger
+            WHERE loser_after IS NOT NULL
+        )
+        ORDER BY guild_id, user_id, entry_id
+    ''')
+    bulk_load_rating_history(c.connection, c.fetchall())
+
+def _migration_bot_state(c: sqlite3.Cursor):
+    """Version 9: key/value store for bot-wide bookkeeping such as the last synced command tree."""
+    c.execute("CREATE TABLE bot_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+def _migration_change_timestamps(c: sqlite3.Cursor):
+    """Version 10: when each player and match row last changed, for incremental exports."""
+    # Rows written before this version read as 0, so the first incremental export includes them.
+    for table in ("players", "matches"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0")
+        c.execute(f"CREATE INDEX idx_{table}_updated_at ON {table} (updated_at)")
+
+def _migration_tournaments(c: sqlite3.Cursor):
+    """Version 11: elimination tournaments, their entrants and the match behind each bracket slot."""
+    c.execute('''
+        CREATE TABLE tournaments (
+            tournament_id TEXT PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            format TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'signup',
+            current_round INTEGER NOT NULL DEFAULT 0,
+            champion_id INTEGER,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX idx_tournaments_guild_created ON tournaments (guild_id, created_at)")
+    c.execute("CREATE INDEX idx_tournaments_status ON tournaments (status)")
+    # Seeds are assigned from current ratings when the tournament starts.
+    c.execute('''
+        CREATE TABLE tournament_entries (
+            tournament_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at INTEGER NOT NULL,
+            seed INTEGER,
+            PRIMARY KEY (tournament_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Only slots that needed a real match are stored; results live on the match itself.
+    c.execute('''
+        CREATE TABLE tournament_matches (
+            tournament_id TEXT NOT NULL,
+            slot TEXT NOT NULL,
+            round INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            PRIMARY KEY (tournament_id, slot)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE UNIQUE INDEX idx_tournament_matches_match ON tournament_matches (match_id)")
+
+def _migration_seasons(c: sqlite3.Cursor):
+    """Version 12: last match time for inactivity decay, and seasons with their archived standings."""
+    c.execute("ALTER TABLE players ADD COLUMN last_match_at INTEGER")
+    c.execute("ALTER TABLE players ADD COLUMN decayed_at INTEGER")
+    # head_to_head has every ledgered match; players whose matches predate the ledger start their clock now.
+    c.execute('''
+        UPDATE players SET last_match_at = COALESCE(
+            (SELECT MAX(h.last_played) FROM head_to_head h WHERE h.guild_id = players.guild_id AND h.player_id = players.user_id),
+            CASE WHEN games_played > 0 THEN ? END)
+    ''', (int(time.time()),))
+    # One 'current' season per guild; 'rolling' while its standings are being archived, then 'archived'.
+    c.execute('''
+        CREATE TABLE seasons (
+            guild_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'current',
+            started_at INTEGER NOT NULL,
+            ended_at INTEGER,
+            archived_through INTEGER NOT NULL DEFAULT 0,
+            players INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, season)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE season_standings (
+            guild_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT NOT NULL,
+            elo_rating INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            games_played INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, season, user_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX idx_season_standings_elo ON season_standings (guild_id, season, elo_rating, user_id)")
+
+# Ordered list of (version, description, step). Versions must be consecutive.
+MIGRATIONS = [
+    (1, "initial schema", _migration_initial_schema),
+    (2, "integer discord ids", _migration_integer_ids),
+    (3, "query indexes", _migration_query_indexes),
+    (4, "rating ledger", _migration_rating_ledger),
+    (5, "glicko-2 state", _migration_glicko2_state),
+    (6, "per-guild partitioning", _migration_guild_partitioning),
+    (7, "head-to-head aggregates", _migration_head_to_head),
+    (8, "rating history", _migration_rating_history),
+    (9, "bot state", _migration_bot_state),
+    (10, "change timestamps", _migration_change_timestamps),
+    (11, "tournaments", _migration_tournaments),
+    (12, "seasons and decay", _migration_seasons),
+]
+
+def get_schema_version(db_conn: sqlite3.Connection) -> int:
+    """Returns the highest applied migration version, or 0 for a fresh database."""
+    c = db_conn.cursor()
+    c.execute("SELECT MAX(version) FROM schema_version")
+    return c.fetchone()[0] or 0
+
+def init_db(db_conn: sqlite3.Connection):
+    """Initializes the database by applying any pending schema migrations."""
+    print("Initializing database...")
+    c = db_conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    db_conn.commit()
+
+    current_version = get_schema_version(db_conn)
+    for version, description, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+        print(f"Applying migration {version}: {description}...")
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            step(c)
+            c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                      (version, description, int(time.time())))
+            db_conn.commit()
+        except sqlite3.Error:
+            db_conn.rollback()
+            print(f"Migration {version} failed; the database was left at version {current_version}.")
+            raise
+        current_version = version
+    print(f"Database initialized successfully (schema version {current_version}).")
+
+def get_bot_state(db_conn: sqlite3.Connection, key: str) -> Optional[str]:
+    """Gets a bot-wide bookkeeping value. Returns None if it was never set."""
+    c = db_conn.cursor()
+    c.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+def set_bot_state(db_conn: sqlite3.Connection, key: str, value: str):
+    """Creates or replaces a bot-wide bookkeeping value."""
+    c = db_conn.cursor()
+    c.execute("INSERT INTO bot_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+    db_conn.commit()
+
+def get_guild_config(db_conn: sqlite3.Connection, guild_id: int) -> Optional[sqlite3.Row]:
+    """Gets a guild's settings. Returns None if the guild was never configured."""
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM guild_config WHERE guild_id = ?", (guild_id,))
+    return c.fetchone()
+
+def set_guild_config(db_conn: sqlite3.Connection, guild_id: int, elo_channel_id: Optional[int],
+                     admin_role_id: Optional[int], k_factor: Optional[float]):
+    """Creates or replaces a guild's settings."""
+    c = db_conn.cursor()
+    c.execute('''
+        INSERT INTO guild_config (guild_id, elo_channel_id, admin_role_id, k_factor) VALUES (?, ?, ?, ?)
+        ON CONFLICT (guild_id) DO UPDATE SET elo_channel_id = excluded.elo_channel_id,
+            admin_role_id = excluded.admin_role_id, k_factor = excluded.k_factor
+    ''', (guild_id, elo_channel_id, admin_role_id, k_factor))
+    db_conn.commit()
+
+def get_player(db_conn: sqlite3.Connection, guild_id: int, user_id: int) -> Optional[sqlite3.Row]:
+    """Gets a player's data in one guild by their ID. Returns None if not found."""
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM players WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+    return c.fetchone()
+
+def add_player_if_not_exists(db_conn: sqlite3.Connection, guild_id: int, user_id: int, user_name: str) -> bool:
+    """Adds a player to a guild if they do not exist. Returns True if a row was inserted."""
+    c = db_conn.cursor()
+    c.execute("INSERT OR IGNORE INTO players (guild_id, user_id, user_name, elo_rating, updated_at) VALUES (?, ?, ?, ?, ?)",
+              (guild_id, user_id, user_name, INITIAL_ELO, int(time.time())))
+    db_conn.commit()
+    return c.rowcount == 1
+
+def get_all_ratings(db_conn: sqlite3.Connection) -> list:
+    """Gets (guild_id, user_id, elo_rating) for every player, used to build the rank indexes."""
+    c = db_conn.cursor()
+    c.execute("SELECT guild_id, user_id, elo_rating FROM players ORDER BY guild_id")
+    return c.fetchall()
+
+def create_match_record(db_conn: sqlite3.Connection, match_id: str, guild_id: int, p1_id: int, p2_id: int, msg_id: int, ch_id: int):
+    """Creates a new match record in the database."""
+    c = db_conn.cursor()
+    now = int(time.time())
+    c.execute("INSERT INTO matches (match_id, guild_id, player1_id, player2_id, message_id, channel_id, timestamp, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?)",
+              (match_id, guild_id, p1_id, p2_id, msg_id, ch_id, now, now))
+    db_conn.commit()
+
+def set_match_message(db_conn: sqlite3.Connection, match_id: str, msg_id: int):
+    """Records the message that carries a match's report buttons."""
+    c = db_conn.cursor()
+    c.execute("UPDATE matches SET message_id = ?, updated_at = ? WHERE match_id = ?", (msg_id, int(time.time()), match_id))
+    db_conn.commit()
+
+def get_match(db_conn: sqlite3.Connection, match_id: str) -> Optional[sqlite3.Row]:
+    """Gets match data by its ID."""
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM matches WHERE match_id = ?", (match_id,))
+    return c.fetchone()
+
+def update_match_report(db_conn: sqlite3.Connection, match_id: str, player_id: int, report_value: int):
+    """Updates a player's report for a specific match safely."""
+    match_data = get_match(db_conn, match_id)
+    if not match_data: return
+
+    c = db_conn.cursor()
+    # Use explicit queries to avoid any chance of SQL injection
+    if player_id == match_data['player1_id']:
+        c.execute("UPDATE matches SET player1_report = ?, updated_at = ? WHERE match_id = ? AND status = 'pending'",
+                  (report_value, int(time.time()), match_id))
+    elif player_id == match_data['player2_id']:
+        c.execute("UPDATE matches SET player2_report = ?, updated_at = ? WHERE match_id = ? AND status = 'pending'",
+                  (report_value, int(time.time()), match_id))
+    db_conn.commit()
+
+def update_match_status(db_conn: sqlite3.Connection, match_id: str, status: str,
+                        from_statuses: tuple[str, ...] = ('pending',)) -> bool:
+    """
+    Moves a match to `status` if it is still in one of `from_statuses`.
+    Returns False if another resolution got there first.
+    """
+    c = db_conn.cursor()
+    placeholders = ", ".join("?" * len(from_statuses))
+    c.execute(f"UPDATE matches SET status = ?, updated_at = ? WHERE match_id = ? AND status IN ({placeholders})",
+              (status, int(time.time()), match_id, *from_statuses))
     db_conn.commit()
-    print("Database initialized successfully.")
+    return c.rowcount == 1
+
+def get_leaderboard(db_conn: sqlite3.Connection, guild_id: int, limit: int = 10) -> list:
+    """Gets a guild's top players by ELO rating."""
+    c = db_conn.cursor()
+    c.execute("SELECT user_name, elo_rating, wins, losses FROM players WHERE guild_id = ? ORDER BY elo_rating DESC LIMIT ?",
+              (guild_id, limit))
+    return c.fetchall()
+
+def get_leaderboard_page(db_conn: sqlite3.Connection, guild_id: int, after: Optional[tuple[int, int]], limit: int) -> list:
+    """
+    Gets one page of a guild's leaderboard with keyset pagination. `after` is the
+    (elo_rating, user_id) of the last row on the previous page, or None for the first page.
+    """
+    c = db_conn.cursor()
+    if after is None:
+        c.execute('''
+            SELECT user_id, user_name, elo_rating, wins, losses FROM players
+            WHERE guild_id = ? ORDER BY elo_rating DESC, user_id DESC LIMIT ?
+        ''', (guild_id, limit))
+    else:
+        c.execute('''
+            SELECT user_id, user_name, elo_rating, wins, losses FROM players
+            WHERE guild_id = ? AND (elo_rating, user_id) < (?, ?)
+            ORDER BY elo_rating DESC, user_id DESC LIMIT ?
+        ''', (guild_id, after[0], after[1], limit))
+    return c.fetchall()
+
+def get_pending_matches_for_user(db_conn: sqlite3.Connection, guild_id: int, user_id: int) -> list:
+    """Gets all pending matches for a specific user in one guild."""
+    c = db_conn.cursor()
+    # Written as a UNION ALL so each branch uses its own (guild_id, playerN_id, status, timestamp) index.
+    c.execute("""
+        SELECT * FROM matches WHERE guild_id = ? AND player1_id = ? AND status = 'pending'
+        UNION ALL
+        SELECT * FROM matches WHERE guild_id = ? AND player2_id = ? AND status = 'pending'
+        ORDER BY timestamp DESC
+    """, (guild_id, user_id, guild_id, user_id))
+    return c.fetchall()
+
+def get_pending_match_timestamps(db_conn: sqlite3.Connection) -> list:
+    """Gets every pending match's ID, timestamp, guild and players, used to seed the expiry scheduler and challenge indexes."""
+    c = db_conn.cursor()
+    c.execute("SELECT match_id, timestamp, guild_id, player1_id, player2_id FROM matches WHERE status = 'pending'")
+    return c.fetchall()
+
+def get_stale_matches(db_conn: sqlite3.Connection) -> list:
+    """Gets matches that are pending and older than the timeout period."""
+    timeout_seconds = REPORT_TIMEOUT_HOURS * 3600
+    stale_time = int(time.time()) - timeout_seconds
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM matches WHERE status = 'pending' AND timestamp < ?", (stale_time,))
+    return c.fetchall()
+
+# --- ELO CALCULATION MODULE ---
+# The rating system is pluggable. Every engine keeps `players.elo_rating` as the
+# displayed rating. Per-match engines update it as each result is confirmed;
+# batched engines only record the result and move ratings when the rating
+# period closes (see `close_rating_period`).
+
+def calculate_expected_score(rating1: int, rating2: int) -> float:
+    """Calculates the expected score for player 1 against player 2."""
+    return 1.0 / (1.0 + math.pow(10, (rating2 - rating1) / 400.0))
+
+class RatingEngine:
+    """Interface for a rating system. Every engine can rate a single match and a whole period."""
+    name = ""
+    # True if ratings are updated once per rating period instead of per match.
+    batched = False
+    k_factor: Optional[float] = None
+
+    def rate_match(self, r_winner: int, r_loser: int) -> tuple[int, int]:
+        """Returns the new (winner, loser) ratings after one match."""
+        raise NotImplementedError
+
+    def for_guild(self, k_factor: Optional[float]) -> "RatingEngine":
+        """Returns the engine with a guild's K-factor override applied, if the engine uses one."""
+        return self
+
+    def rate_period(self, ratings: np.ndarray, rds: np.ndarray, volatilities: np.ndarray,
+                    players: np.ndarray, opponents: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Rates one period for every player at once. `players`, `opponents` and
+        `scores` describe each game from one player's side, as indexes into the
+        per-player arrays. Returns the new (ratings, rds, volatilities).
+        """
+        raise NotImplementedError
+
+class EloEngine(RatingEngine):
+    """Plain Elo with a fixed K-factor."""
+    name = "elo"
+
+    def __init__(self, k_factor: float = K_FACTOR):
+        self.k_factor = k_factor
+
+    def for_guild(self, k_factor: Optional[float]) -> "EloEngine":
+        return self if k_factor is None or k_factor == self.k_factor else EloEngine(k_factor)
+
+    def rate_match(self, r_winner: int, r_loser: int) -> tuple[int, int]:
+        e_winner = calculate_expected_score(r_winner, r_loser)
+        new_r_winner = r_winner + self.k_factor * (1.0 - e_winner)
+        new_r_loser = r_loser + self.k_factor * (0.0 - (1.0 - e_winner))
+        return round(new_r_winner), round(new_r_loser)
+
+    def rate_matches(self, r_winner: np.ndarray, r_loser: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized `rate_match` for many independent matches."""
+        e_winner = 1.0 / (1.0 + np.power(10.0, (r_loser - r_winner) / 400.0))
+        return np.round(r_winner + self.k_factor * (1.0 - e_winner)), np.round(r_loser - self.k_factor * (1.0 - e_winner))
+
+    def rate_period(self, ratings, rds, volatilities, players, opponents, scores):
+        """
+        Elo over a period: every game moves its player by K * (score - expected),
+        with expectations taken from the ratings at the start of the period.
+        Elo has no deviation or volatility, so those come back unchanged.
+        """
+        e_player = 1.0 / (1.0 + np.power(10.0, (ratings[opponents] - ratings[players]) / 400.0))
+        changes = np.bincount(players, weights=self.k_factor * (scores - e_player), minlength=len(ratings))
+        return ratings + changes, rds, volatilities
+
+class Glicko2Engine(RatingEngine):
+    """Glicko-2 (Glickman, 2013), rating every player of a period in one vectorized pass."""
+    name = "glicko2"
+    batched = True
+    SCALE = 173.7178
+    CONVERGENCE = 1e-6
+
+    def __init__(self, tau: float = GLICKO2_TAU, initial_rd: float = GLICKO2_INITIAL_RD):
+        self.tau = tau
+        self.initial_rd = initial_rd
+
+    def rate_match(self, r_winner: int, r_loser: int) -> tuple[int, int]:
+        """
+        Rates one match as its own one-game period. A single match carries no
+        Glicko-2 state, so both players start from the initial deviation and volatility.
+        """
+        ratings, _, _ = self.rate_period(np.array([r_winner, r_loser], dtype=float), np.full(2, self.initial_rd),
+                                         np.full(2, GLICKO2_INITIAL_VOLATILITY), np.array([0, 1]), np.array([1, 0]),
+                                         np.array([1.0, 0.0]))
+        return round(ratings[0]), round(ratings[1])
+
+    def rate_period(self, ratings, rds, volatilities, players, opponents, scores):
+        n = len(ratings)
+        mu = (ratings - 1500.0) / self.SCALE
+        phi = rds / self.SCALE
+
+        # Steps 3-4: estimated variance and improvement, summed per player with bincount.
+        g = 1.0 / np.sqrt(1.0 + 3.0 * phi[opponents] ** 2 / np.pi ** 2)
+        expected = 1.0 / (1.0 + np.exp(-g * (mu[players] - mu[opponents])))
+        inv_v = np.bincount(players, weights=g * g * expected * (1.0 - expected), minlength=n)
+        improvement = np.bincount(players, weights=g * (scores - expected), minlength=n)
+
+        # Step 5: new volatility, only for players who played this period.
+        new_volatilities = volatilities.astype(float).copy()
+        active = inv_v > 0
+        if active.any():
+            v = 1.0 / inv_v[active]
+            new_volatilities[active] = self._solve_volatility(phi[active], volatilities[active], v, v * improvement[active])
+
+        # Steps 6-8: players without games only see their deviation grow.
+        phi_star = np.sqrt(phi ** 2 + new_volatilities ** 2)
+        new_phi = phi_star.copy()
+        new_mu = mu.copy()
+        new_phi[active] = 1.0 / np.sqrt(1.0 / phi_star[active] ** 2 + inv_v[active])
+        new_mu[active] = mu[active] + new_phi[active] ** 2 * improvement[active]
+
+        return new_mu * self.SCALE + 1500.0, np.minimum(new_phi * self.SCALE, self.initial_rd), new_volatilities
+
+    def _solve_volatility(self, phi, sigma, v, delta):
+        """Runs the Illinois iteration from step 5 for all players in lockstep."""
+        tau = self.tau
+        a = np.log(sigma ** 2)
+
+        def f(x):
+            ex = np.exp(x)
+            return ex * (delta ** 2 - phi ** 2 - v - ex) / (2.0 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+        big_step = delta ** 2 > phi ** 2 + v
+        lower = np.where(big_step, np.log(np.maximum(delta ** 2 - phi ** 2 - v, 1e-300)), a - tau)
+        k = np.ones_like(a)
+        needs_step = ~big_step & (f(a - k * tau) < 0)
+        while needs_step.any():
+            k[needs_step] += 1
+            needs_step &= f(a - k * tau) < 0
+        B = np.where(big_step, lower, a - k * tau)
+        A = a.copy()
+        fA, fB = f(A), f(B)
+
+        unconverged = np.abs(B - A) > self.CONVERGENCE
+        while unconverged.any():
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            swap = fC * fB <= 0
+            A = np.where(unconverged & swap, B, A)
+            fA = np.where(unconverged, np.where(swap, fB, fA / 2.0), fA)
+            B = np.where(unconverged, C, B)
+            fB = np.where(unconverged, fC, fB)
+            unconverged &= np.abs(B - A) > self.CONVERGENCE
+        return np.exp(A / 2.0)
+
+RATING_ENGINES = {engine.name: engine for engine in (EloEngine, Glicko2Engine)}
+
+def create_rating_engine(name: str) -> RatingEngine:
+    """Builds the engine configured for this deployment."""
+    if name not in RATING_ENGINES:
+        raise ValueError(f"Unknown rating engine '{name}'. Choose one of: {', '.join(RATING_ENGINES)}.")
+    return RATING_ENGINES[name]()
+
+rating_engine = create_rating_engine(RATING_ENGINE_NAME)
+
+def apply_match_result(db_conn: sqlite3.Connection, guild_id: int, match_id: str, winner_id: int, loser_id: int,
+                       from_statuses: tuple[str, ...] = ('pending',)) -> Optional[tuple[Optional[int], Optional[int]]]:
+    """
+    Confirms a match and applies both players' rating changes inside the caller's
+    transaction; does not commit. The status change is a compare-and-set, so only
+    one caller can confirm a match. Returns None if the match was no longer in
+    one of `from_statuses`, or (None, None) if a player record is missing.
+    """
+    winner_data = get_player(db_conn, guild_id, winner_id)
+    loser_data = get_player(db_conn, guild_id, loser_id)
+    if not winner_data or not loser_data:
+        print(f"Error: Player data not found for {winner_id} or {loser_id} in guild {guild_id}.")
+        return None, None
+
+    now = int(time.time())
+    c = db_conn.cursor()
+    placeholders = ", ".join("?" * len(from_statuses))
+    c.execute(f"UPDATE matches SET status = 'confirmed', winner_id = ?, updated_at = ? WHERE match_id = ? AND guild_id = ? AND status IN ({placeholders})",
+              (winner_id, now, match_id, guild_id, *from_statuses))
+    if c.rowcount != 1:
+        return None
+
+    config = get_guild_config(db_conn, guild_id)
+    engine = rating_engine.for_guild(config['k_factor'] if config else None)
+    r_winner, r_loser = winner_data['elo_rating'], loser_data['elo_rating']
+    if engine.batched:
+        # Ratings move when the rating period closes; only the record changes now.
+        new_r_winner, new_r_loser = r_winner, r_loser
+        winner_after, loser_after = None, None
+    else:
+        new_r_winner, new_r_loser = engine.rate_match(r_winner, r_loser)
+        winner_after, loser_after = new_r_winner, new_r_loser
+
+    c.execute("UPDATE players SET elo_rating = ?, wins = wins + 1, games_played = games_played + 1, last_match_at = ?, updated_at = ? WHERE guild_id = ? AND user_id = ?",
+              (new_r_winner, now, now, guild_id, winner_id))
+    c.execute("UPDATE players SET elo_rating = ?, losses = losses + 1, games_played = games_played + 1, last_match_at = ?, updated_at = ? WHERE guild_id = ? AND user_id = ?",
+              (new_r_loser, now, now, guild_id, loser_id))
+    c.executemany('''
+        INSERT INTO head_to_head (guild_id, player_id, opponent_id, wins, losses, last_played) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (guild_id, player_id, opponent_id) DO UPDATE SET
+            wins = wins + excluded.wins, losses = losses + excluded.losses, last_played = excluded.last_played
+    ''', [(guild_id, winner_id, loser_id, 1, 0, now), (guild_id, loser_id, winner_id, 0, 1, now)])
+    if not engine.batched:
+        append_rating_history(db_conn, guild_id, [(winner_id, now, new_r_winner), (loser_id, now, new_r_loser)])
+    c.execute('''
+        INSERT INTO rating_ledger (guild_id, match_id, timestamp, winner_id, loser_id, winner_before, loser_before,
+                                   winner_after, loser_after, k_factor)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (guild_id, match_id, now, winner_id, loser_id, r_winner, r_loser, winner_after, loser_after, engine.k_factor))
+    return new_r_winner, new_r_loser
+
+def finalize_match_results(db_conn: sqlite3.Connection, results: list[tuple]) -> list:
+    """
+    Applies a batch of `apply_match_result` argument tuples in one transaction
+    (group commit). Each result runs under its own savepoint, so one failure only
+    rolls back that match. Returns one outcome per result: its return value or the exception.
+    """
+    c = db_conn.cursor()
+    outcomes = []
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        for args in results:
+            c.execute("SAVEPOINT finalize_match")
+            try:
+                outcomes.append(apply_match_result(db_conn, *args))
+            except sqlite3.Error as e:
+                c.execute("ROLLBACK TO finalize_match")
+                outcomes.append(e)
+            c.execute("RELEASE finalize_match")
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return outcomes
+
+def get_last_rating_period_close(db_conn: sqlite3.Connection, engine: RatingEngine, guild_id: int) -> int:
+    """
+    Gets when a guild's last rating period was closed. The first time a batched
+    engine runs for a guild, it opens its first period at the end of the current
+    ledger, because earlier results are already reflected in the players' ratings.
+    """
+    c = db_conn.cursor()
+    c.execute("SELECT MAX(closed_at) FROM rating_periods WHERE guild_id = ?", (guild_id,))
+    last_closed = c.fetchone()[0]
+    if last_closed is None:
+        last_closed = int(time.time())
+        c.execute('''
+            INSERT INTO rating_periods (guild_id, last_entry_id, matches, engine, closed_at)
+            SELECT ?, COALESCE(MAX(entry_id), 0), 0, ?, ? FROM rating_ledger WHERE guild_id = ?
+        ''', (guild_id, engine.name, last_closed, guild_id))
+        db_conn.commit()
+    return last_closed
+
+def close_rating_period(db_conn: sqlite3.Connection, engine: RatingEngine, guild_id: int) -> list[tuple[int, int]]:
+    """
+    Rates every ledger entry of a guild since its previous period in one batch and
+    stores the new ratings. Returns (user_id, rating) for players whose displayed rating changed.
+    """
+    c = db_conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT COALESCE(MAX(last_entry_id), 0) FROM rating_periods WHERE guild_id = ?", (guild_id,))
+        last_entry_id = c.fetchone()[0]
+        c.execute("SELECT entry_id, winner_id, loser_id FROM rating_ledger WHERE guild_id = ? AND entry_id > ? ORDER BY entry_id",
+                  (guild_id, last_entry_id))
+        games = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 3)
+        c.execute('''
+            SELECT user_id, elo_rating, COALESCE(glicko_rating, elo_rating), COALESCE(glicko_rd, ?), COALESCE(glicko_volatility, ?)
+            FROM players WHERE guild_id = ? ORDER BY user_id
+        ''', (GLICKO2_INITIAL_RD, GLICKO2_INITIAL_VOLATILITY, guild_id))
+        state = c.fetchall()
+        if not state:
+            db_conn.rollback()
+            return []
+        user_ids = np.array([row[0] for row in state], dtype=np.int64)
+        displayed = np.array([row[1] for row in state], dtype=np.int64)
+        ratings, rds, volatilities = (np.array([row[i] for row in state], dtype=float) for i in (2, 3, 4))
+
+        # Each match is one game from the winner's side and one from the loser's.
+        winners = np.searchsorted(user_ids, games[:, 1])
+        losers = np.searchsorted(user_ids, games[:, 2])
+        players = np.concatenate([winners, losers])
+        opponents = np.concatenate([losers, winners])
+        scores = np.concatenate([np.ones(len(games)), np.zeros(len(games))])
+        new_ratings, new_rds, new_volatilities = engine.rate_period(ratings, rds, volatilities, players, opponents, scores)
+        new_displayed = np.round(new_ratings).astype(np.int64)
+
+        closed_at = int(time.time())
+        c.executemany(
+            "UPDATE players SET elo_rating = ?, glicko_rating = ?, glicko_rd = ?, glicko_volatility = ?, updated_at = ? WHERE guild_id = ? AND user_id = ?",
+            zip(new_displayed.tolist(), new_ratings.tolist(), new_rds.tolist(), new_volatilities.tolist(),
+                [closed_at] * len(user_ids), [guild_id] * len(user_ids), user_ids.tolist())
+        )
+        c.execute("INSERT INTO rating_periods (guild_id, last_entry_id, matches, engine, closed_at) VALUES (?, ?, ?, ?, ?)",
+                  (guild_id, int(games[-1, 0]) if len(games) else last_entry_id, len(games), engine.name, closed_at))
+        changed = new_displayed != displayed
+        changed_ratings = list(zip(user_ids[changed].tolist(), new_displayed[changed].tolist()))
+        append_rating_history(db_conn, guild_id, [(user_id, closed_at, rating) for user_id, rating in changed_ratings])
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return changed_ratings
+
+# --- RATING REPLAY ENGINE ---
+# Recomputes every Elo rating from the ledger without touching the live tables.
+# Elo is sequential per player, but matches that share no player are
+# independent. Each match is therefore assigned to the first "wave" after the
+# previous matches of both its players, and each wave is applied as a single
+# vectorized NumPy update. The result is identical to replaying one match at a
+# time, including the per-match rounding the live code does.
+
+def load_ledger_outcomes(db_conn: sqlite3.Connection, guild_id: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Gets (winner_ids, loser_ids, last entry_id) for every ledger entry of a guild,
+    in the order they were recorded. The last entry_id is 0 for an empty ledger.
+    """
+    c = db_conn.cursor()
+    c.execute("SELECT entry_id, winner_id, loser_id FROM rating_ledger WHERE guild_id = ? ORDER BY entry_id", (guild_id,))
+    outcomes = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 3)
+    return outcomes[:, 1], outcomes[:, 2], int(outcomes[-1, 0]) if len(outcomes) else 0
+
+def replay_ratings(winner_ids: np.ndarray, loser_ids: np.ndarray, k_factor: float = K_FACTOR,
+                   initial_elo: int = INITIAL_ELO) -> dict[str, np.ndarray]:
+    """
+    Replays match outcomes from scratch and returns parallel arrays
+    `user_ids`, `ratings`, `wins` and `losses`.
+    """
+    user_ids, player_index = np.unique(np.concatenate([winner_ids, loser_ids]), return_inverse=True)
+    num_matches = len(winner_ids)
+    winners, losers = player_index[:num_matches], player_index[num_matches:]
+
+    # Wave assignment is the only sequential step; it is plain integer bookkeeping.
+    last_wave = [0] * len(user_ids)
+    waves = np.empty(num_matches, dtype=np.int64)
+    for i, (w, l) in enumerate(zip(winners.tolist(), losers.tolist())):
+        wave = max(last_wave[w], last_wave[l]) + 1
+        last_wave[w] = last_wave[l] = wave
+        waves[i] = wave
+
+    order = np.argsort(waves, kind="stable")
+    winners, losers, waves = winners[order], losers[order], waves[order]
+    bounds = np.flatnonzero(np.diff(waves)) + 1
+
+    engine = EloEngine(k_factor)
+    ratings = np.full(len(user_ids), float(initial_elo))
+    for wave_winners, wave_losers in zip(np.split(winners, bounds), np.split(losers, bounds)):
+        ratings[wave_winners], ratings[wave_losers] = engine.rate_matches(ratings[wave_winners], ratings[wave_losers])
+
+    return {
+        "user_ids": user_ids,
+        "ratings": ratings.astype(np.int64),
+        "wins": np.bincount(winners, minlength=len(user_ids)),
+        "losses": np.bincount(losers, minlength=len(user_ids)),
+    }
+
+def replay_ratings_from_ledger(db_conn: sqlite3.Connection, guild_id: int, k_factor: float = K_FACTOR,
+                               initial_elo: int = INITIAL_ELO) -> dict[str, Any]:
+    """
+    Loads a guild's ledger and replays it. Adds `matches`, `seconds` and
+    `last_entry_id` (the newest ledger entry the replay includes) to the result.
+    """
+    started = time.perf_counter()
+    winner_ids, loser_ids, last_entry_id = load_ledger_outcomes(db_conn, guild_id)
+    result = replay_ratings(winner_ids, loser_ids, k_factor, initial_elo)
+    result["matches"] = len(winner_ids)
+    result["last_entry_id"] = last_entry_id
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+def count_unledgered_matches(db_conn: sqlite3.Connection, guild_id: int) -> int:
+    """Counts a guild's confirmed matches missing from the ledger (legacy matches whose outcome was unknown)."""
+    c = db_conn.cursor()
+    c.execute('''
+        SELECT COUNT(*) FROM matches m
+        WHERE m.guild_id = ? AND m.status = 'confirmed'
+          AND NOT EXISTS (SELECT 1 FROM rating_ledger l WHERE l.match_id = m.match_id)
+    ''', (guild_id,))
+    return c.fetchone()[0]
+
+def apply_replayed_ratings(db_conn: sqlite3.Connection, guild_id: int, last_entry_id: int, user_ids: list[int],
+                           ratings: list[int], wins: list[int], losses: list[int]) -> bool:
+    """
+    Overwrites a guild's live ratings and records with replayed values in one
+    transaction. The replay was read from a snapshot, so it is only applied if
+    the ledger still ends at `last_entry_id`; a match confirmed in between would
+    otherwise be overwritten. Returns False if the ledger has moved on.
+    """
+    c = db_conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT COALESCE(MAX(entry_id), 0) FROM rating_ledger WHERE guild_id = ?", (guild_id,))
+        if c.fetchone()[0] != last_entry_id:
+            db_conn.rollback()
+            return False
+        c.execute("SELECT user_id, elo_rating FROM players WHERE guild_id = ?", (guild_id,))
+        live = {row['user_id']: row['elo_rating'] for row in c.fetchall()}
+        now = int(time.time())
+        append_rating_history(db_conn, guild_id, [(u, now, r) for u, r in zip(user_ids, ratings) if live.get(u) != r])
+        c.executemany(
+            "UPDATE players SET elo_rating = ?, wins = ?, losses = ?, games_played = ?, updated_at = ? WHERE guild_id = ? AND user_id = ?",
+            [(r, w, l, w + l, now, guild_id, u) for u, r, w, l in zip(user_ids, ratings, wins, losses)]
+        )
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return True
+
+def get_player_names(db_conn: sqlite3.Connection, guild_id: int, user_ids: list[int]) -> dict[int, str]:
+    """Gets display names for a handful of a guild's players by ID."""
+    if not user_ids:
+        return {}
+    c = db_conn.cursor()
+    placeholders = ",".join("?" * len(user_ids))
+    c.execute(f"SELECT user_id, user_name FROM players WHERE guild_id = ? AND user_id IN ({placeholders})", [guild_id, *user_ids])
+    return {row['user_id']: row['user_name'] for row in c.fetchall()}
+
+def get_head_to_head(db_conn: sqlite3.Connection, guild_id: int, player_id: int, opponent_id: int) -> Optional[sqlite3.Row]:
+    """Gets one player's wins, losses and last match against another. Returns None if they never played."""
+    c = db_conn.cursor()
+    c.execute("SELECT wins, losses, last_played FROM head_to_head WHERE guild_id = ? AND player_id = ? AND opponent_id = ?",
+              (guild_id, player_id, opponent_id))
+    return c.fetchone()
+
+def get_top_opponents(db_conn: sqlite3.Connection, guild_id: int, player_id: int, limit: int = 3) -> list:
+    """Gets a player's most played opponents with their record against each."""
+    c = db_conn.cursor()
+    c.execute('''
+        SELECT h.opponent_id, p.user_name, h.wins, h.losses FROM head_to_head h
+        LEFT JOIN players p ON p.guild_id = h.guild_id AND p.user_id = h.opponent_id
+        WHERE h.guild_id = ? AND h.player_id = ?
+        ORDER BY h.wins + h.losses DESC LIMIT ?
+    ''', (guild_id, player_id, limit))
+    return c.fetchall()
+
+# --- RATING HISTORY ---
+# Every displayed rating change is appended to `rating_history`. A player's
+# points are packed into chunks of RATING_HISTORY_CHUNK_POINTS, each point a
+# uint32 offset in seconds from the chunk start plus an int16 rating (6 bytes).
+# Every chunk row also carries its min, max and last rating, so long ranges are
+# downsampled from those summaries and only short ranges decode point data. A
+# long range is sampled with one index seek per output point, so either way a
+# query touches at most `max_points` chunks, however long the history.
+
+RATING_POINT = np.dtype([('offset', '<u4'), ('rating', '<i2')])
+
+def _pack_rating_points(chunk_start: int, timestamps: np.ndarray, ratings: np.ndarray) -> bytes:
+    points = np.empty(len(timestamps), dtype=RATING_POINT)
+    points['offset'] = np.maximum(timestamps - chunk_start, 0)
+    points['rating'] = np.clip(ratings, -32768, 32767)
+    return points.tobytes()
+
+def append_rating_history(db_conn: sqlite3.Connection, guild_id: int, points: list[tuple[int, int, int]]):
+    """Appends (user_id, timestamp, rating) points inside the caller's transaction."""
+    if not points:
+        return
+    c = db_conn.cursor()
+    # Each player's newest chunk, looked up for the whole batch at once.
+    user_ids = list(dict.fromkeys(user_id for user_id, _, _ in points))
+    chunks: dict[int, dict] = {}
+    for start in range(0, len(user_ids), 500):
+        batch = user_ids[start:start + 500]
+        c.execute(f'''
+            SELECT user_id, chunk_start, points, min_rating, max_rating, data FROM rating_history h
+            WHERE guild_id = ? AND user_id IN ({", ".join("?" * len(batch))})
+              AND chunk_start = (SELECT MAX(chunk_start) FROM rating_history WHERE guild_id = h.guild_id AND user_id = h.user_id)
+        ''', (guild_id, *batch))
+        for row in c.fetchall():
+            chunks[row['user_id']] = {"start": row['chunk_start'], "points": row['points'], "min": row['min_rating'],
+                                      "max": row['max_rating'], "data": [row['data']], "new": False, "changed": False}
+
+    # Place every point in its chunk, starting a new chunk when the newest is full.
+    offsets, ratings, placed = [], [], []
+    for user_id, timestamp, rating in points:
+        chunk = chunks.get(user_id)
+        if chunk is None or chunk['points'] >= RATING_HISTORY_CHUNK_POINTS:
+            # Chunk starts are unique per player even when a chunk fills up within one second.
+            chunk_start = timestamp if chunk is None else max(timestamp, chunk['start'] + 1)
+            if chunk is not None and chunk['changed']:
+                placed.append(dict(chunk, user_id=user_id))
+            chunk = chunks[user_id] = {"start": chunk_start, "points": 0, "min": rating, "max": rating,
+                                       "data": [], "new": True, "changed": True}
+        offsets.append(timestamp - chunk['start'])
+        ratings.append(rating)
+        chunk['data'].append(len(offsets) - 1)
+        chunk.update(points=chunk['points'] + 1, min=min(chunk['min'], rating), max=max(chunk['max'], rating),
+                     last_timestamp=timestamp, last_rating=rating, changed=True)
+    placed += [dict(chunk, user_id=user_id) for user_id, chunk in chunks.items() if chunk['changed']]
+
+    # All new points are packed in one go, then sliced back out per chunk.
+    packed = _pack_rating_points(0, np.array(offsets, dtype=np.int64), np.array(ratings, dtype=np.int64))
+    size = RATING_POINT.itemsize
+    for chunk in placed:
+        chunk['blob'] = b"".join(part if isinstance(part, bytes) else packed[part * size:(part + 1) * size] for part in chunk['data'])
+    c.executemany('''
+        INSERT INTO rating_history (guild_id, user_id, chunk_start, last_timestamp, points,
+                                    min_rating, max_rating, last_rating, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(guild_id, ch['user_id'], ch['start'], ch['last_timestamp'], ch['points'], ch['min'], ch['max'], ch['last_rating'], ch['blob'])
+          for ch in placed if ch['new']])
+    c.executemany('''
+        UPDATE rating_history SET data = ?, points = ?, last_timestamp = ?, last_rating = ?, min_rating = ?, max_rating = ?
+        WHERE guild_id = ? AND user_id = ? AND chunk_start = ?
+    ''', [(ch['blob'], ch['points'], ch['last_timestamp'], ch['last_rating'], ch['min'], ch['max'], guild_id, ch['user_id'], ch['start'])
+          for ch in placed if not ch['new']])
+
+def bulk_load_rating_history(db_conn: sqlite3.Connection, rows):
+    """
+    Writes history from (guild_id, user_id, timestamp, rating) rows sorted by
+    guild, player and time, inside the caller's transaction. Used for backfills.
+    """
+    c = db_conn.cursor()
+    for (guild_id, user_id), series in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+        series = np.array([(row[2], row[3]) for row in series], dtype=np.int64)
+        chunk_start = None
+        for start in range(0, len(series), RATING_HISTORY_CHUNK_POINTS):
+            chunk = series[start:start + RATING_HISTORY_CHUNK_POINTS]
+            timestamps, ratings = chunk[:, 0], chunk[:, 1]
+            chunk_start = int(timestamps[0]) if chunk_start is None else max(int(timestamps[0]), chunk_start + 1)
+            c.execute('''
+                INSERT INTO rating_history (guild_id, user_id, chunk_start, last_timestamp, points,
+                                            min_rating, max_rating, last_rating, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (guild_id, user_id, chunk_start, int(timestamps[-1]), len(chunk), int(ratings.min()),
+                  int(ratings.max()), int(ratings[-1]), _pack_rating_points(chunk_start, timestamps, ratings)))
+
+def downsample_lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: returns the indices of `threshold` points
+    that keep the visual shape of the series, always including both ends.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:threshold])
+    x, y = x.astype(float), y.astype(float)
+    # The interior points are split into threshold - 2 buckets.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        ax, ay = x[selected[-1]], y[selected[-1]]
+        # Keep the point forming the largest triangle with the last kept point and the next bucket's average.
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        selected.append(lo + int(area.argmax()))
+    selected.append(n - 1)
+    return np.array(selected)
+
+def get_rating_history(db_conn: sqlite3.Connection, guild_id: int, user_id: int, since: int = 0,
+                       max_points: int = SPARKLINE_POINTS) -> list[tuple[int, int]]:
+    """Gets a player's (timestamp, rating) history since `since`, downsampled to at most `max_points` points."""
+    c = db_conn.cursor()
+    # The range starts at the chunk holding `since` and ends at the newest chunk.
+    c.execute('''
+        SELECT COALESCE((SELECT MAX(chunk_start) FROM rating_history WHERE guild_id = ? AND user_id = ? AND chunk_start <= ?),
+                        (SELECT MIN(chunk_start) FROM rating_history WHERE guild_id = ? AND user_id = ?)),
+               (SELECT MAX(chunk_start) FROM rating_history WHERE guild_id = ? AND user_id = ?)
+    ''', (guild_id, user_id, since, guild_id, user_id, guild_id, user_id))
+    first, last = c.fetchone()
+    if first is None:
+        return []
+    c.execute("SELECT COUNT(*) FROM (SELECT 1 FROM rating_history WHERE guild_id = ? AND user_id = ? AND chunk_start >= ? LIMIT ?)",
+              (guild_id, user_id, first, max_points))
+    if c.fetchone()[0] >= max_points:
+        # Enough chunks to fill every point: take the closing rating of the chunk
+        # under each of `max_points` evenly spaced times, one index seek apiece.
+        c.execute('''
+            WITH RECURSIVE steps(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM steps WHERE i + 1 < ?)
+            SELECT DISTINCT h.last_timestamp, h.last_rating FROM steps
+            JOIN rating_history h ON h.guild_id = ? AND h.user_id = ? AND h.chunk_start = (
+                SELECT MAX(chunk_start) FROM rating_history
+                WHERE guild_id = ? AND user_id = ? AND chunk_start <= ? + (? - ?) * i / ?)
+            ORDER BY h.last_timestamp
+        ''', (max_points, guild_id, user_id, guild_id, user_id, first, last, first, max(max_points - 1, 1)))
+        rows = c.fetchall()
+        x = np.array([row['last_timestamp'] for row in rows], dtype=np.int64)
+        y = np.array([row['last_rating'] for row in rows], dtype=np.int64)
+    else:
+        c.execute("SELECT chunk_start, data FROM rating_history WHERE guild_id = ? AND user_id = ? AND chunk_start >= ? ORDER BY chunk_start",
+                  (guild_id, user_id, first))
+        decoded = [(row['chunk_start'], np.frombuffer(row['data'], dtype=RATING_POINT)) for row in c.fetchall()]
+        x = np.concatenate([start + points['offset'].astype(np.int64) for start, points in decoded])
+        y = np.concatenate([points['rating'].astype(np.int64) for _, points in decoded])
+    keep = x >= since
+    x, y = x[keep], y[keep]
+    indices = downsample_lttb(x, y, max_points)
+    return list(zip(x[indices].tolist(), y[indices].tolist()))
+
+def get_peak_rating(db_conn: sqlite3.Connection, guild_id: int, user_id: int) -> Optional[int]:
+    """Gets a player's highest recorded rating from the chunk summaries. Returns None without history."""
+    c = db_conn.cursor()
+    c.execute("SELECT MAX(max_rating) FROM rating_history WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+    return c.fetchone()[0]
+
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values: list[int]) -> str:
+    """Renders values as a one-line bar chart."""
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return SPARKLINE_BLOCKS[3] * len(values)
+    return "".join(SPARKLINE_BLOCKS[round((v - lo) / (hi - lo) * (len(SPARKLINE_BLOCKS) - 1))] for v in values)
+
+def count_matches_by_status(db_conn: sqlite3.Connection) -> dict[str, int]:
+    """Counts matches per status, for the metrics endpoint."""
+    c = db_conn.cursor()
+    c.execute("SELECT status, COUNT(*) FROM matches GROUP BY status")
+    return dict(c.fetchall())
+
+# --- SEASONS AND DECAY ---
+# Inactivity decay and season rollovers rewrite many players at once. Each is
+# done in chunks of MAINTENANCE_CHUNK_ROWS consecutive players by user_id: one
+# transaction per chunk, with the chunk's changes made by a single UPDATE over
+# its key range. A chunk never touches more rows than that, whatever the guild's
+# size, so a match result queued behind it waits a few milliseconds at most.
+
+def _next_chunk_end(c: sqlite3.Cursor, guild_id: int, after: int, size: int) -> Optional[int]:
+    """The user_id that ends the next chunk of `size` players after `after`, or None if there are none left."""
+    c.execute("SELECT MAX(user_id) FROM (SELECT user_id FROM players WHERE guild_id = ? AND user_id > ? ORDER BY user_id LIMIT ?)",
+              (guild_id, after, size))
+    return c.fetchone()[0]
+
+def _ratings_in_range(c: sqlite3.Cursor, guild_id: int, after: int, last: int, condition: str = "1", params: tuple = ()) -> dict[int, int]:
+    c.execute(f"SELECT user_id, elo_rating FROM players WHERE guild_id = ? AND user_id > ? AND user_id <= ? AND {condition}",
+              (guild_id, after, last, *params))
+    return dict(c.fetchall())
+
+def decay_ratings_chunk(db_conn: sqlite3.Connection, guild_id: int, after: int, now: int) -> tuple[Optional[int], list[tuple[int, int]]]:
+    """
+    Decays the players in the next chunk after user_id `after` who have not
+    finished a match in DECAY_AFTER_DAYS and were not decayed in the last day.
+    Returns (the chunk's last user_id or None when done, [(user_id, new rating)]).
+    """
+    c = db_conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        last = _next_chunk_end(c, guild_id, after, MAINTENANCE_CHUNK_ROWS)
+        if last is None:
+            db_conn.rollback()
+            return None, []
+        condition = "last_match_at < ? AND elo_rating > ? AND COALESCE(decayed_at, 0) <= ?"
+        params = (now - DECAY_AFTER_DAYS * 86400, DECAY_FLOOR, now - 86400)
+        decayed = _ratings_in_range(c, guild_id, after, last, condition, params)
+        if decayed:
+            # The Glicko-2 rating drops by the same amount, so the next rating period doesn't undo the decay.
+            c.execute(f'''
+                UPDATE players SET elo_rating = MAX(?, elo_rating - ?),
+                    glicko_rating = glicko_rating - (elo_rating - MAX(?, elo_rating - ?)),
+                    decayed_at = ?, updated_at = ?
+                WHERE guild_id = ? AND user_id > ? AND user_id <= ? AND {condition}
+            ''', (DECAY_FLOOR, DECAY_POINTS_PER_DAY, DECAY_FLOOR, DECAY_POINTS_PER_DAY, now, now,
+                  guild_id, after, last, *params))
+            ratings = _ratings_in_range(c, guild_id, after, last)
+            decayed = {user_id: ratings[user_id] for user_id in decayed}
+            append_rating_history(db_conn, guild_id, [(user_id, now, rating) for user_id, rating in decayed.items()])
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return last, list(decayed.items())
+
+def get_current_season(db_conn: sqlite3.Connection, guild_id: int) -> sqlite3.Row:
+    """Gets a guild's current season. The first call for a guild starts season 1 now."""
+    c = db_conn.cursor()
+    c.execute("INSERT INTO seasons (guild_id, season, started_at) SELECT ?, 1, ? WHERE NOT EXISTS (SELECT 1 FROM seasons WHERE guild_id = ?)",
+              (guild_id, int(time.time()), guild_id))
+    c.execute("SELECT * FROM seasons WHERE guild_id = ? AND status = 'current'", (guild_id,))
+    season = c.fetchone()
+    db_conn.commit()
+    return season
+
+def get_rolling_season(db_conn: sqlite3.Connection, guild_id: int) -> Optional[int]:
+    """Gets the season whose rollover was started but not finished, e.g. before a restart."""
+    c = db_conn.cursor()
+    c.execute("SELECT season FROM seasons WHERE guild_id = ? AND status = 'rolling'", (guild_id,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+def begin_season_rollover(db_conn: sqlite3.Connection, guild_id: int, now: int) -> int:
+    """
+    Ends the current season and starts the next one. Returns the season to
+    archive, which is the unfinished one if a rollover was already under way.
+    """
+    c = db_conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT season, status FROM seasons WHERE guild_id = ? AND status IN ('current', 'rolling')", (guild_id,))
+        seasons = {row['status']: row['season'] for row in c.fetchall()}
+        if 'rolling' in seasons:
+            db_conn.rollback()
+            return seasons['rolling']
+        season = seasons.get('current')
+        if season is None:
+            season = 1
+            c.execute("INSERT INTO seasons (guild_id, season, status, started_at, ended_at) VALUES (?, 1, 'rolling', ?, ?)",
+                      (guild_id, now, now))
+        else:
+            c.execute("UPDATE seasons SET status = 'rolling', ended_at = ? WHERE guild_id = ? AND season = ?", (now, guild_id, season))
+        c.execute("INSERT INTO seasons (guild_id, season, started_at) VALUES (?, ?, ?)", (guild_id, season + 1, now))
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return season
+
+def roll_over_season_chunk(db_conn: sqlite3.Connection, guild_id: int, season: int, now: int) -> tuple[bool, list[tuple[int, int]]]:
+    """
+    Archives the next chunk of a rolling season's standings and soft-resets the
+    same players: each rating keeps SEASON_RATING_CARRYOVER of its distance
+    from INITIAL_ELO, records start over, and the Glicko-2 deviation and
+    volatility go back to their defaults so the new season's games move the
+    carried-over rating as much as a newcomer's. Returns (whether the rollover is
+    finished, [(user_id, new rating)]).
+    """
+    c = db_conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT archived_through FROM seasons WHERE guild_id = ? AND season = ? AND status = 'rolling'", (guild_id, season))
+        row = c.fetchone()
+        if row is None:
+            db_conn.rollback()
+            return True, []
+        after = row[0]
+        last = _next_chunk_end(c, guild_id, after, MAINTENANCE_CHUNK_ROWS)
+        if last is None:
+            c.execute("UPDATE seasons SET status = 'archived' WHERE guild_id = ? AND season = ?", (guild_id, season))
+            db_conn.commit()
+            return True, []
+        c.execute('''
+            INSERT INTO season_standings (guild_id, season, user_id, user_name, elo_rating, wins, losses, games_played)
+            SELECT guild_id, ?, user_id, user_name, elo_rating, wins, losses, games_played FROM players
+            WHERE guild_id = ? AND user_id > ? AND user_id <= ? AND games_played > 0
+        ''', (season, guild_id, after, last))
+        archived = c.rowcount
+        condition = "(games_played > 0 OR elo_rating != ?)"
+        before = _ratings_in_range(c, guild_id, after, last, condition, (INITIAL_ELO,))
+        c.execute(f'''
+            UPDATE players SET elo_rating = CAST(ROUND(? + (elo_rating - ?) * ?) AS INTEGER),
+                glicko_rating = ? + (glicko_rating - ?) * ?, glicko_rd = ?, glicko_volatility = ?,
+                wins = 0, losses = 0, games_played = 0, updated_at = ?
+            WHERE guild_id = ? AND user_id > ? AND user_id <= ? AND {condition}
+        ''', (INITIAL_ELO, INITIAL_ELO, SEASON_RATING_CARRYOVER, INITIAL_ELO, INITIAL_ELO, SEASON_RATING_CARRYOVER,
+              GLICKO2_INITIAL_RD, GLICKO2_INITIAL_VOLATILITY, now,
+              guild_id, after, last, INITIAL_ELO))
+        after_reset = _ratings_in_range(c, guild_id, after, last)
+        changed = [(user_id, after_reset[user_id]) for user_id, rating in before.items() if after_reset[user_id] != rating]
+        append_rating_history(db_conn, guild_id, [(user_id, now, rating) for user_id, rating in changed])
+        c.execute("UPDATE seasons SET archived_through = ?, players = players + ? WHERE guild_id = ? AND season = ?",
+                  (last, archived, guild_id, season))
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return False, changed
+
+def get_season(db_conn: sqlite3.Connection, guild_id: int, season: int) -> Optional[sqlite3.Row]:
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM seasons WHERE guild_id = ? AND season = ?", (guild_id, season))
+    return c.fetchone()
+
+def get_season_standings(db_conn: sqlite3.Connection, guild_id: int, season: int, limit: int = 10) -> list:
+    """Gets the top of an archived season's final standings."""
+    c = db_conn.cursor()
+    c.execute('''
+        SELECT user_id, user_name, elo_rating, wins, losses FROM season_standings
+        WHERE guild_id = ? AND season = ? ORDER BY elo_rating DESC, user_id DESC LIMIT ?
+    ''', (guild_id, season, limit))
+    return c.fetchall()
+
+def get_season_finish(db_conn: sqlite3.Connection, guild_id: int, season: int, user_id: int) -> Optional[tuple[int, sqlite3.Row]]:
+    """Gets a player's final rank and standing in an archived season, or None if they didn't play in it."""
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM season_standings WHERE guild_id = ? AND season = ? AND user_id = ?", (guild_id, season, user_id))
+    standing = c.fetchone()
+    if standing is None:
+        return None
+    c.execute("SELECT COUNT(*) FROM season_standings WHERE guild_id = ? AND season = ? AND elo_rating > ?",
+              (guild_id, season, standing['elo_rating']))
+    return c.fetchone()[0] + 1, standing
+
+def has_rating_adjustments(db_conn: sqlite3.Connection, guild_id: int) -> bool:
+    """Whether a guild's ratings were ever decayed or reset by a season rollover. The ledger records neither."""
+    c = db_conn.cursor()
+    c.execute('''
+        SELECT EXISTS (SELECT 1 FROM seasons WHERE guild_id = ? AND status != 'current')
+            OR EXISTS (SELECT 1 FROM players WHERE guild_id = ? AND decayed_at IS NOT NULL)
+    ''', (guild_id, guild_id))
+    return bool(c.fetchone()[0])
+
+# --- TOURNAMENT BRACKETS ---
+# A bracket is a list of slots in play order. Each slot takes its two players
+# from a seed, or from the winner or loser of an earlier slot. Only the seeds
+# and the slots that needed a real match are stored; who plays where, byes and
+# walkovers included, is recomputed from them whenever a round finishes, which
+# for a 512-player double elimination bracket is about two thousand dict lookups.
+
+BYE = 0  # "Nobody" in a bracket slot; Discord user IDs are never 0.
+# Statuses of a tournament match whose winner is final, and of one an admin can still settle.
+DECIDED_MATCH_STATUSES = ('confirmed', 'walkover')
+UNDECIDED_MATCH_STATUSES = ('pending', 'disputed', 'timed_out', 'error_player_not_found')
+
+class BracketSlot(NamedTuple):
+    name: str
+    # Each source is ("seed", index), ("winner", slot name) or ("loser", slot name).
+    sources: tuple[tuple[str, Any], tuple[str, Any]]
+
+class SlotState(NamedTuple):
+    """Who plays in a slot and how it ended. None means not decided yet, BYE means nobody."""
+    player1: Optional[int]
+    player2: Optional[int]
+    winner: Optional[int]
+    loser: Optional[int]
+
+def seed_order(size: int) -> list[int]:
+    """0-based seeds in first-round order for a bracket of `size` (a power of two), so the top seed meets the last."""
+    order = [0]
+    while len(order) < size:
+        order = [s for seed in order for s in (seed, 2 * len(order) - 1 - seed)]
+    return order
+
+def build_bracket(fmt: str, num_players: int) -> list[BracketSlot]:
+    """
+    The slots of a "single" or "double" elimination bracket, each after the
+    slots it takes players from. The last slot is the final. Double elimination
+    needs at least 3 players and ends in a single grand final match.
+    """
+    rounds = max(1, math.ceil(math.log2(num_players)))
+    size = 2 ** rounds
+    order = seed_order(size)
+    slots = [BracketSlot(f"W1-{p}", (("seed", order[2 * p]), ("seed", order[2 * p + 1]))) for p in range(size // 2)]
+    for r in range(2, rounds + 1):
+        slots += [BracketSlot(f"W{r}-{p}", (("winner", f"W{r - 1}-{2 * p}"), ("winner", f"W{r - 1}-{2 * p + 1}")))
+                  for p in range(size >> r)]
+    if fmt == "single":
+        return slots
+
+    # Losers bracket: odd rounds pair up its survivors, even rounds bring in the
+    # losers of the next winners round, reversed every other time to avoid rematches.
+    slots += [BracketSlot(f"L1-{p}", (("loser", f"W1-{2 * p}"), ("loser", f"W1-{2 * p + 1}"))) for p in range(size // 4)]
+    for j in range(1, rounds):
+        count = size >> (j + 1)
+        dropped = [f"W{j + 1}-{p}" for p in range(count)]
+        if j % 2:
+            dropped.reverse()
+        slots += [BracketSlot(f"L{2 * j}-{p}", (("winner", f"L{2 * j - 1}-{p}"), ("loser", dropped[p]))) for p in range(count)]
+        if j < rounds - 1:
+            slots += [BracketSlot(f"L{2 * j + 1}-{p}", (("winner", f"L{2 * j}-{2 * p}"), ("winner", f"L{2 * j}-{2 * p + 1}")))
+                      for p in range(count // 2)]
+    slots.append(BracketSlot("GF", (("winner", f"W{rounds}-0"), ("winner", f"L{2 * (rounds - 1)}-0"))))
+    return slots
+
+def resolve_bracket(slots: list[BracketSlot], seeds: list[int], results: dict[str, int]) -> dict[str, SlotState]:
+    """
+    Works out every slot from the seeds (user IDs, best first) and the winners
+    of the slots that were played. A slot with a bye goes to the other player
+    without a match.
+    """
+    states: dict[str, SlotState] = {}
+    for slot in slots:
+        players = []
+        for kind, ref in slot.sources:
+            if kind == "seed":
+                players.append(seeds[ref] if ref < len(seeds) else BYE)
+            else:
+                players.append(states[ref].winner if kind == "winner" else states[ref].loser)
+        p1, p2 = players
+        winner = loser = None
+        if p1 is not None and p2 is not None:
+            if p1 == BYE or p2 == BYE:
+                winner, loser = (p2, p1) if p1 == BYE else (p1, p2)
+            elif slot.name in results:
+                winner = results[slot.name]
+                loser = p2 if winner == p1 else p1
+        states[slot.name] = SlotState(p1, p2, winner, loser)
+    return states
+
+def slot_label(slot: str) -> str:
+    """A short bracket position for announcements, e.g. "W2" or "GF"."""
+    return slot.split("-")[0]
+
+def create_tournament(db_conn: sqlite3.Connection, tournament_id: str, guild_id: int, channel_id: int, name: str, fmt: str):
+    """Creates a tournament that is open for sign-ups."""
+    now = int(time.time())
+    db_conn.execute('''
+        INSERT INTO tournaments (tournament_id, guild_id, channel_id, name, format, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (tournament_id, guild_id, channel_id, name, fmt, now, now))
+    db_conn.commit()
+
+def get_tournament(db_conn: sqlite3.Connection, tournament_id: str) -> Optional[sqlite3.Row]:
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM tournaments WHERE tournament_id = ?", (tournament_id,))
+    return c.fetchone()
+
+def get_latest_tournament(db_conn: sqlite3.Connection, guild_id: int) -> Optional[sqlite3.Row]:
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM tournaments WHERE guild_id = ? ORDER BY created_at DESC LIMIT 1", (guild_id,))
+    return c.fetchone()
+
+def count_tournament_entries(db_conn: sqlite3.Connection, tournament_id: str) -> int:
+    c = db_conn.cursor()
+    c.execute("SELECT COUNT(*) FROM tournament_entries WHERE tournament_id = ?", (tournament_id,))
+    return c.fetchone()[0]
+
+def toggle_tournament_entry(db_conn: sqlite3.Connection, tournament_id: str, user_id: int,
+                            max_players: int) -> tuple[Optional[bool], int]:
+    """
+    Signs a player up, or takes them off the list if they already are. Returns
+    (True if joined / False if left, entrant count), or (None, count) if
+    sign-ups are closed or full.
+    """
+    c = db_conn.cursor()
+    c.execute("SELECT status FROM tournaments WHERE tournament_id = ?", (tournament_id,))
+    row = c.fetchone()
+    if row is None or row['status'] != 'signup':
+        db_conn.commit()
+        return None, 0
+    c.execute("DELETE FROM tournament_entries WHERE tournament_id = ? AND user_id = ?", (tournament_id, user_id))
+    joined = c.rowcount == 0
+    count = count_tournament_entries(db_conn, tournament_id)
+    if joined and count >= max_players:
+        db_conn.commit()
+        return None, count
+    if joined:
+        c.execute("INSERT INTO tournament_entries (tournament_id, user_id, joined_at) VALUES (?, ?, ?)",
+                  (tournament_id, user_id, int(time.time())))
+        count += 1
+    db_conn.commit()
+    return joined, count
+
+def start_tournament(db_conn: sqlite3.Connection, tournament_id: str) -> int:
+    """
+    Closes sign-ups and seeds the entrants by their current rating, best first.
+    Returns the number of players seeded, or 0 if the tournament was not open.
+    """
+    c = db_conn.cursor()
+    c.execute("UPDATE tournaments SET status = 'running', updated_at = ? WHERE tournament_id = ? AND status = 'signup'",
+              (int(time.time()), tournament_id))
+    if c.rowcount == 0:
+        db_conn.commit()
+        return 0
+    c.execute('''
+        SELECT e.user_id FROM tournament_entries e
+        JOIN tournaments t ON t.tournament_id = e.tournament_id
+        LEFT JOIN players p ON p.guild_id = t.guild_id AND p.user_id = e.user_id
+        WHERE e.tournament_id = ?
+        ORDER BY COALESCE(p.elo_rating, ?) DESC, e.joined_at, e.user_id
+    ''', (tournament_id, INITIAL_ELO))
+    seeds = [(seed, tournament_id, row[0]) for seed, row in enumerate(c.fetchall(), 1)]
+    c.executemany("UPDATE tournament_entries SET seed = ? WHERE tournament_id = ? AND user_id = ?", seeds)
+    db_conn.commit()
+    return len(seeds)
+
+def get_tournament_bracket(db_conn: sqlite3.Connection, tournament_id: str) -> tuple[Optional[sqlite3.Row], list, list]:
+    """Gets a tournament, its seeded entrants (best first) and every slot that has a match, with its winner if decided."""
+    c = db_conn.cursor()
+    c.execute("SELECT * FROM tournaments WHERE tournament_id = ?", (tournament_id,))
+    tournament = c.fetchone()
+    c.execute('''
+        SELECT e.user_id, e.seed, p.user_name FROM tournament_entries e
+        JOIN tournaments t ON t.tournament_id = e.tournament_id
+        LEFT JOIN players p ON p.guild_id = t.guild_id AND p.user_id = e.user_id
+        WHERE e.tournament_id = ? AND e.seed IS NOT NULL ORDER BY e.seed
+    ''', (tournament_id,))
+    entries = c.fetchall()
+    c.execute(f'''
+        SELECT tm.slot, tm.round, tm.match_id, m.player1_id, m.player2_id, m.status,
+               CASE WHEN m.status IN ({", ".join("?" * len(DECIDED_MATCH_STATUSES))}) THEN m.winner_id END AS winner_id
+        FROM tournament_matches tm JOIN matches m ON m.match_id = tm.match_id
+        WHERE tm.tournament_id = ?
+    ''', (*DECIDED_MATCH_STATUSES, tournament_id))
+    return tournament, entries, c.fetchall()
+
+def create_tournament_round(db_conn: sqlite3.Connection, tournament_id: str, guild_id: int, channel_id: int,
+                            round_number: int, pairings: list[tuple[str, str, int, int]]):
+    """Creates every (slot, match_id, player1_id, player2_id) match of a round in one transaction."""
+    now = int(time.time())
+    c = db_conn.cursor()
+    c.executemany('''
+        INSERT INTO matches (match_id, guild_id, player1_id, player2_id, message_id, channel_id, timestamp, status, updated_at)
+        VALUES (?, ?, ?, ?, NULL, ?, ?, 'pending', ?)
+    ''', [(match_id, guild_id, p1_id, p2_id, channel_id, now, now) for _, match_id, p1_id, p2_id in pairings])
+    c.executemany("INSERT INTO tournament_matches (tournament_id, slot, round, match_id) VALUES (?, ?, ?, ?)",
+                  [(tournament_id, slot, round_number, match_id) for slot, match_id, _, _ in pairings])
+    c.execute("UPDATE tournaments SET current_round = ?, updated_at = ? WHERE tournament_id = ?", (round_number, now, tournament_id))
+    db_conn.commit()
+
+def set_match_messages(db_conn: sqlite3.Connection, messages: list[tuple[int, str]]):
+    """Records the (message_id, match_id) of matches announced together."""
+    now = int(time.time())
+    db_conn.executemany("UPDATE matches SET message_id = ?, updated_at = ? WHERE match_id = ?",
+                        [(msg_id, now, match_id) for msg_id, match_id in messages])
+    db_conn.commit()
+
+def walkover_match(db_conn: sqlite3.Connection, match_id: str, winner_id: int) -> bool:
+    """Awards an undecided match to `winner_id` without a rating change. Returns False if it was already decided."""
+    c = db_conn.cursor()
+    c.execute(f"UPDATE matches SET status = 'walkover', winner_id = ?, updated_at = ? WHERE match_id = ? AND status IN ({', '.join('?' * len(UNDECIDED_MATCH_STATUSES))})",
+              (winner_id, int(time.time()), match_id, *UNDECIDED_MATCH_STATUSES))
+    db_conn.commit()
+    return c.rowcount == 1
+
+def finish_tournament(db_conn: sqlite3.Connection, tournament_id: str, champion_id: int) -> bool:
+    c = db_conn.cursor()
+    c.execute("UPDATE tournaments SET status = 'finished', champion_id = ?, updated_at = ? WHERE tournament_id = ? AND status = 'running'",
+              (champion_id, int(time.time()), tournament_id))
+    db_conn.commit()
+    return c.rowcount == 1
+
+def cancel_tournament(db_conn: sqlite3.Connection, tournament_id: str) -> Optional[list[str]]:
+    """Cancels a tournament and its undecided matches. Returns their IDs, or None if it had already ended."""
+    now = int(time.time())
+    c = db_conn.cursor()
+    c.execute("UPDATE tournaments SET status = 'cancelled', updated_at = ? WHERE tournament_id = ? AND status IN ('signup', 'running')",
+              (now, tournament_id))
+    if c.rowcount == 0:
+        db_conn.commit()
+        return None
+    c.execute(f'''
+        SELECT m.match_id FROM tournament_matches tm JOIN matches m ON m.match_id = tm.match_id
+        WHERE tm.tournament_id = ? AND m.status IN ({", ".join("?" * len(UNDECIDED_MATCH_STATUSES))})
+    ''', (tournament_id, *UNDECIDED_MATCH_STATUSES))
+    cancelled = [row[0] for row in c.fetchall()]
+    c.executemany("UPDATE matches SET status = 'cancelled', updated_at = ? WHERE match_id = ?", [(now, match_id) for match_id in cancelled])
+    db_conn.commit()
+    return cancelled
+
+def get_open_tournament_matches(db_conn: sqlite3.Connection) -> list:
+    """
+    Gets (tournament_id, guild_id, match_id) rows for every running tournament.
+    match_id is set for undecided matches and NULL otherwise, so tournaments
+    between rounds are listed too.
+    """
+    c = db_conn.cursor()
+    c.execute(f'''
+        SELECT t.tournament_id, t.guild_id, m.match_id FROM tournaments t
+        LEFT JOIN tournament_matches tm ON tm.tournament_id = t.tournament_id
+        LEFT JOIN matches m ON m.match_id = tm.match_id AND m.status NOT IN ({", ".join("?" * len(DECIDED_MATCH_STATUSES))})
+        WHERE t.status = 'running'
+    ''', DECIDED_MATCH_STATUSES)
+    return c.fetchall()
+
+# --- BACKUPS ---
+# Backups use SQLite's online backup API from a separate connection that holds
+# one read transaction for the whole copy. In WAL mode that pins a consistent
+# snapshot without blocking writers, and their commits can't force the copy to
+# restart. Pages are copied a few hundred at a time with a short pause between
+# steps. The copy is integrity-checked before it is gzipped and linked into
+# place under a name no other backup has, so every file in BACKUP_DIR is a
+# complete, verified database and no backup ever replaces another.
+
+class BackupResult(NamedTuple):
+    path: Path
+    pages: int
+    steps: int
+    database_bytes: int
+    backup_bytes: int
+    copy_seconds: float
+    total_seconds: float
+
+def list_backups(backup_dir: str) -> list[Path]:
+    """Backups in `backup_dir`, oldest first."""
+    return sorted(Path(backup_dir).glob("elo_bot-*.db.gz"))
+
+def newest_backup(backup_dir: str) -> Optional[os.stat_result]:
+    """The file status of the newest backup in `backup_dir`, or None if there is none."""
+    backups = list_backups(backup_dir)
+    return backups[-1].stat() if backups else None
+
+def check_integrity(db_conn: sqlite3.Connection):
+    """Raises sqlite3.DatabaseError unless `PRAGMA integrity_check` reports ok."""
+    problems = [row[0] for row in db_conn.execute("PRAGMA integrity_check")]
+    if problems != ["ok"]:
+        raise sqlite3.DatabaseError("integrity check failed: " + "; ".join(problems[:5]))
+
+def backup_database(source_path: str, backup_dir: str, keep: Optional[int],
+                    pages_per_step: int = BACKUP_PAGES_PER_STEP, pause: float = BACKUP_STEP_PAUSE_SECONDS,
+                    prefix: str = "elo_bot") -> BackupResult:
+    """
+    Writes a verified, gzipped snapshot of `source_path` to `backup_dir` and
+    deletes all but the newest `keep` backups (None keeps everything).
+    Snapshots with another `prefix` are not backups to `list_backups`, so
+    rotation never deletes them. Blocks for the whole copy, so the bot runs it
+    on a worker thread.
+    """
+    started = time.perf_counter()
+    directory = Path(backup_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Leftovers from an interrupted backup. Another process may be writing its own, so only stale ones go.
+    for partial in directory.glob("elo_bot-*.partial"):
+        if partial.stat().st_mtime < time.time() - 3600:
+            partial.unlink(missing_ok=True)
+    work_name = f"elo_bot-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    raw_path = directory / (work_name + ".db.partial")
+    gz_path = directory / (work_name + ".db.gz.partial")
+
+    steps = 0
+    def pace(status: int, remaining: int, total: int):
+        nonlocal steps
+        steps += 1
+        time.sleep(pause)
+
+    source = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    target = sqlite3.connect(raw_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source.backup(target, pages=pages_per_step, progress=pace)
+        source.execute("COMMIT")
+        copy_seconds = time.perf_counter() - started
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+        check_integrity(target)
+        target.close()
+        with open(raw_path, "rb") as raw, gzip.open(gz_path, "wb", compresslevel=6) as compressed:
+            shutil.copyfileobj(raw, compressed, 1024 * 1024)
+        database_bytes = raw_path.stat().st_size
+        while True:
+            now = time.time()
+            path = directory / f"{prefix}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{int(now % 1 * 1e6):06d}.db.gz"
+            try:
+                # Unlike a rename, a link never replaces an existing file.
+                os.link(gz_path, path)
+                break
+            except FileExistsError:
+                continue
+    finally:
+        source.close()
+        target.close()
+        for leftover in (raw_path, gz_path):
+            leftover.unlink(missing_ok=True)
+
+    if keep is not None:
+        for old in list_backups(backup_dir)[:-keep]:
+            old.unlink()
+    return BackupResult(path, pages, steps, database_bytes, path.stat().st_size, copy_seconds, time.perf_counter() - started)
+
+def verify_backup(backup_path: str) -> int:
+    """Decompresses a backup to a temporary file and checks its integrity. Returns its schema version."""
+    raw_path = Path(str(backup_path) + ".verify")
+    try:
+        with gzip.open(backup_path, "rb") as compressed, open(raw_path, "wb") as raw:
+            shutil.copyfileobj(compressed, raw, 1024 * 1024)
+        db_conn = sqlite3.connect(raw_path)
+        try:
+            check_integrity(db_conn)
+            return get_schema_version(db_conn)
+        finally:
+            db_conn.close()
+    finally:
+        raw_path.unlink(missing_ok=True)
+
+def restore_database(backup_path: str, target_path: str) -> int:
+    """
+    Replaces the contents of `target_path` with a verified backup and returns
+    the number of pages restored. The bot must be stopped first. The copy goes
+    through SQLite, so a leftover WAL file can't mix old pages into the result.
+    """
+    raw_path = Path(target_path).with_name(Path(target_path).name + ".restore")
+    try:
+        with gzip.open(backup_path, "rb") as compressed, open(raw_path, "wb") as raw:
+            shutil.copyfileobj(compressed, raw, 1024 * 1024)
+        snapshot = sqlite3.connect(raw_path)
+        target = sqlite3.connect(target_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+        try:
+            check_integrity(snapshot)
+            snapshot.backup(target)
+            return target.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            snapshot.close()
+            target.close()
+    finally:
+        raw_path.unlink(missing_ok=True)
+
+# --- METRICS ---
+# A small in-process registry rendered in the Prometheus text format. Counters
+# and histograms are updated on the event loop; gauges are collected from async
+# sources when the endpoint is scraped. Slash commands and button callbacks are
+# wrapped with `@instrumented`, and every database call is timed by
+# `AsyncDatabase._submit`.
+
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 3.0, 5.0, 10.0)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Metrics:
+    """Counters, histograms and scrape-time gauges, exported as Prometheus text."""
+    def __init__(self, buckets: tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        # Per label set: one count per bucket plus +Inf, then the sum and the total count.
+        self._histograms: dict[str, dict[tuple, list[float]]] = {}
+        self._gauge_sources: list[Callable[[], Awaitable[list[tuple[str, dict, float]]]]] = []
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ("counter", help_text)
+        self._counters[name] = {}
+
+    def histogram(self, name: str, help_text: str):
+        self._help[name] = ("histogram", help_text)
+        self._histograms[name] = {}
+
+    def gauge(self, name: str, help_text: str):
+        self._help[name] = ("gauge", help_text)
+
+    def add_gauge_source(self, source: Callable[[], Awaitable[list[tuple[str, dict, float]]]]):
+        """Registers a coroutine returning (name, labels, value) samples, called on every scrape."""
+        self._gauge_sources.append(source)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self._counters[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        series = self._histograms[name]
+        key = tuple(sorted(labels.items()))
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    async def render(self) -> str:
+        lines = []
+        gauges: dict[str, list[tuple[tuple, float]]] = {}
+        for source in self._gauge_sources:
+            try:
+                for name, labels, value in await source():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"Metrics gauge source failed: {e}")
+        for name, (kind, help_text) in self._help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in self._counters[name].items())
+            elif kind == "gauge":
+                lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in gauges.get(name, []))
+            else:
+                for key, state in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip((*self.buckets, "+Inf"), state):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serves `GET /metrics` on a minimal HTTP/1.0 listener."""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                parts = request_line.decode("latin-1").split()
+                if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                    status, body = "200 OK", (await self.render()).encode()
+                else:
+                    status, body = "404 Not Found", b"Not found\n"
+                writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+        return await asyncio.start_server(handle, host, port)
+
+metrics = Metrics()
+metrics.histogram("elo_handler_seconds", "Time spent in a slash command or button handler.")
+metrics.counter("elo_handler_errors_total", "Handlers that raised, by exception type.")
+metrics.histogram("elo_interaction_ack_seconds", "Time from interaction creation to its first response or defer.")
+metrics.counter("elo_interaction_ack_late_total", "Interactions acknowledged after Discord's 3 second deadline.")
+metrics.counter("elo_interaction_unacknowledged_total", "Handlers that finished without responding to their interaction.")
+metrics.histogram("elo_db_call_seconds", "Database helper latency seen by the event loop, including worker queueing.")
+metrics.histogram("elo_db_exec_seconds", "Database helper run time on its worker thread.")
+metrics.counter("elo_db_errors_total", "Database helpers that raised.")
+metrics.gauge("elo_matches", "Matches by status.")
+metrics.gauge("elo_scheduled_expiries", "Pending matches waiting for their report deadline.")
+metrics.gauge("elo_queue_size", "Players in the ranked queue.")
+metrics.gauge("elo_cleanup_outstanding", "Expired matches and Discord updates still in the cleanup pipeline.")
+metrics.histogram("elo_loop_lag_seconds", "How late the stall detector's heartbeat woke up.")
+metrics.counter("elo_command_syncs_total", "Startup and forced command tree syncs, by whether they were sent or skipped.")
+metrics.counter("elo_loop_stalls_total", "Event loop stalls longer than STALL_THRESHOLD_MS.")
+metrics.counter("elo_challenges_rejected_total", "Challenges refused before any database or Discord work, by reason.")
+metrics.counter("elo_backups_total", "Database backups, by whether they were written and verified.")
+metrics.histogram("elo_backup_seconds", "Time to copy, verify and compress one database backup.")
+metrics.gauge("elo_backup_last_success_timestamp", "Unix time of the newest backup in BACKUP_DIR.")
+metrics.gauge("elo_backup_last_bytes", "Compressed size of the newest backup in BACKUP_DIR.")
+metrics.counter("elo_maintenance_players_total", "Ratings changed by inactivity decay and season rollovers, by job.")
+
+# How often a handler checks whether its interaction has been acknowledged yet.
+ACK_POLL_SECONDS = 0.05
+
+def _record_ack(interaction: discord.Interaction, handler: str):
+    seconds = max(0.0, (discord.utils.utcnow() - interaction.created_at).total_seconds())
+    metrics.observe("elo_interaction_ack_seconds", seconds, handler=handler)
+    if seconds > INTERACTION_ACK_DEADLINE_SECONDS:
+        metrics.inc("elo_interaction_ack_late_total", handler=handler)
+
+async def _watch_ack(interaction: discord.Interaction, handler: str):
+    while not interaction.response.is_done():
+        await asyncio.sleep(ACK_POLL_SECONDS)
+    _record_ack(interaction, handler)
+
+def instrumented(handler: str):
+    """Records latency, errors and time-to-ack for an interaction handler."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+            # The task name is what the stall detector reports if this handler blocks the loop.
+            task = asyncio.current_task()
+            if task:
+                custom_id = interaction.data.get('custom_id') if interaction.data else None
+                task.set_name(f"{handler} interaction={interaction.id}" + (f" custom_id={custom_id}" if custom_id else ""))
+            watcher = asyncio.create_task(_watch_ack(interaction, handler))
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                metrics.inc("elo_handler_errors_total", handler=handler, error=type(e).__name__)
+                raise
+            finally:
+                metrics.observe("elo_handler_seconds", time.perf_counter() - started, handler=handler)
+                if not watcher.done():
+                    watcher.cancel()
+                    if interaction.response.is_done():
+                        _record_ack(interaction, handler)
+                    else:
+                        metrics.inc("elo_interaction_unacknowledged_total", handler=handler)
+        return wrapper
+    return decorator
+
+def _timed_call(func, *args) -> tuple[Any, float]:
+    started = time.perf_counter()
+    return func(*args), time.perf_counter() - started
+
+# --- ASYNC DATA ACCESS LAYER ---
+# Every write goes through a single writer thread that owns the write connection,
+# so commits are serialized without any locking on the event loop. Queries use a
+# second, read-only connection on its own thread; WAL mode lets them run while a
+# write is in progress.
+
+class AsyncDatabase:
+    """Awaitable front-end for the blocking database helpers."""
+    def __init__(self, path: str):
+        self.path = path
+        self.write_conn: Optional[sqlite3.Connection] = None
+        self.read_conn: Optional[sqlite3.Connection] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="elo-db-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="elo-db-reader")
+        # Called on the event loop as `listener(guild_id, user_id, new_rating)` after a rating is written.
+        self.rating_listeners: list[Callable[[int, int, int], None]] = []
+        # Match results waiting for the next group commit, and the task flushing them.
+        self._pending_results: list[tuple[tuple, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    def notify_rating_change(self, guild_id: int, user_id: int, rating: int):
+        for listener in self.rating_listeners:
+            listener(guild_id, user_id, rating)
+
+    async def _submit(self, executor: ThreadPoolExecutor, func, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        helper = getattr(func, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            result, run_seconds = await loop.run_in_executor(executor, functools.partial(_timed_call, func, *args))
+        except Exception:
+            metrics.inc("elo_db_errors_total", helper=helper)
+            raise
+        metrics.observe("elo_db_call_seconds", time.perf_counter() - started, helper=helper)
+        metrics.observe("elo_db_exec_seconds", run_seconds, helper=helper)
+        return result
+
+    async def open(self):
+        """Opens both connections on their worker threads and initializes the schema."""
+        # Connections are created on the thread that will use them, as sqlite3 requires.
+        self.write_conn = await self._submit(self._writer, open_connection, self.path)
+        await self.write(init_db)
+        self.read_conn = await self._submit(self._reader, open_connection, self.path, True)
+
+    async def write(self, func, *args) -> Any:
+        """Runs `func(write_conn, *args)` on the writer thread."""
+        return await self._submit(self._writer, func, self.write_conn, *args)
+
+    async def read(self, func, *args) -> Any:
+        """Runs `func(read_conn, *args)` on the reader thread."""
+        return await self._submit(self._reader, func, self.read_conn, *args)
+
+    async def close(self):
+        """Closes both connections on their own threads and stops the workers."""
+        if self._flusher:
+            await self._flusher
+        if self.read_conn:
+            await self._submit(self._reader, self.read_conn.close)
+            self.read_conn = None
+        if self.write_conn:
+            await self._submit(self._writer, self.write_conn.close)
+            self.write_conn = None
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+
+    # Same surface as the module-level helpers, minus the connection argument.
+
+    async def get_guild_config(self, guild_id: int) -> Optional[sqlite3.Row]:
+        return await self.read(get_guild_config, guild_id)
+
+    async def set_guild_config(self, guild_id: int, elo_channel_id: Optional[int], admin_role_id: Optional[int],
+                               k_factor: Optional[float]):
+        await self.write(set_guild_config, guild_id, elo_channel_id, admin_role_id, k_factor)
+
+    async def get_player(self, guild_id: int, user_id: int) -> Optional[sqlite3.Row]:
+        return await self.read(get_player, guild_id, user_id)
+
+    async def add_player_if_not_exists(self, guild_id: int, user_id: int, user_name: str) -> bool:
+        inserted = await self.write(add_player_if_not_exists, guild_id, user_id, user_name)
+        if inserted:
+            self.notify_rating_change(guild_id, user_id, INITIAL_ELO)
+        return inserted
+
+    async def create_match_record(self, match_id: str, guild_id: int, p1_id: int, p2_id: int, msg_id: int, ch_id: int):
+        await self.write(create_match_record, match_id, guild_id, p1_id, p2_id, msg_id, ch_id)
+
+    async def set_match_message(self, match_id: str, msg_id: int):
+        await self.write(set_match_message, match_id, msg_id)
+
+    async def get_match(self, match_id: str) -> Optional[sqlite3.Row]:
+        return await self.read(get_match, match_id)
+
+    async def update_match_report(self, match_id: str, player_id: int, report_value: int):
+        await self.write(update_match_report, match_id, player_id, report_value)
+
+    async def update_match_status(self, match_id: str, status: str, from_statuses: tuple[str, ...] = ('pending',)) -> bool:
+        return await self.write(update_match_status, match_id, status, from_statuses)
+
+    async def get_leaderboard(self, guild_id: int, limit: int = 10) -> list:
+        return await self.read(get_leaderboard, guild_id, limit)
+
+    async def get_pending_matches_for_user(self, guild_id: int, user_id: int) -> list:
+        return await self.read(get_pending_matches_for_user, guild_id, user_id)
+
+    async def get_head_to_head(self, guild_id: int, player_id: int, opponent_id: int) -> Optional[sqlite3.Row]:
+        return await self.read(get_head_to_head, guild_id, player_id, opponent_id)
+
+    async def get_top_opponents(self, guild_id: int, player_id: int, limit: int = 3) -> list:
+        return await self.read(get_top_opponents, guild_id, player_id, limit)
+
+    async def get_rating_history(self, guild_id: int, user_id: int, since: int = 0,
+                                 max_points: int = SPARKLINE_POINTS) -> list[tuple[int, int]]:
+        return await self.read(get_rating_history, guild_id, user_id, since, max_points)
+
+    async def get_peak_rating(self, guild_id: int, user_id: int) -> Optional[int]:
+        return await self.read(get_peak_rating, guild_id, user_id)
+
+    async def get_stale_matches(self) -> list:
+        return await self.read(get_stale_matches)
+
+    async def close_rating_period(self, engine: RatingEngine, guild_id: int) -> list[tuple[int, int]]:
+        changed = await self.write(close_rating_period, engine, guild_id)
+        for user_id, rating in changed:
+            self.notify_rating_change(guild_id, user_id, rating)
+        return changed
+
+    async def apply_match_result(self, guild_id: int, match_id: str, winner_id: int, loser_id: int,
+                                 from_statuses: tuple[str, ...] = ('pending',)) -> Optional[tuple[Optional[int], Optional[int]]]:
+        """
+        Confirms a match and rates it; see the blocking `apply_match_result`.
+        Results that arrive while a commit is in flight are queued and written
+        together in the next transaction.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending_results.append(((guild_id, match_id, winner_id, loser_id, from_statuses), future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_results())
+        return await future
+
+    async def _flush_results(self):
+        while self._pending_results:
+            batch, self._pending_results = self._pending_results, []
+            try:
+                outcomes = await self.write(finalize_match_results, [args for args, _ in batch])
+            except Exception as e:
+                print(f"Group commit of {len(batch)} match result(s) failed: {e}")
+                outcomes = [e] * len(batch)
+            for (args, future), outcome in zip(batch, outcomes):
+                if isinstance(outcome, Exception):
+                    if not future.done():
+                        future.set_exception(outcome)
+                    continue
+                # Committed ratings reach the listeners even if the caller stopped waiting,
+                # and one failing listener must not strand the rest of the batch.
+                if outcome is not None and outcome[0] is not None:
+                    guild_id, _, winner_id, loser_id, _ = args
+                    try:
+                        self.notify_rating_change(guild_id, winner_id, outcome[0])
+                        self.notify_rating_change(guild_id, loser_id, outcome[1])
+                    except Exception as e:
+                        print(f"Error while publishing the rating change of match {args[1]}: {e}")
+                # A caller cancelled while waiting (shutdown, or its handler task) has a done future.
+                if not future.done():
+                    future.set_result(outcome)
+
+# --- RANK INDEX ---
+# A Fenwick tree over whole-point rating buckets, highest rating first, plus a
+# sorted list of (rating, user ID) per bucket. Counting the players above a rating and
+# finding the player at a given position are both O(log buckets), so rank
+# lookups never touch SQLite. Order matches the leaderboard: rating descending,
+# then user ID descending.
+
+class RankIndex:
+    """In-memory order statistics over player ratings."""
+    def __init__(self, max_rating: int = RANK_INDEX_MAX_RATING):
+        self.size = max_rating + 1
+        self._tree = [0] * (self.size + 1)
+        self._ratings: dict[int, int] = {}
+        self._buckets: dict[int, list[tuple[int, int]]] = {}  # slot -> sorted (rating, user_id)
+
+    def __len__(self) -> int:
+        return len(self._ratings)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ratings
+
+    def rating(self, user_id: int) -> Optional[int]:
+        return self._ratings.get(user_id)
+
+    def _slot(self, rating: int) -> int:
+        """Maps a rating to its 1-based Fenwick slot; slot 1 holds the highest bucket."""
+        bucket = min(max(int(round(rating)), 0), self.size - 1)
+        return self.size - bucket
+
+    def _add(self, slot: int, delta: int):
+        while slot <= self.size:
+            self._tree[slot] += delta
+            slot += slot & -slot
+
+    def _count_through(self, slot: int) -> int:
+        """Number of players in slots 1..slot, i.e. rated at or above that bucket."""
+        total = 0
+        while slot > 0:
+            total += self._tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def _find_slot(self, position: int) -> int:
+        """Finds the slot holding the player at 0-based `position`."""
+        slot, remaining = 0, position
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = slot + step
+            if nxt <= self.size and self._tree[nxt] <= remaining:
+                slot = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return slot + 1
+
+    def load(self, rows):
+        """Replaces the index contents with (user_id, rating) pairs."""
+        self._tree = [0] * (self.size + 1)
+        self._ratings.clear()
+        self._buckets.clear()
+        for user_id, rating in rows:
+            self.update(user_id, rating)
+
+    def update(self, user_id: int, rating: int):
+        """Adds a player or moves an existing one to a new rating."""
+        if user_id in self._ratings:
+            self.remove(user_id)
+        slot = self._slot(rating)
+        self._ratings[user_id] = rating
+        bisect.insort(self._buckets.setdefault(slot, []), (rating, user_id))
+        self._add(slot, 1)
+
+    def remove(self, user_id: int):
+        rating = self._ratings.pop(user_id, None)
+        if rating is None:
+            return
+        slot = self._slot(rating)
+        bucket = self._buckets[slot]
+        del bucket[bisect.bisect_left(bucket, (rating, user_id))]
+        if not bucket:
+            del self._buckets[slot]
+        self._add(slot, -1)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based rank of a player; players on the same rating share a rank."""
+        rating = self._ratings.get(user_id)
+        if rating is None:
+            return None
+        slot = self._slot(rating)
+        bucket = self._buckets[slot]
+        # Only the clamped end buckets can hold higher ratings than this one.
+        return self._count_through(slot - 1) + len(bucket) - bisect.bisect_right(bucket, (rating, math.inf)) + 1
+
+    def position(self, user_id: int) -> Optional[int]:
+        """0-based position of a player in leaderboard order."""
+        rating = self._ratings.get(user_id)
+        if rating is None:
+            return None
+        slot = self._slot(rating)
+        bucket = self._buckets[slot]
+        return self._count_through(slot - 1) + len(bucket) - 1 - bisect.bisect_left(bucket, (rating, user_id))
+
+    def entry_at(self, position: int) -> Optional[tuple[int, int]]:
+        """(user_id, rating) of the player at 0-based `position`, or None if out of range."""
+        if not 0 <= position < len(self._ratings):
+            return None
+        slot = self._find_slot(position)
+        bucket = self._buckets[slot]
+        rating, user_id = bucket[len(bucket) - 1 - (position - self._count_through(slot - 1))]
+        return user_id, rating
+
+    def top(self, n: int) -> list[tuple[int, int, int]]:
+        """(rank, user_id, rating) for the first `n` players."""
+        return self._slice(0, n)
+
+    def around(self, user_id: int, radius: int = 2) -> list[tuple[int, int, int]]:
+        """(rank, user_id, rating) for the player and up to `radius` neighbours on each side."""
+        position = self.position(user_id)
+        if position is None:
+            return []
+        start = max(position - radius, 0)
+        return self._slice(start, position + radius + 1 - start)
+
+    def _slice(self, start: int, count: int) -> list[tuple[int, int, int]]:
+        entries = []
+        for position in range(start, min(start + count, len(self._ratings))):
+            entry_user_id, rating = self.entry_at(position)
+            entries.append((self.rank(entry_user_id), entry_user_id, rating))
+        return entries
+
+# --- LEADERBOARD SERVICE ---
+# Rendered leaderboard pages are cached, so repeated /leaderboard calls and page
+# flips cost no queries. A page caches the (elo_rating, user_id) keys of its
+# first and last rows. When a rating changes, only the pages between the
+# player's old and new positions shift, so only those are dropped. Pages are
+# loaded with keyset pagination, and the cursor comes from the previous cached
+# page or from the rank index, never from OFFSET.
+
+class LeaderboardPage(NamedTuple):
+    number: int
+    text: str
+    first_key: tuple[int, int]
+    last_key: tuple[int, int]
+    full: bool
+
+class LeaderboardService:
+    """Caches rendered leaderboard pages and invalidates them as ratings change."""
+    MEDALS = ["🥇", "🥈", "🥉"]
+
+    def __init__(self, db: AsyncDatabase, rank_index: RankIndex, guild_id: int,
+                 page_size: int = LEADERBOARD_PAGE_SIZE, max_pages: int = LEADERBOARD_CACHED_PAGES):
+        self.db = db
+        self.rank_index = rank_index
+        self.guild_id = guild_id
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages: OrderedDict[int, LeaderboardPage] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def page_count(self) -> int:
+        return max(1, math.ceil(len(self.rank_index) / self.page_size))
+
+    async def get_page(self, number: int) -> Optional[LeaderboardPage]:
+        """Returns a rendered page, or None if the page is empty."""
+        page = self._pages.get(number)
+        if page is not None:
+            self.hits += 1
+            self._pages.move_to_end(number)
+            return page
+
+        self.misses += 1
+        after = None
+        if number > 0:
+            previous = self._pages.get(number - 1)
+            if previous is not None:
+                after = previous.last_key
+            else:
+                entry = self.rank_index.entry_at(number * self.page_size - 1)
+                if entry is None:
+                    return None
+                after = (entry[1], entry[0])
+        rows = await self.db.read(get_leaderboard_page, self.guild_id, after, self.page_size)
+        if not rows:
+            return None
+
+        lines = []
+        for i, player in enumerate(rows):
+            position = number * self.page_size + i
+            rank = self.MEDALS[position] if position < 3 else f"**#{position + 1}**"
+            lines.append(f"{rank} **{player['user_name']}** - {player['elo_rating']} ELO (W:{player['wins']}/L:{player['losses']})")
+        page = LeaderboardPage(number, "\n".join(lines), (rows[0]['elo_rating'], rows[0]['user_id']),
+                               (rows[-1]['elo_rating'], rows[-1]['user_id']), len(rows) == self.page_size)
+        self._pages[number] = page
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return page
+
+    def on_rating_change(self, user_id: int, rating: int):
+        """
+        Drops pages whose contents move when `user_id` goes to `rating`.
+        Must run before the rank index applies the change, since it reads the old rating.
+        """
+        old_rating = self.rank_index.rating(user_id)
+        new_key = (rating, user_id)
+        if old_rating is None:
+            # A new player shifts every page from their position down.
+            low, high = (-math.inf, -math.inf), new_key
+        else:
+            old_key = (old_rating, user_id)
+            low, high = min(old_key, new_key), max(old_key, new_key)
+        for number, page in list(self._pages.items()):
+            # A short last page also grows when someone lands below it.
+            page_low = page.last_key if page.full else (-math.inf, -math.inf)
+            if page_low <= high and page.first_key >= low:
+                del self._pages[number]
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def clear(self):
+        self._pages.clear()
+
+# --- EVENT LOOP STALL DETECTOR ---
+# A heartbeat task wakes every LOOP_HEARTBEAT_SECONDS and records how late it
+# woke up. A watchdog thread watches the heartbeat; once it has been silent for
+# longer than the threshold, the thread captures the loop thread's stack and the
+# name of the task that is running, while the stall is still in progress.
+# Instrumented handlers name their task after the command and interaction, and
+# expiry tasks after their match, so the log says who blocked the loop.
+
+class StallReport(NamedTuple):
+    at: float
+    seconds: float
+    context: str
+
+class StallDetector:
+    """Measures event loop lag and logs the stack of any stall longer than `threshold` seconds."""
+    def __init__(self, threshold: float, interval: float = LOOP_HEARTBEAT_SECONDS, samples: int = LOOP_LAG_SAMPLES):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags: deque[float] = deque(maxlen=samples)
+        self.stalls: deque[StallReport] = deque(maxlen=20)
+        self.stall_count = 0
+        self._last_beat = time.monotonic()
+        # Set by the watchdog thread while a stall is in progress, read once the loop recovers.
+        self._stall_context: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat(), name="stall-detector-heartbeat")
+        threading.Thread(target=self._watch, name="stall-detector", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def percentiles(self) -> dict[str, float]:
+        """p50/p90/p99/max loop lag in seconds over the sample window."""
+        if not self.lags:
+            return {}
+        lags = np.array(self.lags)
+        return {"p50": float(np.percentile(lags, 50)), "p90": float(np.percentile(lags, 90)),
+                "p99": float(np.percentile(lags, 99)), "max": float(lags.max())}
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._last_beat - self.interval)
+            self.lags.append(lag)
+            metrics.observe("elo_loop_lag_seconds", lag)
+            if lag >= self.threshold:
+                context = self._stall_context or "unknown"
+                self._stall_context = None
+                self.stall_count += 1
+                self.stalls.append(StallReport(time.time(), lag, context))
+                metrics.inc("elo_loop_stalls_total")
+                print(f"Event loop stalled for {lag * 1000:.0f}ms in {context}.")
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.interval):
+            beat = self._last_beat
+            if beat == reported_beat or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            reported_beat = beat
+            task = asyncio.current_task(self._loop)
+            context = task.get_name() if task else "a callback outside any task"
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)\n"
+            self._stall_context = context
+            print(f"Event loop blocked for over {self.threshold * 1000:.0f}ms in {context}. Loop thread stack:\n{stack}", end="")
+
+# --- MATCH EXPIRY SCHEDULER ---
+# One min-heap of (deadline, match_id) and one task that sleeps until the
+# earliest deadline. Scheduling is O(log n); cancelling just forgets the match
+# and its heap entry is discarded lazily when it reaches the top. Pending
+# matches are re-seeded from the database on startup, so restarts lose nothing.
+
+def match_deadline(timestamp: int) -> float:
+    """Unix time at which a match created at `timestamp` stops accepting reports."""
+    return timestamp + REPORT_TIMEOUT_HOURS * 3600
+
+class MatchExpiryScheduler:
+    """Calls `callback(match_id)` once, as soon as a pending match reaches its deadline."""
+    def __init__(self, callback: Callable[[str], Awaitable[None]]):
+        self.callback = callback
+        self._heap: list[tuple[float, str]] = []
+        self._deadlines: dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, match_id: str, deadline: float):
+        self._deadlines[match_id] = deadline
+        heapq.heappush(self._heap, (deadline, match_id))
+        # Compact once cancelled entries make up most of the heap.
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, m) for m, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        if self._wakeup and self._heap[0] == (deadline, match_id):
+            self._wakeup.set()
+
+    def cancel(self, match_id: str):
+        self._deadlines.pop(match_id, None)
+
+    def start(self, pending: list):
+        """Seeds the heap with (match_id, timestamp) rows and starts the timer task."""
+        for match_id, timestamp in pending:
+            self.schedule(match_id, match_deadline(timestamp))
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="match-expiry-scheduler")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # Drop entries that were cancelled or rescheduled since they were pushed.
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, match_id = heapq.heappop(self._heap)
+            del self._deadlines[match_id]
+            # Run each expiry in its own task so one slow match can't delay the next deadline.
+            task = asyncio.create_task(self._fire(match_id), name=f"expire match={match_id}")
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, match_id: str):
+        try:
+            await self.callback(match_id)
+        except Exception as e:
+            print(f"Error while expiring match {match_id}: {e}")
+
+# --- MATCH CLEANUP PIPELINE ---
+# Expired matches are cleaned up in two stages. Resolution only touches the
+# database and runs CLEANUP_CONCURRENCY matches at a time, so a backlog lands in
+# a few group commits. Discord I/O goes to per-channel lanes, one per route:
+# the announcement lane packs every result queued behind an in-flight send into
+# as few messages as fit, and the button lane clears report buttons one edit
+# at a time. A lane never has more than one request in flight, matching
+# Discord's per-route rate-limit buckets instead of queueing hundreds of
+# requests behind the same bucket.
+
+class ExpiredMatch(NamedTuple):
+    channel_id: int
+    message_id: Optional[int]
+    announcement: str
+
+class DrainReport(NamedTuple):
+    matches: int
+    messages: int
+    edits: int
+    seconds: float
+
+def pack_messages(lines: list[str], limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """Joins announcements into as few messages as possible, each at most `limit` characters."""
+    messages, current = [], ""
+    for line in lines:
+        candidate = f"{current}\n\n{line}" if current else line
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            messages.append(current)
+        current = line[:limit]
+    if current:
+        messages.append(current)
+    return messages
+
+class MatchCleanupPipeline:
+    """Resolves expired matches, then announces them and clears their buttons in batches."""
+    def __init__(self, resolve: Callable[[str], Awaitable[Optional[ExpiredMatch]]],
+                 send: Callable[[int, str], Awaitable[None]],
+                 clear_buttons: Callable[[int, int], Awaitable[None]],
+                 concurrency: int = CLEANUP_CONCURRENCY):
+        self.resolve = resolve
+        self.send = send
+        self.clear_buttons = clear_buttons
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lanes: dict[tuple[str, int], list] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # Work items not finished yet: matches being resolved plus queued lane items.
+        self.outstanding = 0
+        self._started_at = 0.0
+        self._counts = {"matches": 0, "messages": 0, "edits": 0}
+        self.last_drain: Optional[DrainReport] = None
+
+    async def expire(self, match_id: str):
+        """Scheduler callback: resolves one match and queues its Discord updates."""
+        if self.outstanding == 0:
+            self._started_at = time.perf_counter()
+            self._counts = dict.fromkeys(self._counts, 0)
+        self.outstanding += 1
+        try:
+            async with self._semaphore:
+                expired = await self.resolve(match_id)
+            if expired:
+                self._counts["matches"] += 1
+                self._enqueue("announce", expired.channel_id, expired.announcement)
+                if expired.message_id:
+                    self._enqueue("buttons", expired.channel_id, expired.message_id)
+        finally:
+            self.outstanding -= 1
+            self._check_drained()
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _enqueue(self, route: str, channel_id: int, item):
+        key = (route, channel_id)
+        if key not in self._lanes:
+            self._lanes[key] = []
+            task = asyncio.create_task(self._drain_lane(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._lanes[key].append(item)
+        self.outstanding += 1
+
+    async def _drain_lane(self, key: tuple[str, int]):
+        route, channel_id = key
+        while self._lanes[key]:
+            items, self._lanes[key] = self._lanes[key], []
+            try:
+                if route == "announce":
+                    for content in pack_messages(items):
+                        if await self._attempt(self.send(channel_id, content), "announce expired matches"):
+                            self._counts["messages"] += 1
+                else:
+                    for message_id in items:
+                        if await self._attempt(self.clear_buttons(channel_id, message_id), f"clear buttons on message {message_id}"):
+                            self._counts["edits"] += 1
+            finally:
+                self.outstanding -= len(items)
+                self._check_drained()
+        del self._lanes[key]
+
+    async def _attempt(self, request: Awaitable[None], action: str) -> bool:
+        try:
+            await request
+            return True
+        except Exception as e:
+            print(f"Cleanup failed to {action}: {e}")
+            return False
+
+    def _check_drained(self):
+        # A drain where every match had already been resolved elsewhere would hide the last real backlog.
+        if self.outstanding or not self._counts["matches"]:
+            return
+        self.last_drain = DrainReport(seconds=time.perf_counter() - self._started_at, **self._counts)
+        if self.last_drain.matches > 1:
+            print(f"Cleanup drained {self.last_drain.matches} expired match(es) in {self.last_drain.seconds:.1f}s "
+                  f"({self.last_drain.messages} message(s), {self.last_drain.edits} button edit(s)).")
+
+# --- MATCHMAKING QUEUE ---
+# Queued players live in a list sorted by (rating, user_id). The closest-rated
+# opponent for anyone is always one of their two neighbours, so a join only
+# needs a binary search and two comparisons. Because windows widen over time,
+# each neighbouring pair is pushed onto a heap keyed by the moment its gap
+# becomes acceptable; nothing ever rescans the whole queue.
+
+class MatchmakingQueue:
+    """Nearest-rating pairing with time-widening windows."""
+    def __init__(self, base_window: float = MATCHMAKING_BASE_WINDOW,
+                 growth_per_second: float = MATCHMAKING_WINDOW_GROWTH_PER_MINUTE / 60,
+                 max_window: float = MATCHMAKING_MAX_WINDOW):
+        self.base_window = base_window
+        self.growth_per_second = growth_per_second
+        self.max_window = max_window
+        self._sorted: list[tuple[int, int]] = []
+        self._queued: dict[int, tuple[int, float]] = {}  # user_id -> (rating, joined_at)
+        self._candidates: list[tuple[float, int, int]] = []  # (ready_at, lower_user_id, upper_user_id)
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._queued
+
+    def window(self, waited_seconds: float) -> float:
+        return min(self.base_window + self.growth_per_second * waited_seconds, self.max_window)
+
+    def _ready_at(self, lower: tuple[int, int], upper: tuple[int, int]) -> float:
+        """When the pair's gap fits the window of the player who joined last (inf if never)."""
+        gap = upper[0] - lower[0]
+        if gap > self.max_window:
+            return math.inf
+        joined_last = max(self._queued[lower[1]][1], self._queued[upper[1]][1])
+        if gap <= self.base_window:
+            return joined_last
+        return joined_last + (gap - self.base_window) / self.growth_per_second
+
+    def _push_candidate(self, index: int):
+        """Considers the neighbours at `index` and `index + 1` as a future pair."""
+        if 0 <= index and index + 1 < len(self._sorted):
+            lower, upper = self._sorted[index], self._sorted[index + 1]
+            ready_at = self._ready_at(lower, upper)
+            if ready_at != math.inf:
+                heapq.heappush(self._candidates, (ready_at, lower[1], upper[1]))
+
+    def _remove_at(self, index: int):
+        _, user_id = self._sorted.pop(index)
+        del self._queued[user_id]
+
+    def _pair_at(self, index: int) -> tuple[int, int]:
+        """Removes the neighbours at `index` and `index + 1` and returns their IDs."""
+        pair = (self._sorted[index][1], self._sorted[index + 1][1])
+        self._remove_at(index + 1)
+        self._remove_at(index)
+        # The players on either side of the removed pair are now neighbours.
+        self._push_candidate(index - 1)
+        return pair
+
+    def join(self, user_id: int, rating: int, now: Optional[float] = None) -> Optional[tuple[int, int]]:
+        """Queues a player. Returns a pair straight away if a neighbour is already acceptable."""
+        if user_id in self._queued:
+            return None
+        now = time.time() if now is None else now
+        entry = (rating, user_id)
+        self._queued[user_id] = (rating, now)
+        index = bisect.bisect_left(self._sorted, entry)
+        self._sorted.insert(index, entry)
+
+        options = [(self._ready_at(self._sorted[i], self._sorted[i + 1]), i)
+                   for i in (index - 1, index) if 0 <= i and i + 1 < len(self._sorted)]
+        ready = [(self._sorted[i + 1][0] - self._sorted[i][0], i) for ready_at, i in options if ready_at <= now]
+        if ready:
+            return self._pair_at(min(ready)[1])
+        for _, i in options:
+            self._push_candidate(i)
+        return None
+
+    def leave(self, user_id: int) -> bool:
+        queued = self._queued.get(user_id)
+        if queued is None:
+            return False
+        index = bisect.bisect_left(self._sorted, (queued[0], user_id))
+        self._remove_at(index)
+        self._push_candidate(index - 1)
+        return True
+
+    def pop_ready(self, now: Optional[float] = None) -> list[tuple[int, int]]:
+        """Pairs every candidate whose window has opened by `now`."""
+        now = time.time() if now is None else now
+        pairs = []
+        while self._candidates and self._candidates[0][0] <= now:
+            _, lower_id, upper_id = heapq.heappop(self._candidates)
+            # Skip candidates made stale by joins, leaves or earlier pairings.
+            if lower_id not in self._queued or upper_id not in self._queued:
+                continue
+            index = bisect.bisect_left(self._sorted, (self._queued[lower_id][0], lower_id))
+            if index + 1 < len(self._sorted) and self._sorted[index + 1][1] == upper_id:
+                pairs.append(self._pair_at(index))
+        return pairs
+
+    def next_ready_at(self) -> Optional[float]:
+        return self._candidates[0][0] if self._candidates else None
+
+class Matchmaker:
+    """Drives a `MatchmakingQueue` and calls `on_pair(user_id, user_id)` for every match it makes."""
+    def __init__(self, on_pair: Callable[[int, int], Awaitable[None]]):
+        self.queue = MatchmakingQueue()
+        self.on_pair = on_pair
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        # When each queued or just-paired player joined, kept so a player whose match can't start keeps their wait.
+        self._joined_at: dict[int, float] = {}
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="matchmaker")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def join(self, user_id: int, rating: int, joined_at: Optional[float] = None) -> bool:
+        """Queues a player; returns True if they were matched immediately."""
+        if user_id in self.queue:
+            return False
+        joined_at = time.time() if joined_at is None else joined_at
+        self._joined_at[user_id] = joined_at
+        pair = self.queue.join(user_id, rating, joined_at)
+        if pair:
+            self._dispatch(pair)
+        elif self._wakeup:
+            self._wakeup.set()
+        return pair is not None
+
+    def requeue(self, user_id: int, rating: int) -> bool:
+        """Puts a paired player whose match could not start back in the queue, with the window they had built up."""
+        return self.join(user_id, rating, self._joined_at.get(user_id))
+
+    def leave(self, user_id: int) -> bool:
+        self._joined_at.pop(user_id, None)
+        return self.queue.leave(user_id)
+
+    def _dispatch(self, pair: tuple[int, int]):
+        task = asyncio.create_task(self._fire(pair))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _fire(self, pair: tuple[int, int]):
+        try:
+            await self.on_pair(*pair)
+        except Exception as e:
+            print(f"Error while starting queued match {pair}: {e}")
+        finally:
+            for user_id in pair:
+                if user_id not in self.queue:
+                    self._joined_at.pop(user_id, None)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            for pair in self.queue.pop_ready():
+                self._dispatch(pair)
+            next_ready_at = self.queue.next_ready_at()
+            timeout = None if next_ready_at is None else max(0.0, next_ready_at - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+# --- OPEN CHALLENGES ---
+# Each guild keeps its open challenges and pending matches in memory, keyed by
+# player pair, along with every player's outgoing challenge. /challenge checks
+# them and a per-user token bucket before it touches the database or Discord,
+# so a storm of duplicate or spammed challenges costs a few dict lookups each.
+
+def player_pair(a: int, b: int) -> tuple[int, int]:
+    return (a, b) if a < b else (b, a)
+
+class ChallengeIndex:
+    """The open challenges and pending matches of one guild."""
+    def __init__(self):
+        self._challenges: dict[tuple[int, int], int] = {}  # pair -> challenger_id
+        self._outgoing: dict[int, tuple[int, int]] = {}  # challenger_id -> pair
+        self._matches: dict[str, tuple[int, int]] = {}  # match_id -> pair
+        self._pair_matches: dict[tuple[int, int], set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._challenges)
+
+    def conflict(self, challenger_id: int, opponent_id: int) -> Optional[str]:
+        """Why `challenger_id` can't challenge `opponent_id` right now, or None if they can."""
+        pair = player_pair(challenger_id, opponent_id)
+        if pair in self._challenges:
+            return "duplicate"
+        if pair in self._pair_matches:
+            return "pending_match"
+        if challenger_id in self._outgoing:
+            return "outgoing"
+        return None
+
+    def open(self, challenger_id: int, opponent_id: int):
+        pair = player_pair(challenger_id, opponent_id)
+        self._challenges[pair] = challenger_id
+        self._outgoing[challenger_id] = pair
+
+    def close(self, challenger_id: int, opponent_id: int):
+        pair = player_pair(challenger_id, opponent_id)
+        if self._challenges.get(pair) == challenger_id:
+            del self._challenges[pair]
+            del self._outgoing[challenger_id]
+
+    def begin_match(self, match_id: str, p1_id: int, p2_id: int):
+        pair = player_pair(p1_id, p2_id)
+        self._matches[match_id] = pair
+        self._pair_matches.setdefault(pair, set()).add(match_id)
+
+    def end_match(self, match_id: str):
+        pair = self._matches.pop(match_id, None)
+        if pair is not None:
+            matches = self._pair_matches[pair]
+            matches.discard(match_id)
+            if not matches:
+                del self._pair_matches[pair]
+
+class TokenBucket:
+    """Per-key token buckets holding up to `capacity` tokens, refilled at `rate` tokens per second."""
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._buckets: dict[int, tuple[float, float]] = {}  # key -> (tokens, updated_at)
+        self._prune_at = 1024
+
+    def take(self, key: int, now: Optional[float] = None) -> float:
+        """Spends one of `key`'s tokens. Returns 0 on success, otherwise the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) >= self._prune_at:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        """Forgets buckets that have refilled; a missing key behaves like a full bucket."""
+        refill_seconds = self.capacity / self.rate
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < refill_seconds}
+        self._prune_at = max(1024, 2 * len(self._buckets))
 
-def get_player(db_conn: sqlite3.Connection, user_id: int) -> Optional[sqlite3.Row]:
-    """Gets a player's data by their ID. Returns None if not found."""
-    c = db_conn.cursor()
-    c.execute("SELECT * FROM players WHERE user_id = ?", (str(user_id),))
-    return c.fetchone()
+# --- TOURNAMENTS ---
+# Tournament matches are ordinary ranked matches: they are reported with the
+# same buttons, expire the same way and move ratings. The tournament only
+# decides who plays whom. Once every match of a round is decided, the next
+# round's matches are created in one transaction and announced
+# TOURNAMENT_PAIRINGS_PER_MESSAGE to a message, each message with a menu that
+# hands players their report buttons. A 256-player first round is one commit
+# and seven messages, sent one after another so they stay inside the channel's
+# rate limit.
 
-def add_player_if_not_exists(db_conn: sqlite3.Connection, user_id: int, user_name: str):
-    """Adds a player to the database if they do not exist using a single, efficient query."""
-    c = db_conn.cursor()
-    c.execute("INSERT OR IGNORE INTO players (user_id, user_name, elo_rating) VALUES (?, ?, ?)",
-              (str(user_id), user_name, INITIAL_ELO))
-    db_conn.commit()
+class RoundReport(NamedTuple):
+    round_number: int
+    matches: int
+    messages: int
+    seconds: float
 
-def create_match_record(db_conn: sqlite3.Connection, match_id: str, p1_id: int, p2_id: int, msg_id: int, ch_id: int):
-    """Creates a new match record in the database."""
-    c = db_conn.cursor()
-    c.execute("INSERT INTO matches (match_id, player1_id, player2_id, message_id, channel_id, timestamp, status) VALUES (?, ?, ?, ?, ?, ?, 'pending')",
-              (match_id, str(p1_id), str(p2_id), str(msg_id), str(ch_id), int(time.time())))
-    db_conn.commit()
+class TournamentService:
+    """Tracks the undecided matches of running tournaments and starts each round once the previous one is decided."""
+    def __init__(self, client: "MyClient"):
+        self.client = client
+        self._open: dict[str, set[str]] = {}  # tournament_id -> undecided match IDs
+        self._by_match: dict[str, str] = {}  # match_id -> tournament_id
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._running: set[asyncio.Task] = set()
 
-def get_match(db_conn: sqlite3.Connection, match_id: str) -> Optional[sqlite3.Row]:
-    """Gets match data by its ID."""
-    c = db_conn.cursor()
-    c.execute("SELECT * FROM matches WHERE match_id = ?", (match_id,))
-    return c.fetchone()
+    def __contains__(self, match_id: str) -> bool:
+        return match_id in self._by_match
 
-def update_match_report(db_conn: sqlite3.Connection, match_id: str, player_id: int, report_value: int):
-    """Updates a player's report for a specific match safely."""
-    match_data = get_match(db_conn, match_id)
-    if not match_data: return
+    def tournament_of(self, match_id: str) -> Optional[str]:
+        return self._by_match.get(match_id)
 
-    c = db_conn.cursor()
-    # Use explicit queries to avoid any chance of SQL injection
-    if str(player_id) == match_data['player1_id']:
-        c.execute("UPDATE matches SET player1_report = ? WHERE match_id = ?", (report_value, match_id))
-    elif str(player_id) == match_data['player2_id']:
-        c.execute("UPDATE matches SET player2_report = ? WHERE match_id = ?", (report_value, match_id))
-    db_conn.commit()
+    def load(self, rows: list):
+        """Seeds the index from `get_open_tournament_matches` rows and advances tournaments left between rounds."""
+        for row in rows:
+            self._open.setdefault(row['tournament_id'], set())
+            if row['match_id']:
+                self._track(row['tournament_id'], row['match_id'])
+        for tournament_id, match_ids in self._open.items():
+            if not match_ids:
+                self._dispatch(tournament_id)
 
-def update_match_status(db_conn: sqlite3.Connection, match_id: str, status: str):
-    """Updates the status of a match."""
-    c = db_conn.cursor()
-    c.execute("UPDATE matches SET status = ? WHERE match_id = ?", (status, match_id))
-    db_conn.commit()
+    def _track(self, tournament_id: str, match_id: str):
+        self._open.setdefault(tournament_id, set()).add(match_id)
+        self._by_match[match_id] = tournament_id
 
-def get_leaderboard(db_conn: sqlite3.Connection, limit: int = 10) -> list:
-    """Gets the top players by ELO rating."""
-    c = db_conn.cursor()
-    c.execute("SELECT user_name, elo_rating, wins, losses FROM players ORDER BY elo_rating DESC LIMIT ?", (limit,))
-    return c.fetchall()
+    def forget(self, tournament_id: str):
+        for match_id in self._open.pop(tournament_id, ()):
+            self._by_match.pop(match_id, None)
 
-def get_pending_matches_for_user(db_conn: sqlite3.Connection, user_id: int) -> list:
-    """Gets all pending matches for a specific user."""
-    c = db_conn.cursor()
-    c.execute("SELECT * FROM matches WHERE (player1_id = ? OR player2_id = ?) AND status = 'pending' ORDER BY timestamp DESC", (str(user_id), str(user_id)))
-    return c.fetchall()
+    def on_match_decided(self, match_id: str):
+        """Called once a match has a final winner. Starts the next round in the background after a round's last match."""
+        tournament_id = self._by_match.pop(match_id, None)
+        if tournament_id is None:
+            return
+        open_matches = self._open[tournament_id]
+        open_matches.discard(match_id)
+        if not open_matches:
+            self._dispatch(tournament_id)
 
-def get_stale_matches(db_conn: sqlite3.Connection) -> list:
-    """Gets matches that are pending and older than the timeout period."""
-    timeout_seconds = REPORT_TIMEOUT_HOURS * 3600
-    stale_time = int(time.time()) - timeout_seconds
-    c = db_conn.cursor()
-    c.execute("SELECT * FROM matches WHERE status = 'pending' AND timestamp < ?", (stale_time,))
-    return c.fetchall()
+    def _dispatch(self, tournament_id: str):
+        task = asyncio.create_task(self._advance_in_background(tournament_id), name=f"tournament-advance {tournament_id}")
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
 
-# --- ELO CALCULATION MODULE ---
+    async def _advance_in_background(self, tournament_id: str):
+        await self.client.wait_until_ready()
+        try:
+            await self.advance(tournament_id)
+        except Exception as e:
+            print(f"Error while advancing tournament {tournament_id}: {e}")
 
-def calculate_expected_score(rating1: int, rating2: int) -> float:
-    """Calculates the expected score for player 1 against player 2."""
-    return 1.0 / (1.0 + math.pow(10, (rating2 - rating1) / 400.0))
+    async def advance(self, tournament_id: str) -> Optional[RoundReport]:
+        """
+        Starts a tournament's next round once its current one is decided, or
+        crowns the champion after the final. Returns the round it started, if any.
+        """
+        async with self._locks.setdefault(tournament_id, asyncio.Lock()):
+            if self._open.get(tournament_id):
+                return None
+            started = time.perf_counter()
+            tournament, entries, played = await self.client.db.read(get_tournament_bracket, tournament_id)
+            if tournament is None or tournament['status'] != 'running':
+                return None
 
-def update_elo_and_stats(db_conn: sqlite3.Connection, winner_id: int, loser_id: int) -> tuple[Optional[int], Optional[int]]:
-    """Updates ELO and stats for both players after a confirmed match."""
-    winner_data = get_player(db_conn, winner_id)
-    loser_data = get_player(db_conn, loser_id)
-    if not winner_data or not loser_data:
-        print(f"Error: Player data not found for {winner_id} or {loser_id}.")
-        return None, None
+            seeds = [entry['user_id'] for entry in entries]
+            slots = build_bracket(tournament['format'], len(seeds))
+            states = resolve_bracket(slots, seeds, {row['slot']: row['winner_id'] for row in played if row['winner_id'] is not None})
+            champion = states[slots[-1].name].winner
+            if champion is not None:
+                if await self.client.db.write(finish_tournament, tournament_id, champion):
+                    self._open.pop(tournament_id, None)
+                    await send_to_channel(self.client, tournament['channel_id'],
+                                          f"🏆 <@{champion}> has won **{tournament['name']}**! Congratulations!")
+                return None
 
-    r_winner, r_loser = winner_data['elo_rating'], loser_data['elo_rating']
-    e_winner = calculate_expected_score(r_winner, r_loser)
+            played_slots = {row['slot'] for row in played}
+            pairings = []
+            for slot in slots:
+                state = states[slot.name]
+                if (state.winner is None and slot.name not in played_slots
+                        and state.player1 not in (None, BYE) and state.player2 not in (None, BYE)):
+                    pairings.append((slot.name, uuid.uuid4().hex[:8], state.player1, state.player2))
+            if not pairings:
+                print(f"Tournament {tournament_id} has no match left to play but no champion.")
+                return None
 
-    new_r_winner = r_winner + K_FACTOR * (1.0 - e_winner)
-    new_r_loser = r_loser + K_FACTOR * (0.0 - (1.0 - e_winner))
+            round_number = tournament['current_round'] + 1
+            guild_id = tournament['guild_id']
+            await self.client.db.write(create_tournament_round, tournament_id, guild_id, tournament['channel_id'], round_number, pairings)
+            deadline = match_deadline(int(time.time()))
+            challenges = self.client.guild_state(guild_id).challenges
+            for _, match_id, p1_id, p2_id in pairings:
+                self._track(tournament_id, match_id)
+                challenges.begin_match(match_id, p1_id, p2_id)
+                self.client.expiry.schedule(match_id, deadline)
+            messages = await self.announce_round(tournament, round_number, pairings, entries)
+            return RoundReport(round_number, len(pairings), messages, time.perf_counter() - started)
 
-    c = db_conn.cursor()
-    c.execute("UPDATE players SET elo_rating = ?, wins = wins + 1, games_played = games_played + 1 WHERE user_id = ?", (round(new_r_winner), str(winner_id)))
-    c.execute("UPDATE players SET elo_rating = ?, losses = losses + 1, games_played = games_played + 1 WHERE user_id = ?", (round(new_r_loser), str(loser_id)))
-    db_conn.commit()
+    async def announce_round(self, tournament: sqlite3.Row, round_number: int, pairings: list, entries: list) -> int:
+        """Posts a round's pairings in batches and records the message that carries each match. Returns the messages sent."""
+        channel = self.client.get_channel(tournament['channel_id'])
+        if channel is None:
+            print(f"Could not find channel {tournament['channel_id']}. Round {round_number} of tournament {tournament['tournament_id']} was not announced.")
+            return 0
+        seeds = {entry['user_id']: entry['seed'] for entry in entries}
+        names = {entry['user_id']: entry['user_name'] or str(entry['user_id']) for entry in entries}
+        batches = [pairings[i:i + TOURNAMENT_PAIRINGS_PER_MESSAGE] for i in range(0, len(pairings), TOURNAMENT_PAIRINGS_PER_MESSAGE)]
+        posted, sent = [], 0
+        for part, batch in enumerate(batches, 1):
+            lines = [f"🏟️ **{tournament['name']}**: round {round_number}" + (f" ({part}/{len(batches)})" if len(batches) > 1 else "")]
+            lines += [f"`{match_id}` {slot_label(slot)} <@{p1_id}> (#{seeds[p1_id]}) vs <@{p2_id}> (#{seeds[p2_id]})"
+                      for slot, match_id, p1_id, p2_id in batch]
+            lines.append(f"Pick your match below to report the result. You have {REPORT_TIMEOUT_HOURS} hour(s).")
+            options = [discord.SelectOption(label=f"{names[p1_id]} vs {names[p2_id]}"[:100], value=match_id,
+                                            description=f"{slot_label(slot)} • match {match_id}")
+                       for slot, match_id, p1_id, p2_id in batch]
+            try:
+                message = await channel.send("\n".join(lines), view=TournamentReportView(tournament['tournament_id'], round_number, part, options))
+            except (discord.Forbidden, discord.HTTPException) as e:
+                print(f"Could not announce part {part} of round {round_number} of tournament {tournament['tournament_id']}: {e}")
+                continue
+            posted += [(message.id, match_id) for _, match_id, _, _ in batch]
+            sent += 1
+        if posted:
+            await self.client.db.write(set_match_messages, posted)
+        return sent
+
+# --- MEMBER RESOLUTION CACHE ---
+# Lookups try the gateway member cache first (kept current by the members
+# intent), then a small TTL/LRU cache, and only then go to Discord. Misses are
+# fetched in one gateway `query_members` request per 100 IDs instead of one REST
+# `fetch_member` call each, and concurrent lookups of the same member share a
+# single fetch.
+
+class MemberCache:
+    """Resolves guild members with as few Discord round-trips as possible."""
+    QUERY_BATCH_SIZE = 100  # Discord's limit on user IDs per member query
 
-    return round(new_r_winner), round(new_r_loser)
+    def __init__(self, ttl: float = MEMBER_CACHE_TTL_SECONDS, max_size: int = MEMBER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple[int, int], tuple[float, discord.Member]] = OrderedDict()
+        self._inflight: dict[tuple[int, int], asyncio.Future] = {}
+        self.gateway_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.fetch_requests = 0
+
+    def _get(self, key: tuple[int, int]) -> Optional[discord.Member]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, member = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return member
+
+    def _put(self, key: tuple[int, int], member: discord.Member):
+        self._entries[key] = (time.monotonic() + self.ttl, member)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, guild_id: int, user_id: int):
+        self._entries.pop((guild_id, user_id), None)
+
+    async def resolve(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        """Returns the member, or None if they are no longer in the guild."""
+        return (await self.resolve_many(guild, [user_id])).get(user_id)
+
+    async def resolve_many(self, guild: discord.Guild, user_ids: list[int]) -> dict[int, discord.Member]:
+        """Resolves several members at once; users who left the guild are absent from the result."""
+        found: dict[int, discord.Member] = {}
+        waiting: dict[int, asyncio.Future] = {}
+        to_fetch: list[int] = []
+        for user_id in dict.fromkeys(user_ids):
+            key = (guild.id, user_id)
+            member = guild.get_member(user_id)
+            if member is not None:
+                self.gateway_hits += 1
+                found[user_id] = member
+            elif (member := self._get(key)) is not None:
+                self.cache_hits += 1
+                found[user_id] = member
+            elif key in self._inflight:
+                self.cache_hits += 1
+                waiting[user_id] = self._inflight[key]
+            else:
+                self.misses += 1
+                to_fetch.append(user_id)
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {user_id: loop.create_future() for user_id in to_fetch}
+            for user_id, future in futures.items():
+                self._inflight[(guild.id, user_id)] = future
+                # Mark failures as retrieved; the caller doing the fetch re-raises them.
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                fetched = await self._fetch(guild, to_fetch)
+                for user_id, future in futures.items():
+                    future.set_result(fetched.get(user_id))
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                raise
+            finally:
+                for user_id in to_fetch:
+                    self._inflight.pop((guild.id, user_id), None)
+            found.update(fetched)
+
+        for user_id, future in waiting.items():
+            member = await future
+            if member is not None:
+                found[user_id] = member
+        return found
+
+    async def _fetch(self, guild: discord.Guild, user_ids: list[int]) -> dict[int, discord.Member]:
+        fetched: dict[int, discord.Member] = {}
+        for i in range(0, len(user_ids), self.QUERY_BATCH_SIZE):
+            batch = user_ids[i:i + self.QUERY_BATCH_SIZE]
+            self.fetch_requests += 1
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                # The gateway query can time out during reconnects; fall back to REST.
+                print(f"Member query failed ({e}); fetching {len(batch)} member(s) individually.")
+                members = []
+                for user_id in batch:
+                    self.fetch_requests += 1
+                    try:
+                        members.append(await guild.fetch_member(user_id))
+                    except discord.NotFound:
+                        pass
+            for member in members:
+                fetched[member.id] = member
+                self._put((guild.id, member.id), member)
+        return fetched
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.gateway_hits + self.cache_hits + self.misses
+        return {
+            "lookups": lookups,
+            "gateway_hits": self.gateway_hits,
+            "cache_hits": self.cache_hits,
+            "misses": self.misses,
+            "fetch_requests": self.fetch_requests,
+            "hit_rate": (self.gateway_hits + self.cache_hits) / lookups if lookups else 0.0,
+        }
+
+# --- PER-GUILD STATE ---
+# Every guild is its own rating pool with its own rank index, leaderboard cache
+# and matchmaking queue. State is built at startup for guilds that already have
+# players, and on first use for the rest. When the bot runs as several shard
+# processes, each one only loads the guilds its shards receive events for, so
+# no two processes work on the same guild's rows.
+
+class GuildConfig(NamedTuple):
+    """A guild's row in `guild_config`; None means the default is used."""
+    channel_id: Optional[int]
+    admin_role_id: Optional[int]
+    k_factor: Optional[float]
+
+class GuildState:
+    """The in-memory rating state of one guild."""
+    def __init__(self, client: "MyClient", guild_id: int):
+        self.guild_id = guild_id
+        self.rank_index = RankIndex()
+        self.leaderboard = LeaderboardService(client.db, self.rank_index, guild_id)
+        self.matchmaker = Matchmaker(lambda p1_id, p2_id: start_queued_match(client, guild_id, p1_id, p2_id))
+        self.challenges = ChallengeIndex()
 
 # --- DISCORD CLIENT AND BOT LOGIC ---
 
-class MyClient(discord.Client):
+def command_tree_fingerprint(tree: app_commands.CommandTree) -> str:
+    """Hashes the global command definitions (names, options, permissions) exactly as a sync would send them."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: (c.get('type', 1), c['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+class MyClient(discord.AutoShardedClient):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.tree = app_commands.CommandTree(self)
-        self.guild = discord.Object(id=GUILD_ID)
+        # Commands are registered globally and offered in every guild, never in DMs.
+        self.tree = app_commands.CommandTree(self, allowed_contexts=app_commands.AppCommandContext(guild=True))
+
+        # --- Centralized Database Access ---
+        # Connections are opened in `setup_hook`, once the event loop is running.
+        self.db = AsyncDatabase(DATABASE_FILE)
+        self.guild_states: dict[int, GuildState] = {}
+        self.guild_configs: dict[int, GuildConfig] = {}
+        self.members = MemberCache()
+        self.cleanup = MatchCleanupPipeline(
+            resolve=lambda match_id: resolve_expired_match(self, match_id),
+            send=lambda channel_id, content: send_to_channel(self, channel_id, content),
+            clear_buttons=lambda channel_id, message_id: clear_match_buttons(self, channel_id, message_id),
+        )
+        self.expiry = MatchExpiryScheduler(self.cleanup.expire)
+        self.challenge_throttle = TokenBucket(CHALLENGE_BURST, 1 / CHALLENGE_REFILL_SECONDS)
+        self.tournaments = TournamentService(self)
+        self.backup_lock = asyncio.Lock()
+        # Decay and season rollovers never run at the same time.
+        self.maintenance_lock = asyncio.Lock()
+        self.last_backup: Optional[BackupResult] = None
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+        self.stall_detector: Optional[StallDetector] = None
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether this process runs the shard that receives `guild_id`'s events."""
+        return self.shard_ids is None or (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def guild_state(self, guild_id: int) -> GuildState:
+        state = self.guild_states.get(guild_id)
+        if state is None:
+            state = self.guild_states[guild_id] = GuildState(self, guild_id)
+            state.matchmaker.start()
+        return state
+
+    def on_rating_change(self, guild_id: int, user_id: int, rating: int):
+        state = self.guild_state(guild_id)
+        # The leaderboard reads the old rating from the rank index, so it goes first.
+        state.leaderboard.on_rating_change(user_id, rating)
+        state.rank_index.update(user_id, rating)
+
+    async def get_guild_config(self, guild_id: int) -> GuildConfig:
+        """A guild's settings, cached until /admin_configure changes them."""
+        config = self.guild_configs.get(guild_id)
+        if config is None:
+            row = await self.db.get_guild_config(guild_id)
+            config = GuildConfig(row['elo_channel_id'], row['admin_role_id'], row['k_factor']) if row else GuildConfig(None, None, None)
+            self.guild_configs[guild_id] = config
+        return config
+
+    async def sync_commands(self, force: bool = False) -> bool:
+        """Pushes the global commands to Discord if they changed since the last sync. Returns True if it synced."""
+        fingerprint = command_tree_fingerprint(self.tree)
+        key = f"command_tree:{self.application_id}"
+        if not force and await self.db.read(get_bot_state, key) == fingerprint:
+            metrics.inc("elo_command_syncs_total", result="skipped")
+            return False
+        await self.tree.sync()
+        await self.db.write(set_bot_state, key, fingerprint)
+        metrics.inc("elo_command_syncs_total", result="synced")
+        return True
 
-        # --- Centralized Database Connection ---
-        self.db_conn = sqlite3.connect(DATABASE_FILE)
-        self.db_conn.row_factory = sqlite3.Row
-        init_db(self.db_conn)
+    async def run_backup(self) -> BackupResult:
+        """Backs the database up on a worker thread. Only one backup runs at a time."""
+        async with self.backup_lock:
+            try:
+                result = await asyncio.to_thread(backup_database, DATABASE_FILE, BACKUP_DIR, BACKUP_KEEP)
+            except Exception:
+                metrics.inc("elo_backups_total", result="failed")
+                raise
+        metrics.inc("elo_backups_total", result="ok")
+        metrics.observe("elo_backup_seconds", result.total_seconds)
+        self.last_backup = result
+        print(f"Backup written to {result.path}: {result.pages} pages in {result.steps} steps, "
+              f"copied in {result.copy_seconds:.1f}s, {result.total_seconds:.1f}s with verify and compression, "
+              f"{result.database_bytes / 1e6:.1f}MB -> {result.backup_bytes / 1e6:.1f}MB.")
+        return result
 
     async def setup_hook(self):
-        self.tree.copy_global_to(guild=self.guild)
-        await self.tree.sync(guild=self.guild)
-        print(f"Commands synced for guild: {GUILD_ID}")
+        started = time.perf_counter()
+        await self.db.open()
+        # Ratings come back ordered by guild; skip guilds another shard process serves.
+        owned = [row for row in await self.db.read(get_all_ratings) if self.owns_guild(row['guild_id'])]
+        for guild_id, rows in itertools.groupby(owned, key=lambda row: row['guild_id']):
+            self.guild_state(guild_id).rank_index.load((row['user_id'], row['elo_rating']) for row in rows)
+        self.db.rating_listeners.append(self.on_rating_change)
+        # Route match report clicks by custom_id, including buttons posted before a restart.
+        self.add_dynamic_items(MatchReportButton, LeaderboardPageButton, TournamentJoinButton, TournamentReportSelect)
+        print(f"Rank indexes loaded for {len(self.guild_states)} guild(s) with {len(owned)} player(s).")
+        pending = [row for row in await self.db.read(get_pending_match_timestamps) if self.owns_guild(row['guild_id'])]
+        self.expiry.start([(row['match_id'], row['timestamp']) for row in pending])
+        for row in pending:
+            self.guild_state(row['guild_id']).challenges.begin_match(row['match_id'], row['player1_id'], row['player2_id'])
+        self.tournaments.load([row for row in await self.db.read(get_open_tournament_matches) if self.owns_guild(row['guild_id'])])
+        print(f"Expiry scheduler started with {len(self.expiry)} pending match(es).")
+        if rating_engine.batched:
+            close_rating_periods.start(self)
+        rating_maintenance.start(self)
+        # Every shard process shares the database file, so only the one running shard 0 backs it up.
+        if BACKUP_INTERVAL_HOURS and (self.shard_ids is None or 0 in self.shard_ids):
+            scheduled_backups.start(self)
+        metrics.add_gauge_source(self.collect_gauges)
+        if STALL_THRESHOLD_MS:
+            self.stall_detector = StallDetector(STALL_THRESHOLD_MS / 1000)
+            self.stall_detector.start()
+            print(f"Stall detector reporting event loop stalls over {STALL_THRESHOLD_MS}ms.")
+        if METRICS_PORT:
+            self.metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT)
+            print(f"Metrics served on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        print(f"Rating engine: {rating_engine.name}.")
+        # Global commands are shared by every shard process, so only the one running shard 0 syncs them.
+        if self.shard_ids is None or 0 in self.shard_ids:
+            if await self.sync_commands(force=FORCE_COMMAND_SYNC):
+                print("Commands synced globally.")
+            else:
+                print("Command definitions unchanged since the last sync; sync skipped.")
+        print(f"Startup finished in {time.perf_counter() - started:.2f}s.")
+
+    async def collect_gauges(self) -> list[tuple[str, dict, float]]:
+        """Scrape-time gauges for the metrics endpoint."""
+        by_status = await self.db.read(count_matches_by_status)
+        samples = [("elo_matches", {"status": status}, by_status.get(status, 0)) for status in ("pending", "disputed")]
+        samples += [("elo_matches", {"status": status}, count) for status, count in by_status.items() if status not in ("pending", "disputed")]
+        samples.append(("elo_scheduled_expiries", {}, len(self.expiry)))
+        samples.append(("elo_queue_size", {}, sum(len(state.matchmaker.queue) for state in self.guild_states.values())))
+        samples.append(("elo_cleanup_outstanding", {}, self.cleanup.outstanding))
+        # Listing the backup directory is file system work, so it stays off the event loop.
+        newest = await asyncio.to_thread(newest_backup, BACKUP_DIR)
+        if newest is not None:
+            samples.append(("elo_backup_last_success_timestamp", {}, newest.st_mtime))
+            samples.append(("elo_backup_last_bytes", {}, newest.st_size))
+        return samples
 
     async def on_ready(self):
-        check_stale_matches.start(self)  # Pass client instance to the task
         print(f'Bot connected as {self.user} (ID: {self.user.id})!')
         print('------')
 
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.members.invalidate(after.guild.id, after.id)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        self.members.invalidate(payload.guild_id, payload.user.id)
+
     async def close(self):
         """Properly close resources when the bot is shutting down."""
-        if self.db_conn:
-            self.db_conn.close()
-            print("Database connection closed.")
+        self.expiry.stop()
+        self.cleanup.stop()
+        for state in self.guild_states.values():
+            state.matchmaker.stop()
+        close_rating_periods.cancel()
+        rating_maintenance.cancel()
+        scheduled_backups.cancel()
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.stall_detector:
+            self.stall_detector.stop()
+        await self.db.close()
+        print("Database connections closed.")
         await super().close()
 
 intents = discord.Intents.default()
 intents.members = True
-client = MyClient(intents=intents)
+client = MyClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
 
 # --- MATCH RESOLUTION HELPER ---
 # This centralized function prevents code duplication.
@@ -199,16 +3443,24 @@ async def _resolve_match_logic(client: MyClient, guild: discord.Guild, match_dat
     Handles all logic for resolving a match.
     Determines winner/loser, updates stats, and generates the result message.
     Returns the result message string and an optional View for disputed matches.
+    Every status change is conditional on the match still being pending, so if
+    another path resolved it first the message is empty and nothing is written.
     """
-    p1_id, p2_id = int(match_data['player1_id']), int(match_data['player2_id'])
+    p1_id, p2_id = match_data['player1_id'], match_data['player2_id']
     p1_report, p2_report = match_data['player1_report'], match_data['player2_report']
-    match_id = match_data['match_id']
+    match_id, guild_id = match_data['match_id'], match_data['guild_id']
 
-    try:
-        player1 = await guild.fetch_member(p1_id)
-        player2 = await guild.fetch_member(p2_id)
-    except discord.NotFound:
-        update_match_status(client.db_conn, match_id, "error_player_not_found")
+    def release():
+        """Once the match has left 'pending', it no longer needs its expiry deadline or blocks a rematch."""
+        client.expiry.cancel(match_id)
+        client.guild_state(guild_id).challenges.end_match(match_id)
+
+    members = await client.members.resolve_many(guild, [p1_id, p2_id])
+    player1, player2 = members.get(p1_id), members.get(p2_id)
+    if player1 is None or player2 is None:
+        if not await client.db.update_match_status(match_id, "error_player_not_found"):
+            return "", None
+        release()
         return f"Could not resolve match `{match_id}` because a player left the server.", None
 
     winner, loser = None, None
@@ -224,8 +3476,11 @@ async def _resolve_match_logic(client: MyClient, guild: discord.Guild, match_dat
             result_message = f"✅ **Result Confirmed** for match `{match_id}`. "
         # Case 1b: Reports conflict (both claim win or both claim loss)
         else:
-            update_match_status(client.db_conn, match_id, "disputed")
-            admin_role = discord.utils.get(guild.roles, name=ADMIN_ROLE_NAME)
+            if not await client.db.update_match_status(match_id, "disputed"):
+                return "", None
+            release()
+            config = await client.get_guild_config(guild_id)
+            admin_role = guild.get_role(config.admin_role_id) if config.admin_role_id else discord.utils.get(guild.roles, name=ADMIN_ROLE_NAME)
             admin_mention = f"<@&{admin_role.id}>" if admin_role else f"an **{ADMIN_ROLE_NAME}**"
             result_message = (f"🚨 **Report Conflict** in match `{match_id}` between "
                               f"{player1.mention} and {player2.mention}.\n"
@@ -247,44 +3502,112 @@ async def _resolve_match_logic(client: MyClient, guild: discord.Guild, match_dat
 
     # Case 3: Neither player reported before timeout
     else:
-        update_match_status(client.db_conn, match_id, "timed_out")
+        if not await client.db.update_match_status(match_id, "timed_out"):
+            return "", None
+        release()
         result_message = f"❌ **Match Expired** (`{match_id}`). Neither player reported in time."
+        if match_id in client.tournaments:
+            result_message += " An admin can advance a player with `/admin_tournament_walkover`."
         return result_message, None
 
     # If a winner was determined, update ELO and finalize the message
     if winner and loser:
-        new_winner_elo, new_loser_elo = update_elo_and_stats(client.db_conn, winner.id, loser.id)
-        update_match_status(client.db_conn, match_id, "confirmed")
-        if new_winner_elo is not None:
-            result_message += f"**{winner.mention} has defeated {loser.mention}!**\n"
-            result_message += f"ELO: {winner.display_name} (`{new_winner_elo}`) | {loser.display_name} (`{new_loser_elo}`)"
-        else:
-            result_message = f"Could not update ELO for match `{match_id}` due to a data error."
+        outcome = await client.db.apply_match_result(guild_id, match_id, winner.id, loser.id)
+        if outcome is None:
+            # Another report, the expiry or an admin resolved the match first.
+            return "", None
+        if outcome == (None, None):
+            # A player record is missing, so nothing was written and the match is still open.
+            return (f"Could not update ELO for match `{match_id}` because a player record is missing. "
+                    f"An admin can resolve it with `/admin_resolve_match`."), None
+        release()
+        client.tournaments.on_match_decided(match_id)
+        new_winner_elo, new_loser_elo = outcome
+        result_message += f"**{winner.mention} has defeated {loser.mention}!**\n"
+        result_message += f"ELO: {winner.display_name} (`{new_winner_elo}`) | {loser.display_name} (`{new_loser_elo}`)"
+        if rating_engine.batched:
+            result_message += "\nRatings will update when the current rating period closes."
 
     return result_message, final_view
 
+# --- MATCH CREATION ---
+
+async def register_match(client: MyClient, match_id: str, guild_id: int, p1_id: int, p2_id: int, msg_id: Optional[int], ch_id: int):
+    """Writes a new pending match and arms its report deadline."""
+    challenges = client.guild_state(guild_id).challenges
+    # Indexed before the write so no new challenge between the pair slips in meanwhile.
+    challenges.begin_match(match_id, p1_id, p2_id)
+    try:
+        await client.db.create_match_record(match_id, guild_id, p1_id, p2_id, msg_id, ch_id)
+    except Exception:
+        challenges.end_match(match_id)
+        raise
+    client.expiry.schedule(match_id, match_deadline(int(time.time())))
+
+async def start_queued_match(client: MyClient, guild_id: int, p1_id: int, p2_id: int):
+    """Posts a match for two players paired by a guild's matchmaking queue."""
+    guild = client.get_guild(guild_id)
+    config = await client.get_guild_config(guild_id)
+    channel = guild.get_channel(config.channel_id) if guild and config.channel_id else None
+    if not channel:
+        print(f"Could not find the ELO channel of guild {guild_id}. Queued match between {p1_id} and {p2_id} skipped.")
+        return
+    state = client.guild_state(guild_id)
+
+    members = await client.members.resolve_many(guild, [p1_id, p2_id])
+    player1, player2 = members.get(p1_id), members.get(p2_id)
+    if player1 is None or player2 is None:
+        # Whoever is still here goes back in the queue, keeping the wait they had built up.
+        for member in (player1, player2):
+            if member is not None:
+                state.matchmaker.requeue(member.id, state.rank_index.rating(member.id) or INITIAL_ELO)
+        return
+
+    # The record exists before the buttons are posted; the message ID is filled in after.
+    match_id = uuid.uuid4().hex[:8]
+    await register_match(client, match_id, guild_id, p1_id, p2_id, None, channel.id)
+    embed = discord.Embed(
+        title="🎯 Ranked Match Found!",
+        description=f"{player1.mention} (`{state.rank_index.rating(p1_id)}`) vs {player2.mention} (`{state.rank_index.rating(p2_id)}`)",
+        color=discord.Color.green()
+    )
+    embed.set_footer(text=f"Match ID: {match_id} | Both players have {REPORT_TIMEOUT_HOURS} hour(s) to report the result.")
+    message = await channel.send(f"{player1.mention} {player2.mention}", embed=embed, view=MatchResultView(match_id))
+    await client.db.set_match_message(match_id, message.id)
+
 # --- INTERACTIVE UI (VIEWS) ---
 
-class MatchResultView(discord.ui.View):
-    def __init__(self, client_instance: MyClient, player1: discord.Member, player2: discord.Member, match_id: str):
-        super().__init__(timeout=REPORT_TIMEOUT_HOURS * 3600)
-        self.client = client_instance
-        self.player1 = player1
-        self.player2 = player2
+# Match report buttons are persistent dynamic items: the match ID is encoded in
+# each button's custom_id and every click is routed to `MatchReportButton`, which
+# reads the match state from the database. Nothing is kept in memory per open
+# match, and buttons keep working across restarts and deploys.
+
+class MatchReportButton(discord.ui.DynamicItem[discord.ui.Button], template=r'elo:report:(?P<result>won|lost):(?P<match_id>[0-9a-f]+)'):
+    """An "I Won!" / "I Lost" button for one match."""
+    def __init__(self, match_id: str, won: bool):
+        super().__init__(discord.ui.Button(
+            label="I Won!" if won else "I Lost",
+            style=discord.ButtonStyle.success if won else discord.ButtonStyle.danger,
+            custom_id=f"elo:report:{'won' if won else 'lost'}:{match_id}",
+        ))
         self.match_id = match_id
-        self.message: Optional[discord.Message] = None
+        self.won = won
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls(match['match_id'], match['result'] == 'won')
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         """
         Checks if the interacting user is allowed to use the buttons.
         Also checks if the match is still pending to prevent race conditions.
         """
-        match_data = get_match(self.client.db_conn, self.match_id)
+        match_data = await interaction.client.db.get_match(self.match_id)
         if not match_data or match_data['status'] != 'pending':
             await interaction.response.send_message("This match has already been resolved or expired.", ephemeral=True)
             return False
 
-        is_participant = interaction.user.id in [self.player1.id, self.player2.id]
+        is_participant = interaction.user.id in [match_data['player1_id'], match_data['player2_id']]
         if not is_participant:
             await interaction.response.send_message("You are not a participant in this match.", ephemeral=True)
             return False
@@ -292,58 +3615,170 @@ class MatchResultView(discord.ui.View):
         voted_p1 = match_data['player1_report'] is not None
         voted_p2 = match_data['player2_report'] is not None
 
-        has_voted = (interaction.user.id == self.player1.id and voted_p1) or \
-                    (interaction.user.id == self.player2.id and voted_p2)
+        has_voted = (interaction.user.id == match_data['player1_id'] and voted_p1) or \
+                    (interaction.user.id == match_data['player2_id'] and voted_p2)
         if has_voted:
             await interaction.response.send_message("You have already reported a result for this match.", ephemeral=True)
             return False
 
         return True
 
-    async def finalize_match(self, channel: discord.TextChannel):
-        """Finalizes the match by calling the central logic helper."""
-        match_data = get_match(self.client.db_conn, self.match_id)
-        if not match_data or match_data['status'] != 'pending':
-            return
+    @instrumented("report_button")
+    async def callback(self, interaction: discord.Interaction):
+        """Handles a win/loss report from a player."""
+        client = interaction.client
+        report_value = 1 if self.won else 0
+        await client.db.update_match_report(self.match_id, interaction.user.id, report_value)
 
-        result_message, final_view = await _resolve_match_logic(self.client, channel.guild, match_data)
+        await interaction.response.send_message(f"You have reported a **{'win' if self.won else 'loss'}**. Waiting for the opponent...", ephemeral=True)
 
-        if result_message:
-            await channel.send(result_message, view=final_view)
+        # Check if both players have now voted
+        match_data = await client.db.get_match(self.match_id)
+        if match_data['player1_report'] is not None and match_data['player2_report'] is not None:
+            # Buttons handed out by a tournament menu live on an ephemeral message that can't be edited later.
+            message = None if interaction.message.flags.ephemeral else interaction.message
+            await finalize_match(client, self.match_id, interaction.channel, message)
 
-        # Reliably disable buttons on the original message, with robust error handling
-        if self.message:
-            try:
-                await self.message.edit(view=None)
-            except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
-                print(f"Could not edit message for match {self.match_id}. Error: {e}")
+class MatchResultView(discord.ui.View):
+    """
+    The report buttons for one match. The view holds no state, so it is stopped
+    straight away and never kept in the view store; clicks reach
+    `MatchReportButton` through the dynamic item registry instead.
+    """
+    def __init__(self, match_id: str):
+        super().__init__(timeout=None)
+        self.add_item(MatchReportButton(match_id, won=True))
+        self.add_item(MatchReportButton(match_id, won=False))
+        self.stop()
+
+async def finalize_match(client: MyClient, match_id: str, channel: discord.abc.Messageable, message: Optional[discord.Message]):
+    """Finalizes the match by calling the central logic helper."""
+    match_data = await client.db.get_match(match_id)
+    if not match_data or match_data['status'] != 'pending':
+        return
+
+    result_message, final_view = await _resolve_match_logic(client, channel.guild, match_data)
+
+    if result_message:
+        await channel.send(result_message, view=final_view)
+
+    # Reliably disable buttons on the original message, with robust error handling
+    if message:
+        try:
+            await message.edit(view=None)
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+            print(f"Could not edit message for match {match_id}. Error: {e}")
 
+def build_leaderboard_embed(interaction: discord.Interaction, state: GuildState, page: LeaderboardPage) -> discord.Embed:
+    """Wraps a cached leaderboard page in an embed with a per-viewer footer."""
+    embed = discord.Embed(title="🏆 Fatal Fury Leaderboard 🏆", description="The top fighters on the server.", color=discord.Color.gold())
+    embed.add_field(name="Top Players" if page.number == 0 else "Rankings", value=page.text, inline=False)
+    footer = f"Page {page.number + 1}/{state.leaderboard.page_count()}"
+    caller_rank = state.rank_index.rank(interaction.user.id)
+    if caller_rank is not None:
+        footer += f" • You are ranked #{caller_rank} of {len(state.rank_index)}."
+    embed.set_footer(text=footer)
+    return embed
+
+class LeaderboardPageButton(discord.ui.DynamicItem[discord.ui.Button], template=r'elo:leaderboard:(?P<direction>prev|next):(?P<page>\d+)'):
+    """A previous/next button that flips a leaderboard message to another page."""
+    def __init__(self, direction: str, page: int, disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            label="◀ Previous" if direction == "prev" else "Next ▶",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"elo:leaderboard:{direction}:{page}",
+            disabled=disabled,
+        ))
+        self.direction = direction
+        self.page = page
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls(match['direction'], int(match['page']))
+
+    @instrumented("leaderboard_button")
+    async def callback(self, interaction: discord.Interaction):
+        state = interaction.client.guild_state(interaction.guild_id)
+        page = await state.leaderboard.get_page(self.page)
+        if page is None:
+            await interaction.response.send_message("That leaderboard page no longer exists.", ephemeral=True)
+            return
+        await interaction.response.edit_message(embed=build_leaderboard_embed(interaction, state, page), view=LeaderboardView(state.leaderboard, page.number))
+
+class LeaderboardView(discord.ui.View):
+    """Stateless previous/next buttons for a leaderboard message (see `MatchResultView`)."""
+    def __init__(self, leaderboard: LeaderboardService, page: int):
+        super().__init__(timeout=None)
+        self.add_item(LeaderboardPageButton("prev", max(page - 1, 0), disabled=page == 0))
+        self.add_item(LeaderboardPageButton("next", page + 1, disabled=page + 1 >= leaderboard.page_count()))
         self.stop()
 
-    async def on_timeout(self):
-        """Handles the case where the view times out before both players report."""
-        if self.message:
-            await self.finalize_match(self.message.channel)
+class TournamentJoinButton(discord.ui.DynamicItem[discord.ui.Button], template=r'elo:tournament:join:(?P<tournament_id>[0-9a-f]+)'):
+    """Signs the clicking player up for a tournament, or takes them off the list if they already are."""
+    def __init__(self, tournament_id: str):
+        super().__init__(discord.ui.Button(
+            label="Join / Leave",
+            style=discord.ButtonStyle.primary,
+            custom_id=f"elo:tournament:join:{tournament_id}",
+        ))
+        self.tournament_id = tournament_id
 
-    async def handle_report(self, interaction: discord.Interaction, won: bool):
-        """Handles a win/loss report from a player."""
-        report_value = 1 if won else 0
-        update_match_report(self.client.db_conn, self.match_id, interaction.user.id, report_value)
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls(match['tournament_id'])
 
-        await interaction.response.send_message(f"You have reported a **{'win' if won else 'loss'}**. Waiting for the opponent...", ephemeral=True)
+    @instrumented("tournament_join")
+    async def callback(self, interaction: discord.Interaction):
+        client = interaction.client
+        if client.guild_state(interaction.guild_id).rank_index.rating(interaction.user.id) is None:
+            await client.db.add_player_if_not_exists(interaction.guild_id, interaction.user.id, interaction.user.display_name)
+        joined, count = await client.db.write(toggle_tournament_entry, self.tournament_id, interaction.user.id, TOURNAMENT_MAX_PLAYERS)
+        if joined is None:
+            text = "This tournament is full." if count >= TOURNAMENT_MAX_PLAYERS else "Sign-ups for this tournament are closed."
+        elif joined:
+            text = f"You are signed up! {count} player(s) so far."
+        else:
+            text = f"You left the tournament. {count} player(s) signed up."
+        await interaction.response.send_message(text, ephemeral=True)
 
-        # Check if both players have now voted
-        match_data = get_match(self.client.db_conn, self.match_id)
-        if match_data['player1_report'] is not None and match_data['player2_report'] is not None:
-            await self.finalize_match(interaction.channel)
+class TournamentJoinView(discord.ui.View):
+    """Stateless sign-up button for a tournament (see `MatchResultView`)."""
+    def __init__(self, tournament_id: str):
+        super().__init__(timeout=None)
+        self.add_item(TournamentJoinButton(tournament_id))
+        self.stop()
 
-    @discord.ui.button(label="I Won!", style=discord.ButtonStyle.success, custom_id="i_won")
-    async def i_won_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.handle_report(interaction, won=True)
+class TournamentReportSelect(discord.ui.DynamicItem[discord.ui.Select], template=r'elo:tournament:report:(?P<tournament_id>[0-9a-f]+):(?P<round>\d+):(?P<part>\d+)'):
+    """The menu under a batch of tournament pairings. Picking a match answers with its report buttons."""
+    def __init__(self, tournament_id: str, round_number: int, part: int, options: list[discord.SelectOption]):
+        super().__init__(discord.ui.Select(
+            placeholder="Pick your match to report the result",
+            options=options,
+            custom_id=f"elo:tournament:report:{tournament_id}:{round_number}:{part}",
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match: re.Match[str]):
+        return cls(match['tournament_id'], int(match['round']), int(match['part']), item.options)
+
+    @instrumented("tournament_report_select")
+    async def callback(self, interaction: discord.Interaction):
+        match_id = self.item.values[0]
+        match_data = await interaction.client.db.get_match(match_id)
+        if not match_data or match_data['status'] != 'pending':
+            await interaction.response.send_message("This match has already been resolved or expired.", ephemeral=True)
+            return
+        if interaction.user.id not in (match_data['player1_id'], match_data['player2_id']):
+            await interaction.response.send_message("You are not a participant in this match.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"Report the result of match `{match_id}`:", view=MatchResultView(match_id), ephemeral=True)
 
-    @discord.ui.button(label="I Lost", style=discord.ButtonStyle.danger, custom_id="i_lost")
-    async def i_lost_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.handle_report(interaction, won=False)
+class TournamentReportView(discord.ui.View):
+    """Stateless match menu for a batch of tournament pairings (see `MatchResultView`)."""
+    def __init__(self, tournament_id: str, round_number: int, part: int, options: list[discord.SelectOption]):
+        super().__init__(timeout=None)
+        self.add_item(TournamentReportSelect(tournament_id, round_number, part, options))
+        self.stop()
 
 class ChallengeView(discord.ui.View):
     """A view to handle the challenge acceptance phase."""
@@ -354,6 +3789,10 @@ class ChallengeView(discord.ui.View):
         self.opponent = opponent
         self.message: Optional[discord.Message] = None
 
+    def release(self):
+        """Frees the pair and the challenger's outgoing slot in the guild's challenge index."""
+        self.client.guild_state(self.challenger.guild.id).challenges.close(self.challenger.id, self.opponent.id)
+
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         """Only the opponent can interact with these buttons."""
         if interaction.user != self.opponent:
@@ -363,6 +3802,7 @@ class ChallengeView(discord.ui.View):
 
     async def on_timeout(self) -> None:
         """Handles the case where the challenge invitation times out."""
+        self.release()
         if self.message:
             embed = self.message.embeds[0]
             embed.color = discord.Color.dark_grey()
@@ -370,30 +3810,39 @@ class ChallengeView(discord.ui.View):
             await self.message.edit(embed=embed, view=None)
 
     @discord.ui.button(label="Accept", style=discord.ButtonStyle.success)
+    @instrumented("challenge_accept")
     async def accept_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Handles the challenge being accepted."""
         self.stop()
         match_id = uuid.uuid4().hex[:8]
-        view = MatchResultView(self.client, self.challenger, self.opponent, match_id)
+
+        try:
+            # Players only get rows once a challenge turns into a match; known players need no write.
+            rank_index = self.client.guild_state(interaction.guild_id).rank_index
+            for member in (self.challenger, self.opponent):
+                if rank_index.rating(member.id) is None:
+                    await self.client.db.add_player_if_not_exists(interaction.guild_id, member.id, member.display_name)
+            # The match reuses the challenge message, so its record can be written before
+            # the buttons appear and a click can never arrive for an unknown match.
+            await register_match(self.client, match_id, interaction.guild_id, self.challenger.id, self.opponent.id,
+                                 interaction.message.id, interaction.channel_id)
+        finally:
+            # Released once the match is indexed, so the pair is never free in between.
+            self.release()
 
         # Edit the original message to show the challenge was accepted
         embed = interaction.message.embeds[0]
         embed.color = discord.Color.green()
         embed.description = f"{self.opponent.mention} has accepted the challenge from {self.challenger.mention}!"
         embed.set_footer(text=f"Match ID: {match_id} | Both players have {REPORT_TIMEOUT_HOURS} hour(s) to report the result.")
-        await interaction.response.edit_message(embed=embed, view=view)
-
-        # Update the view instance with the new message
-        message = await interaction.original_response()
-        view.message = message
-
-        # Create the match record in the database
-        create_match_record(self.client.db_conn, match_id, self.challenger.id, self.opponent.id, message.id, message.channel.id)
+        await interaction.response.edit_message(embed=embed, view=MatchResultView(match_id))
 
     @discord.ui.button(label="Decline", style=discord.ButtonStyle.danger)
+    @instrumented("challenge_decline")
     async def decline_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Handles the challenge being declined."""
         self.stop()
+        self.release()
         embed = interaction.message.embeds[0]
         embed.color = discord.Color.red()
         embed.description = f"{self.opponent.mention} has declined the challenge from {self.challenger.mention}."
@@ -402,19 +3851,56 @@ class ChallengeView(discord.ui.View):
 
 # --- SLASH COMMANDS ---
 
+async def check_elo_channel(interaction: discord.Interaction) -> bool:
+    """Tells the user and returns False if the guild limits ELO commands to another channel."""
+    config = await interaction.client.get_guild_config(interaction.guild_id)
+    if config.channel_id is not None and interaction.channel_id != config.channel_id:
+        await interaction.response.send_message("This command can only be used in the designated ELO channel.", ephemeral=True)
+        return False
+    return True
+
+def elo_admin_only():
+    """Like `app_commands.checks.has_role`, with the role set by /admin_configure or ADMIN_ROLE_NAME."""
+    async def predicate(interaction: discord.Interaction) -> bool:
+        config = await interaction.client.get_guild_config(interaction.guild_id)
+        role = config.admin_role_id or ADMIN_ROLE_NAME
+        if isinstance(interaction.user, discord.Member):
+            if isinstance(role, int) and interaction.user.get_role(role):
+                return True
+            if isinstance(role, str) and discord.utils.get(interaction.user.roles, name=role):
+                return True
+        raise app_commands.MissingRole(role)
+    return app_commands.check(predicate)
+
 @client.tree.command(name="challenge", description="Challenge another player to a ranked match.")
 @app_commands.describe(opponent="The player you want to challenge.")
+@instrumented("/challenge")
 async def challenge_command(interaction: discord.Interaction, opponent: discord.Member):
-    if interaction.channel_id != CHANNEL_ID:
-        await interaction.response.send_message(f"This command can only be used in the designated ELO channel.", ephemeral=True)
+    if not await check_elo_channel(interaction):
         return
 
     if opponent.bot or opponent.id == interaction.user.id:
         await interaction.response.send_message("You cannot challenge a bot or yourself.", ephemeral=True)
         return
 
-    add_player_if_not_exists(interaction.client.db_conn, interaction.user.id, interaction.user.display_name)
-    add_player_if_not_exists(interaction.client.db_conn, opponent.id, opponent.display_name)
+    # Duplicates and spam are turned away here, before any database or Discord work.
+    challenges = interaction.client.guild_state(interaction.guild_id).challenges
+    conflict = challenges.conflict(interaction.user.id, opponent.id)
+    retry_after = 0.0
+    if conflict is None:
+        retry_after = interaction.client.challenge_throttle.take(interaction.user.id)
+        conflict = "throttled" if retry_after else None
+    if conflict is not None:
+        metrics.inc("elo_challenges_rejected_total", reason=conflict)
+        reasons = {
+            "duplicate": f"There is already an open challenge between you and {opponent.display_name}.",
+            "pending_match": f"You already have a pending match against {opponent.display_name}. Report it first.",
+            "outgoing": "You already have an open challenge. Wait for it to be answered or to expire.",
+            "throttled": f"You are sending challenges too quickly. Try again in {math.ceil(retry_after)} seconds.",
+        }
+        await interaction.response.send_message(reasons[conflict], ephemeral=True)
+        return
+    challenges.open(interaction.user.id, opponent.id)
 
     # Use the new ChallengeView to handle acceptance
     view = ChallengeView(client, interaction.user, opponent)
@@ -426,61 +3912,109 @@ async def challenge_command(interaction: discord.Interaction, opponent: discord.
     )
     embed.set_footer(text=f"The opponent has {CHALLENGE_TIMEOUT_SECONDS // 60} minutes to respond.")
 
-    await interaction.response.send_message(opponent.mention, embed=embed, view=view)
+    try:
+        await interaction.response.send_message(opponent.mention, embed=embed, view=view)
+    except Exception:
+        view.stop()
+        view.release()
+        raise
     message = await interaction.original_response()
     view.message = message
 
 @client.tree.command(name="stats", description="Show your stats or another player's stats.")
 @app_commands.describe(player="The player whose stats you want to see (optional).")
+@instrumented("/stats")
 async def stats_command(interaction: discord.Interaction, player: Optional[discord.Member] = None):
-    if interaction.channel_id != CHANNEL_ID:
-        await interaction.response.send_message(f"This command can only be used in the designated ELO channel.", ephemeral=True)
+    if not await check_elo_channel(interaction):
         return
 
     target_user = player or interaction.user
-    player_data = get_player(interaction.client.db_conn, target_user.id)
+    player_data = await interaction.client.db.get_player(interaction.guild_id, target_user.id)
     if not player_data:
         await interaction.response.send_message(f"{target_user.display_name} has not played any matches yet.", ephemeral=True)
         return
 
     embed = discord.Embed(title=f"📊 Stats for {player_data['user_name']}", color=discord.Color.blue())
     embed.set_thumbnail(url=target_user.display_avatar.url)
-    embed.add_field(name="ELO Rating", value=f"**{player_data['elo_rating']}**", inline=False)
+    rating_text = f"**{player_data['elo_rating']}**"
+    if rating_engine.name == "glicko2" and player_data['glicko_rd'] is not None:
+        rating_text += f" ± {round(2 * player_data['glicko_rd'])}"
+    embed.add_field(name="ELO Rating", value=rating_text, inline=False)
+    rank_index = interaction.client.guild_state(interaction.guild_id).rank_index
+    rank = rank_index.rank(target_user.id)
+    if rank is not None:
+        rank_text = f"#{rank} of {len(rank_index)}"
+        if rank > 1:
+            # The rank-1 players above are positions 0..rank-2; the last one is the closest.
+            user_above, rating_above = rank_index.entry_at(rank - 2)
+            rank_text += f" ({rating_above - player_data['elo_rating']} ELO behind #{rank_index.rank(user_above)})"
+        embed.add_field(name="Server Rank", value=rank_text, inline=False)
     embed.add_field(name="Wins", value=player_data['wins'], inline=True)
     embed.add_field(name="Losses", value=player_data['losses'], inline=True)
     win_rate = (player_data['wins'] / player_data['games_played'] * 100) if player_data['games_played'] > 0 else 0
     embed.add_field(name="Win Rate", value=f"{win_rate:.2f}%", inline=False)
+    history = await interaction.client.db.get_rating_history(interaction.guild_id, target_user.id)
+    if len(history) > 1:
+        peak = max(await interaction.client.db.get_peak_rating(interaction.guild_id, target_user.id), player_data['elo_rating'])
+        embed.add_field(name="Rating Trend", inline=False,
+                        value=f"`{sparkline([rating for _, rating in history])}`\n"
+                              f"Since <t:{history[0][0]}:d>: {history[0][1]} → {history[-1][1]} | Peak: **{peak}**")
+    opponents = await interaction.client.db.get_top_opponents(interaction.guild_id, target_user.id)
+    if opponents:
+        embed.add_field(name="Most Played Opponents", inline=False, value="\n".join(
+            f"**{o['user_name'] or o['opponent_id']}**: {o['wins']}W - {o['losses']}L" for o in opponents))
+
+    await interaction.response.send_message(embed=embed)
+
+@client.tree.command(name="h2h", description="Show the head-to-head record between two players.")
+@app_commands.describe(player_a="The first player.", player_b="The second player.")
+@instrumented("/h2h")
+async def h2h_command(interaction: discord.Interaction, player_a: discord.Member, player_b: discord.Member):
+    if not await check_elo_channel(interaction):
+        return
+    if player_a.id == player_b.id:
+        await interaction.response.send_message("Pick two different players.", ephemeral=True)
+        return
+
+    record = await interaction.client.db.get_head_to_head(interaction.guild_id, player_a.id, player_b.id)
+    if not record:
+        await interaction.response.send_message(f"{player_a.display_name} and {player_b.display_name} have not played each other yet.", ephemeral=True)
+        return
+
+    embed = discord.Embed(title=f"🤜 {player_a.display_name} vs {player_b.display_name} 🤛", color=discord.Color.blue())
+    embed.add_field(name="Record", value=f"{player_a.mention} **{record['wins']}** - **{record['losses']}** {player_b.mention}", inline=False)
+    embed.add_field(name="Matches", value=record['wins'] + record['losses'], inline=True)
+    embed.add_field(name="Last Played", value=f"<t:{record['last_played']}:R>", inline=True)
+    rank_index = interaction.client.guild_state(interaction.guild_id).rank_index
+    rating_a, rating_b = rank_index.rating(player_a.id), rank_index.rating(player_b.id)
+    if rating_a is not None and rating_b is not None:
+        expected = calculate_expected_score(rating_a, rating_b)
+        embed.add_field(name="Next Match Odds (by ELO)", inline=False,
+                        value=f"{player_a.display_name} {expected * 100:.0f}% | {player_b.display_name} {(1 - expected) * 100:.0f}%")
 
     await interaction.response.send_message(embed=embed)
 
 @client.tree.command(name="leaderboard", description="Displays the server's leaderboard.")
+@instrumented("/leaderboard")
 async def leaderboard_command(interaction: discord.Interaction):
-    if interaction.channel_id != CHANNEL_ID:
-        await interaction.response.send_message(f"This command can only be used in the designated ELO channel.", ephemeral=True)
+    if not await check_elo_channel(interaction):
         return
 
-    leaderboard_data = get_leaderboard(interaction.client.db_conn, 10)
-    if not leaderboard_data:
+    state = interaction.client.guild_state(interaction.guild_id)
+    page = await state.leaderboard.get_page(0)
+    if page is None:
         await interaction.response.send_message("There is not enough data for a leaderboard yet.", ephemeral=True)
         return
 
-    embed = discord.Embed(title="🏆 Fatal Fury Leaderboard 🏆", description="The top fighters on the server.", color=discord.Color.gold())
-    leaderboard_text = ""
-    medals = ["🥇", "🥈", "🥉"]
-    for i, player in enumerate(leaderboard_data):
-        rank = medals[i] if i < 3 else f"**#{i+1}**"
-        leaderboard_text += f"{rank} **{player['user_name']}** - {player['elo_rating']} ELO (W:{player['wins']}/L:{player['losses']})\n"
-
-    embed.add_field(name="Top Players", value=leaderboard_text, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await interaction.response.send_message(embed=build_leaderboard_embed(interaction, state, page), view=LeaderboardView(state.leaderboard, page.number))
 
 @client.tree.command(name="my_matches", description="Shows a list of your pending matches.")
+@instrumented("/my_matches")
 async def my_matches_command(interaction: discord.Interaction):
-    if interaction.channel_id != CHANNEL_ID:
-        await interaction.response.send_message(f"This command can only be used in the designated ELO channel.", ephemeral=True)
+    if not await check_elo_channel(interaction):
         return
 
-    pending_matches = get_pending_matches_for_user(interaction.client.db_conn, interaction.user.id)
+    pending_matches = await interaction.client.db.get_pending_matches_for_user(interaction.guild_id, interaction.user.id)
     if not pending_matches:
         await interaction.response.send_message("You have no pending matches!", ephemeral=True)
         return
@@ -491,16 +4025,12 @@ async def my_matches_command(interaction: discord.Interaction):
         color=discord.Color.blue()
     )
     view = discord.ui.View()
-    for match in pending_matches[:5]: # Limit to 5 to avoid clutter
-        p1_id, p2_id = int(match['player1_id']), int(match['player2_id'])
-        opponent_id = p2_id if interaction.user.id == p1_id else p1_id
-
-        try:
-            # Use fetch_member for reliability
-            opponent = await interaction.guild.fetch_member(opponent_id)
-            opponent_name = opponent.display_name
-        except discord.NotFound:
-            opponent_name = "an unknown player"
+    shown_matches = pending_matches[:5] # Limit to 5 to avoid clutter
+    opponent_ids = [m['player2_id'] if interaction.user.id == m['player1_id'] else m['player1_id'] for m in shown_matches]
+    opponents = await interaction.client.members.resolve_many(interaction.guild, opponent_ids)
+    for match, opponent_id in zip(shown_matches, opponent_ids):
+        opponent = opponents.get(opponent_id)
+        opponent_name = opponent.display_name if opponent else "an unknown player"
 
         match_url = f"https://discord.com/channels/{interaction.guild.id}/{match['channel_id']}/{match['message_id']}"
         button = discord.ui.Button(label=f"Match against {opponent_name}", style=discord.ButtonStyle.link, url=match_url)
@@ -508,104 +4038,627 @@ async def my_matches_command(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
+@client.tree.command(name="queue", description="Join the ranked queue and get matched with a similarly rated player.")
+@instrumented("/queue")
+async def queue_command(interaction: discord.Interaction):
+    if not await check_elo_channel(interaction):
+        return
+    # Queued matches are posted in the ELO channel, so the queue needs one.
+    if (await interaction.client.get_guild_config(interaction.guild_id)).channel_id is None:
+        await interaction.response.send_message("The ranked queue is not set up on this server. An admin can pick a channel with `/admin_configure`.", ephemeral=True)
+        return
+
+    state = interaction.client.guild_state(interaction.guild_id)
+    matchmaker = state.matchmaker
+    if interaction.user.id in matchmaker.queue:
+        await interaction.response.send_message("You are already in the queue. Use `/leave_queue` to leave it.", ephemeral=True)
+        return
+
+    await interaction.client.db.add_player_if_not_exists(interaction.guild_id, interaction.user.id, interaction.user.display_name)
+    rating = state.rank_index.rating(interaction.user.id)
+    if matchmaker.join(interaction.user.id, INITIAL_ELO if rating is None else rating):
+        await interaction.response.send_message("An opponent was found! Your match is being posted.", ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            f"You joined the ranked queue ({len(matchmaker.queue)} player(s) waiting). "
+            "The accepted rating range widens the longer you wait.", ephemeral=True)
+
+@client.tree.command(name="leave_queue", description="Leave the ranked queue.")
+@instrumented("/leave_queue")
+async def leave_queue_command(interaction: discord.Interaction):
+    if interaction.client.guild_state(interaction.guild_id).matchmaker.leave(interaction.user.id):
+        await interaction.response.send_message("You left the ranked queue.", ephemeral=True)
+    else:
+        await interaction.response.send_message("You are not in the queue.", ephemeral=True)
+
 @client.tree.command(name="admin_resolve_match", description="[Admin] Manually resolve a match.")
 @app_commands.describe(match_id="The ID of the match to resolve.", winner="The player who won the match.")
-@app_commands.checks.has_role(ADMIN_ROLE_NAME)
+@elo_admin_only()
+@instrumented("/admin_resolve_match")
 async def admin_resolve_command(interaction: discord.Interaction, match_id: str, winner: discord.Member):
-    if interaction.channel_id != CHANNEL_ID:
-        await interaction.response.send_message(f"This command can only be used in the designated ELO channel.", ephemeral=True)
+    if not await check_elo_channel(interaction):
         return
 
-    match_data = get_match(interaction.client.db_conn, match_id)
-    if not match_data:
+    match_data = await interaction.client.db.get_match(match_id)
+    if not match_data or match_data['guild_id'] != interaction.guild_id:
         await interaction.response.send_message(f"Match `{match_id}` was not found.", ephemeral=True)
         return
     if match_data['status'] not in ['pending', 'disputed']:
         await interaction.response.send_message(f"Match `{match_id}` has already been resolved.", ephemeral=True)
         return
 
-    p1_id, p2_id = int(match_data['player1_id']), int(match_data['player2_id'])
+    p1_id, p2_id = match_data['player1_id'], match_data['player2_id']
     if winner.id not in [p1_id, p2_id]:
         await interaction.response.send_message("The specified winner is not a participant in this match.", ephemeral=True)
         return
 
     loser_id = p2_id if winner.id == p1_id else p1_id
-    try:
-        loser = await interaction.guild.fetch_member(loser_id)
-    except discord.NotFound:
+    loser = await interaction.client.members.resolve(interaction.guild, loser_id)
+    if loser is None:
         await interaction.response.send_message(f"Could not find the loser of the match in the server.", ephemeral=True)
         return
 
-    new_winner_elo, new_loser_elo = update_elo_and_stats(interaction.client.db_conn, winner.id, loser.id)
-    update_match_status(interaction.client.db_conn, match_id, 'confirmed')
+    outcome = await interaction.client.db.apply_match_result(interaction.guild_id, match_id, winner.id, loser.id, ('pending', 'disputed'))
+    if outcome is None:
+        await interaction.response.send_message(f"Match `{match_id}` was resolved while this command was running.", ephemeral=True)
+        return
+    if outcome == (None, None):
+        await interaction.response.send_message(
+            f"Match `{match_id}` was not resolved because a player has no rating record in this server.", ephemeral=True)
+        return
+    interaction.client.expiry.cancel(match_id)
+    interaction.client.guild_state(interaction.guild_id).challenges.end_match(match_id)
+    interaction.client.tournaments.on_match_decided(match_id)
+    new_winner_elo, new_loser_elo = outcome
 
     embed = discord.Embed(title="⚖️ Match Resolution by Admin ⚖️", color=discord.Color.dark_orange())
     embed.description = f"Match `{match_id}` has been resolved by {interaction.user.mention}."
     embed.add_field(name="Result", value=f"**Winner:** {winner.mention}\n**Loser:** {loser.mention}", inline=False)
-    if new_winner_elo is not None:
-        embed.add_field(name="Updated ELO", value=f"{winner.display_name}: `{new_winner_elo}`\n{loser.display_name}: `{new_loser_elo}`", inline=False)
+    embed.add_field(name="Updated ELO", value=f"{winner.display_name}: `{new_winner_elo}`\n{loser.display_name}: `{new_loser_elo}`", inline=False)
 
     await interaction.response.send_message(embed=embed)
 
 @admin_resolve_command.error
-async def admin_resolve_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+async def admin_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    """Shared error handler for the admin-only commands."""
+    # Commands that deferred must answer through the followup webhook instead.
+    send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
     if isinstance(error, app_commands.errors.MissingRole):
-        await interaction.response.send_message(f"You need the `{ADMIN_ROLE_NAME}` role to use this command.", ephemeral=True)
+        role = error.missing_role
+        await send(f"You need the {f'<@&{role}>' if isinstance(role, int) else f'`{role}`'} role to use this command.", ephemeral=True)
+    elif isinstance(error, app_commands.errors.MissingPermissions):
+        await send("You need the Manage Server permission to use this command.", ephemeral=True)
     else:
-        await interaction.response.send_message("An unexpected error occurred while running this command.", ephemeral=True)
-        print(f"An error occurred in admin_resolve_match: {error}")
+        await send("An unexpected error occurred while running this command.", ephemeral=True)
+        print(f"An error occurred in {interaction.command.name if interaction.command else 'an admin command'}: {error}")
+
+@client.tree.command(name="admin_replay_ratings", description="[Admin] Recompute all ratings from the match ledger.")
+@app_commands.describe(
+    k_factor="K-factor to replay with (defaults to this server's value).",
+    initial_elo="Starting rating to replay with (defaults to the live value).",
+    apply="Overwrite live ratings with the result. Only allowed with the live settings."
+)
+@elo_admin_only()
+@instrumented("/admin_replay_ratings")
+async def admin_replay_command(interaction: discord.Interaction, k_factor: Optional[float] = None,
+                               initial_elo: Optional[int] = None, apply: bool = False):
+    guild_id = interaction.guild_id
+    config = await interaction.client.get_guild_config(guild_id)
+    live_k_factor = K_FACTOR if config.k_factor is None else config.k_factor
+    k_factor = live_k_factor if k_factor is None else k_factor
+    initial_elo = INITIAL_ELO if initial_elo is None else initial_elo
+    if apply and (k_factor != live_k_factor or initial_elo != INITIAL_ELO):
+        await interaction.response.send_message("What-if replays with custom settings can't be applied.", ephemeral=True)
+        return
+    # The replay is Elo; under another engine `elo_rating` holds that engine's ratings.
+    if apply and rating_engine.name != EloEngine.name:
+        await interaction.response.send_message(
+            f"Replays are computed with Elo and can't be applied while the {rating_engine.name} rating engine is active.", ephemeral=True)
+        return
 
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    db = interaction.client.db
+    result = await db.read(replay_ratings_from_ledger, guild_id, k_factor, initial_elo)
+    user_ids = result["user_ids"].tolist()
+    ratings = result["ratings"].tolist()
 
-# --- BACKGROUND TASK ---
+    # Compare against live ratings from the rank index to find the biggest movers.
+    rank_index = interaction.client.guild_state(guild_id).rank_index
+    live = {u: initial_elo if rank_index.rating(u) is None else rank_index.rating(u) for u in user_ids}
+    deltas = sorted(((r - live[u], u, r) for u, r in zip(user_ids, ratings)), key=lambda d: abs(d[0]), reverse=True)[:10]
+    names = await db.read(get_player_names, guild_id, [u for _, u, _ in deltas])
 
-@tasks.loop(minutes=5)
-async def check_stale_matches(client: MyClient):
-    """Periodically checks for and resolves expired matches."""
-    guild = client.get_guild(GUILD_ID)
-    if not guild:
-        print("Could not find the configured guild. Stale match check skipped.")
+    embed = discord.Embed(title="🔁 Rating Replay", color=discord.Color.dark_teal())
+    embed.description = (f"Replayed **{result['matches']}** ledger matches for **{len(user_ids)}** players "
+                         f"in {result['seconds'] * 1000:.0f} ms (K={k_factor:g}, initial ELO={initial_elo}).")
+    movers = "\n".join(f"**{names.get(u, u)}**: {live[u]} → {r} ({d:+d})" for d, u, r in deltas if d)
+    embed.add_field(name="Largest Differences vs Live", value=movers or "Replay matches the live ratings.", inline=False)
+
+    if apply:
+        unledgered = await db.read(count_unledgered_matches, guild_id)
+        if unledgered:
+            embed.add_field(name="Not Applied",
+                            value=f"{unledgered} confirmed match(es) predate the ledger with unknown outcomes.", inline=False)
+        elif await db.read(has_rating_adjustments, guild_id):
+            embed.add_field(name="Not Applied",
+                            value="Ratings were decayed or reset by a new season, which the ledger doesn't record.", inline=False)
+        elif not await db.write(apply_replayed_ratings, guild_id, result["last_entry_id"], user_ids, ratings,
+                                result["wins"].tolist(), result["losses"].tolist()):
+            embed.add_field(name="Not Applied",
+                            value="New results were confirmed while the replay ran. Run it again to include them.", inline=False)
+        else:
+            for user_id, rating in zip(user_ids, ratings):
+                db.notify_rating_change(guild_id, user_id, rating)
+            embed.add_field(name="Applied", value="Live ratings now match the replay.", inline=False)
+
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+admin_replay_command.error(admin_command_error)
+
+@client.tree.command(name="season", description="Show the current season, or the final standings of a past one.")
+@app_commands.describe(season="A past season's number (optional, defaults to the last one).")
+@instrumented("/season")
+async def season_command(interaction: discord.Interaction, season: Optional[app_commands.Range[int, 1]] = None):
+    if not await check_elo_channel(interaction):
+        return
+    db = interaction.client.db
+    current = await db.write(get_current_season, interaction.guild_id)
+    number = current['season'] - 1 if season is None else season
+    past = await db.read(get_season, interaction.guild_id, number) if number >= 1 else None
+    if season is not None and (past is None or past['status'] == 'current'):
+        await interaction.response.send_message(f"Season {season} has no final standings yet.", ephemeral=True)
         return
 
-    stale_matches = get_stale_matches(client.db_conn)
-    if not stale_matches:
+    ends = f" It ends <t:{current['started_at'] + SEASON_LENGTH_DAYS * 86400}:R>." if SEASON_LENGTH_DAYS else ""
+    embed = discord.Embed(title=f"📅 Season {current['season']}", description=f"Started <t:{current['started_at']}:D>.{ends}",
+                          color=discord.Color.teal())
+    if past is not None:
+        standings = await db.read(get_season_standings, interaction.guild_id, number)
+        lines = [f"{LeaderboardService.MEDALS[i] if i < 3 else f'**#{i + 1}**'} **{row['user_name']}** - {row['elo_rating']} ELO (W:{row['wins']}/L:{row['losses']})"
+                 for i, row in enumerate(standings)]
+        if past['status'] == 'rolling':
+            lines.append("Final standings are still being archived.")
+        embed.add_field(name=f"Season {number} Final Standings", value="\n".join(lines) or "Nobody played this season.", inline=False)
+        finish = await db.read(get_season_finish, interaction.guild_id, number, interaction.user.id)
+        if finish is not None:
+            rank, standing = finish
+            embed.set_footer(text=f"You finished season {number} ranked #{rank} with {standing['elo_rating']} ELO.")
+    await interaction.response.send_message(embed=embed)
+
+@client.tree.command(name="admin_new_season", description="[Admin] End the current season now, archive its standings and soft-reset ratings.")
+@elo_admin_only()
+@instrumented("/admin_new_season")
+async def admin_new_season_command(interaction: discord.Interaction):
+    client = interaction.client
+    if client.maintenance_lock.locked():
+        await interaction.response.send_message("Rating maintenance is running. Try again in a minute.", ephemeral=True)
         return
+    await interaction.response.defer(thinking=True)
+    async with client.maintenance_lock:
+        season, report = await roll_over_season(client, interaction.guild_id)
+    await interaction.followup.send(
+        f"📅 **Season {season} is over!** Its final standings are saved (see `/season`), and season {season + 1} has begun. "
+        f"Ratings keep {SEASON_RATING_CARRYOVER:.0%} of their distance from {INITIAL_ELO} "
+        f"({report.players} player(s) reset in {report.seconds:.1f}s).")
 
-    print(f"Found {len(stale_matches)} stale match(es) to clean up.")
-    for match in stale_matches:
-        # Check if the match is in the designated channel before processing it
-        if int(match['channel_id']) != CHANNEL_ID:
-            print(f"Skipping stale match {match['match_id']} as it is not in the designated channel.")
-            continue
+admin_new_season_command.error(admin_command_error)
+
+@client.tree.command(name="admin_bot_stats", description="[Admin] Shows internal cache statistics.")
+@elo_admin_only()
+@instrumented("/admin_bot_stats")
+async def admin_bot_stats_command(interaction: discord.Interaction):
+    member_stats = interaction.client.members.stats()
+    embed = discord.Embed(title="🛠️ Bot Statistics", color=discord.Color.dark_grey())
+    embed.add_field(
+        name="Member Cache",
+        value=(f"Hit rate: **{member_stats['hit_rate'] * 100:.1f}%** of {member_stats['lookups']} lookups\n"
+               f"Gateway: {member_stats['gateway_hits']} | Cached: {member_stats['cache_hits']} | "
+               f"Missed: {member_stats['misses']} | Fetch requests: {member_stats['fetch_requests']}"),
+        inline=False
+    )
+    leaderboard = interaction.client.guild_state(interaction.guild_id).leaderboard
+    lookups = leaderboard.hits + leaderboard.misses
+    embed.add_field(
+        name="Leaderboard Cache",
+        value=(f"Hit rate: **{(leaderboard.hits / lookups * 100) if lookups else 0:.1f}%** of {lookups} page views\n"
+               f"Cached pages: {len(leaderboard)}"),
+        inline=False
+    )
+    shard_ids = interaction.client.shard_ids
+    embed.add_field(
+        name="Sharding",
+        value=(f"Shards: {'all' if shard_ids is None else ', '.join(map(str, shard_ids))} of {interaction.client.shard_count} | "
+               f"This server: shard {interaction.guild.shard_id}\nGuilds loaded: {len(interaction.client.guild_states)}"),
+        inline=False
+    )
+    cleanup = interaction.client.cleanup
+    drain = cleanup.last_drain
+    embed.add_field(
+        name="Match Cleanup",
+        value=(f"Outstanding: {cleanup.outstanding}\n"
+               + (f"Last drain: {drain.matches} match(es) in {drain.seconds:.1f}s, "
+                  f"{drain.messages} message(s), {drain.edits} button edit(s)" if drain else "Last drain: none yet")),
+        inline=False
+    )
+    detector = interaction.client.stall_detector
+    if detector:
+        lag = detector.percentiles()
+        value = (f"Lag p50 {lag.get('p50', 0) * 1000:.1f}ms | p90 {lag.get('p90', 0) * 1000:.1f}ms | "
+                 f"p99 {lag.get('p99', 0) * 1000:.1f}ms | max {lag.get('max', 0) * 1000:.1f}ms\n"
+                 f"Stalls over {detector.threshold * 1000:.0f}ms: {detector.stall_count}")
+        for stall in list(detector.stalls)[-3:]:
+            value += f"\n<t:{int(stall.at)}:R> {stall.seconds * 1000:.0f}ms in `{stall.context}`"
+    else:
+        value = "Stall detector disabled (set `STALL_THRESHOLD_MS` to enable)."
+    embed.add_field(name="Event Loop", value=value, inline=False)
+    backup = interaction.client.last_backup
+    if backup:
+        value = (f"Last: `{backup.path.name}` ({backup.backup_bytes / 1e6:.1f}MB from {backup.database_bytes / 1e6:.1f}MB)\n"
+                 f"Copied {backup.pages} pages in {backup.steps} steps over {backup.copy_seconds:.1f}s, "
+                 f"{backup.total_seconds:.1f}s in total")
+    else:
+        value = "None since startup." if BACKUP_INTERVAL_HOURS else "Scheduled backups disabled (`BACKUP_INTERVAL_HOURS=0`)."
+    embed.add_field(name="Backups", value=value, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+admin_bot_stats_command.error(admin_command_error)
+
+@client.tree.command(name="admin_configure", description="[Admin] Show or change this server's ELO settings.")
+@app_commands.describe(
+    channel="Channel for ELO commands and queued matches.",
+    admin_role="Role allowed to use the admin commands.",
+    k_factor="K-factor for this server's Elo ratings."
+)
+@app_commands.checks.has_permissions(manage_guild=True)
+@instrumented("/admin_configure")
+async def admin_configure_command(interaction: discord.Interaction, channel: Optional[discord.TextChannel] = None,
+                                  admin_role: Optional[discord.Role] = None,
+                                  k_factor: Optional[app_commands.Range[float, 1, 200]] = None):
+    client = interaction.client
+    config = await client.get_guild_config(interaction.guild_id)
+    if channel or admin_role or k_factor is not None:
+        config = GuildConfig(channel.id if channel else config.channel_id,
+                             admin_role.id if admin_role else config.admin_role_id,
+                             config.k_factor if k_factor is None else k_factor)
+        await client.db.set_guild_config(interaction.guild_id, *config)
+        client.guild_configs[interaction.guild_id] = config
+
+    embed = discord.Embed(title="⚙️ Server Settings", color=discord.Color.dark_grey())
+    embed.add_field(name="ELO Channel", value=f"<#{config.channel_id}>" if config.channel_id else "Any channel (ranked queue off)", inline=False)
+    embed.add_field(name="Admin Role", value=f"<@&{config.admin_role_id}>" if config.admin_role_id else f"`{ADMIN_ROLE_NAME}`", inline=False)
+    k_text = f"{K_FACTOR if config.k_factor is None else config.k_factor:g}"
+    if rating_engine.name != "elo":
+        k_text += f" (unused by {rating_engine.name})"
+    embed.add_field(name="K-Factor", value=k_text, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+admin_configure_command.error(admin_command_error)
+
+@client.tree.command(name="admin_sync_commands", description="[Owner] Push the slash command definitions to Discord now.")
+@app_commands.default_permissions(administrator=True)
+@instrumented("/admin_sync_commands")
+async def admin_sync_commands_command(interaction: discord.Interaction):
+    # Commands are global, so only the bot owner may resync them.
+    if not await interaction.client.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can sync commands.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    started = time.perf_counter()
+    await interaction.client.sync_commands(force=True)
+    await interaction.followup.send(f"Synced {len(interaction.client.tree.get_commands())} command(s) in {time.perf_counter() - started:.1f}s.", ephemeral=True)
 
-        channel = guild.get_channel(int(match['channel_id']))
-        if not channel:
-            print(f"Could not find channel for stale match {match['match_id']}. Skipping.")
+admin_sync_commands_command.error(admin_command_error)
+
+@client.tree.command(name="admin_backup", description="[Owner] Back up the database now.")
+@app_commands.default_permissions(administrator=True)
+@instrumented("/admin_backup")
+async def admin_backup_command(interaction: discord.Interaction):
+    # One database serves every guild, so only the bot owner may back it up.
+    if not await interaction.client.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can run backups.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        backup = await interaction.client.run_backup()
+    except Exception as e:
+        await interaction.followup.send(f"Backup failed: {e}", ephemeral=True)
+        return
+    await interaction.followup.send(
+        f"Backup `{backup.path.name}` written and verified: {backup.pages} pages copied in {backup.copy_seconds:.1f}s, "
+        f"{backup.backup_bytes / 1e6:.1f}MB compressed, {backup.total_seconds:.1f}s in total.", ephemeral=True)
+
+admin_backup_command.error(admin_command_error)
+
+@client.tree.command(name="tournament", description="Show a tournament's progress.")
+@app_commands.describe(tournament_id="The tournament to show (optional, defaults to this server's latest).")
+@instrumented("/tournament")
+async def tournament_command(interaction: discord.Interaction, tournament_id: Optional[str] = None):
+    if not await check_elo_channel(interaction):
+        return
+    db = interaction.client.db
+    tournament = await db.read(get_tournament, tournament_id) if tournament_id else await db.read(get_latest_tournament, interaction.guild_id)
+    if not tournament or tournament['guild_id'] != interaction.guild_id:
+        await interaction.response.send_message("No tournament was found.", ephemeral=True)
+        return
+
+    formats = {"single": "Single elimination", "double": "Double elimination"}
+    embed = discord.Embed(title=f"🏟️ {tournament['name']}", color=discord.Color.purple())
+    embed.add_field(name="Format", value=formats[tournament['format']], inline=True)
+    embed.add_field(name="Players", value=await db.read(count_tournament_entries, tournament['tournament_id']), inline=True)
+    if tournament['status'] == 'signup':
+        embed.description = "Sign-ups are open."
+    elif tournament['status'] == 'finished':
+        embed.description = f"🏆 Won by <@{tournament['champion_id']}>."
+    elif tournament['status'] == 'cancelled':
+        embed.description = "This tournament was cancelled."
+    else:
+        _, _, played = await db.read(get_tournament_bracket, tournament['tournament_id'])
+        current = [row for row in played if row['round'] == tournament['current_round'] and row['winner_id'] is None]
+        embed.description = f"Round {tournament['current_round']}: {len(current)} match(es) left to play."
+        if current:
+            lines = [f"`{row['match_id']}` {slot_label(row['slot'])} <@{row['player1_id']}> vs <@{row['player2_id']}> ({row['status']})"
+                     for row in sorted(current, key=lambda row: row['slot'])[:10]]
+            if len(current) > 10:
+                lines.append(f"...and {len(current) - 10} more.")
+            embed.add_field(name="Open Matches", value="\n".join(lines), inline=False)
+    embed.set_footer(text=f"Tournament ID: {tournament['tournament_id']}")
+    await interaction.response.send_message(embed=embed)
+
+@client.tree.command(name="admin_tournament_create", description="[Admin] Open sign-ups for an elimination tournament.")
+@app_commands.describe(name="The tournament's name.", bracket="Single or double elimination.")
+@app_commands.choices(bracket=[app_commands.Choice(name="Single elimination", value="single"),
+                              app_commands.Choice(name="Double elimination", value="double")])
+@elo_admin_only()
+@instrumented("/admin_tournament_create")
+async def admin_tournament_create_command(interaction: discord.Interaction, name: app_commands.Range[str, 1, 80], bracket: str):
+    if not await check_elo_channel(interaction):
+        return
+    tournament_id = uuid.uuid4().hex[:8]
+    await interaction.client.db.write(create_tournament, tournament_id, interaction.guild_id, interaction.channel_id, name, bracket)
+    embed = discord.Embed(
+        title=f"🏟️ {name}",
+        description=(f"{'Single' if bracket == 'single' else 'Double'} elimination tournament. Press **Join / Leave** to sign up.\n"
+                     f"Players are seeded by their ELO rating when the tournament starts."),
+        color=discord.Color.purple()
+    )
+    embed.set_footer(text=f"Tournament ID: {tournament_id} | Start it with /admin_tournament_start.")
+    await interaction.response.send_message(embed=embed, view=TournamentJoinView(tournament_id))
+
+@client.tree.command(name="admin_tournament_start", description="[Admin] Close sign-ups, seed the bracket and post the first round.")
+@app_commands.describe(tournament_id="The tournament to start.")
+@elo_admin_only()
+@instrumented("/admin_tournament_start")
+async def admin_tournament_start_command(interaction: discord.Interaction, tournament_id: str):
+    client = interaction.client
+    tournament = await client.db.read(get_tournament, tournament_id)
+    if not tournament or tournament['guild_id'] != interaction.guild_id:
+        await interaction.response.send_message(f"Tournament `{tournament_id}` was not found.", ephemeral=True)
+        return
+    if tournament['status'] != 'signup':
+        await interaction.response.send_message(f"Tournament `{tournament_id}` has already started.", ephemeral=True)
+        return
+    entrants = await client.db.read(count_tournament_entries, tournament_id)
+    if entrants < TOURNAMENT_MIN_PLAYERS:
+        await interaction.response.send_message(f"A tournament needs at least {TOURNAMENT_MIN_PLAYERS} players; {entrants} signed up.", ephemeral=True)
+        return
+
+    await interaction.response.defer(thinking=True)
+    seeded = await client.db.write(start_tournament, tournament_id)
+    if not seeded:
+        await interaction.followup.send(f"Tournament `{tournament_id}` was started while this command was running.")
+        return
+    report = await client.tournaments.advance(tournament_id)
+    if report is None:
+        await interaction.followup.send(f"**{tournament['name']}** has started with {seeded} players.")
+        return
+    await interaction.followup.send(
+        f"**{tournament['name']}** has started with {seeded} players. Round 1: {report.matches} match(es) "
+        f"posted in {report.messages} message(s), set up in {report.seconds:.1f}s.")
+
+@client.tree.command(name="admin_tournament_walkover", description="[Admin] Advance a player in an undecided tournament match.")
+@app_commands.describe(match_id="The tournament match.", winner="The player who advances.")
+@elo_admin_only()
+@instrumented("/admin_tournament_walkover")
+async def admin_tournament_walkover_command(interaction: discord.Interaction, match_id: str, winner: discord.Member):
+    client = interaction.client
+    match_data = await client.db.get_match(match_id)
+    if match_id not in client.tournaments or not match_data or match_data['guild_id'] != interaction.guild_id:
+        await interaction.response.send_message(f"Match `{match_id}` is not an undecided tournament match.", ephemeral=True)
+        return
+    if winner.id not in (match_data['player1_id'], match_data['player2_id']):
+        await interaction.response.send_message("The specified winner is not a participant in this match.", ephemeral=True)
+        return
+    if not await client.db.write(walkover_match, match_id, winner.id):
+        await interaction.response.send_message(f"Match `{match_id}` was decided while this command was running.", ephemeral=True)
+        return
+    client.expiry.cancel(match_id)
+    client.guild_state(interaction.guild_id).challenges.end_match(match_id)
+    client.tournaments.on_match_decided(match_id)
+    await interaction.response.send_message(f"⚖️ {winner.mention} advances from match `{match_id}` by walkover, awarded by {interaction.user.mention}. Ratings are unchanged.")
+
+@client.tree.command(name="admin_tournament_cancel", description="[Admin] Cancel a tournament and its undecided matches.")
+@app_commands.describe(tournament_id="The tournament to cancel.")
+@elo_admin_only()
+@instrumented("/admin_tournament_cancel")
+async def admin_tournament_cancel_command(interaction: discord.Interaction, tournament_id: str):
+    client = interaction.client
+    tournament = await client.db.read(get_tournament, tournament_id)
+    if not tournament or tournament['guild_id'] != interaction.guild_id:
+        await interaction.response.send_message(f"Tournament `{tournament_id}` was not found.", ephemeral=True)
+        return
+    cancelled = await client.db.write(cancel_tournament, tournament_id)
+    if cancelled is None:
+        await interaction.response.send_message(f"Tournament `{tournament_id}` has already ended.", ephemeral=True)
+        return
+    challenges = client.guild_state(interaction.guild_id).challenges
+    for match_id in cancelled:
+        client.expiry.cancel(match_id)
+        challenges.end_match(match_id)
+    client.tournaments.forget(tournament_id)
+    await interaction.response.send_message(f"**{tournament['name']}** was cancelled by {interaction.user.mention}, along with {len(cancelled)} undecided match(es).")
+
+admin_tournament_create_command.error(admin_command_error)
+admin_tournament_start_command.error(admin_command_error)
+admin_tournament_walkover_command.error(admin_command_error)
+admin_tournament_cancel_command.error(admin_command_error)
+
+
+# --- RATING PERIODS ---
+
+@tasks.loop(hours=1)
+async def close_rating_periods(client: MyClient):
+    """
+    Closes due rating periods for batched rating engines such as Glicko-2. Each
+    guild keeps its own period clock, so restarts never close a period early.
+    """
+    for guild_id in list(client.guild_states):
+        last_closed = await client.db.write(get_last_rating_period_close, rating_engine, guild_id)
+        if time.time() < last_closed + RATING_PERIOD_HOURS * 3600:
             continue
+        started = time.perf_counter()
+        changed = await client.db.close_rating_period(rating_engine, guild_id)
+        print(f"Closed {rating_engine.name} rating period for guild {guild_id}: "
+              f"{len(changed)} rating(s) changed in {time.perf_counter() - started:.2f}s.")
 
-        # Use the central logic handler to resolve the match
-        result_message, _ = await _resolve_match_logic(client, guild, match)
+@close_rating_periods.before_loop
+async def before_close_rating_periods():
+    await client.wait_until_ready()
 
-        if result_message:
-            await channel.send(result_message)
 
-        # Reliably disable buttons on the original message
-        try:
-            message = await channel.fetch_message(int(match['message_id']))
-            await message.edit(view=None)
-        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
-            print(f"Could not edit original message for stale match {match['match_id']}.")
+# --- SCHEDULED BACKUPS ---
+
+@tasks.loop(hours=1)
+async def scheduled_backups(client: MyClient):
+    """Backs up the database once the newest backup is BACKUP_INTERVAL_HOURS old, so restarts don't add extra backups."""
+    newest = await asyncio.to_thread(newest_backup, BACKUP_DIR)
+    if newest is not None and time.time() < newest.st_mtime + BACKUP_INTERVAL_HOURS * 3600:
+        return
+    try:
+        await client.run_backup()
+    except Exception as e:
+        print(f"Scheduled backup failed: {e}")
+
+
+# --- RATING MAINTENANCE ---
+# Decay and season rollovers run chunk by chunk on the writer thread, so match
+# results queued in the meantime are written between chunks.
+
+class MaintenanceReport(NamedTuple):
+    players: int
+    chunks: int
+    seconds: float
+
+async def decay_inactive_ratings(client: MyClient, guild_id: int) -> MaintenanceReport:
+    """Applies today's inactivity decay to a guild. Safe to repeat: a player decays at most once a day."""
+    started = time.perf_counter()
+    now = int(time.time())
+    after, players, chunks = 0, 0, 0
+    while True:
+        after, decayed = await client.db.write(decay_ratings_chunk, guild_id, after, now)
+        if after is None:
+            break
+        chunks += 1
+        players += len(decayed)
+        for user_id, rating in decayed:
+            client.db.notify_rating_change(guild_id, user_id, rating)
+        await asyncio.sleep(MAINTENANCE_CHUNK_PAUSE_SECONDS)
+    metrics.inc("elo_maintenance_players_total", players, job="decay")
+    return MaintenanceReport(players, chunks, time.perf_counter() - started)
+
+async def roll_over_season(client: MyClient, guild_id: int) -> tuple[int, MaintenanceReport]:
+    """
+    Ends a guild's current season, archives its standings and soft-resets
+    ratings. Resumes an interrupted rollover instead if there is one. Returns
+    the archived season and the number of ratings reset.
+    """
+    started = time.perf_counter()
+    now = int(time.time())
+    season = await client.db.write(begin_season_rollover, guild_id, now)
+    players, chunks = 0, 0
+    while True:
+        done, reset = await client.db.write(roll_over_season_chunk, guild_id, season, now)
+        if done:
+            break
+        chunks += 1
+        players += len(reset)
+        for user_id, rating in reset:
+            client.db.notify_rating_change(guild_id, user_id, rating)
+        await asyncio.sleep(MAINTENANCE_CHUNK_PAUSE_SECONDS)
+    metrics.inc("elo_maintenance_players_total", players, job="season")
+    return season, MaintenanceReport(players, chunks, time.perf_counter() - started)
+
+@tasks.loop(hours=1)
+async def rating_maintenance(client: MyClient):
+    """Finishes interrupted season rollovers, starts due ones and applies inactivity decay in every guild."""
+    for guild_id in list(client.guild_states):
+        async with client.maintenance_lock:
+            try:
+                rolling = await client.db.read(get_rolling_season, guild_id)
+                current = await client.db.write(get_current_season, guild_id) if SEASON_LENGTH_DAYS else None
+                if rolling is not None or (current and time.time() >= current['started_at'] + SEASON_LENGTH_DAYS * 86400):
+                    season, report = await roll_over_season(client, guild_id)
+                    print(f"Season {season} of guild {guild_id} archived: {report.players} rating(s) reset "
+                          f"in {report.chunks} chunk(s), {report.seconds:.2f}s.")
+                if DECAY_AFTER_DAYS:
+                    report = await decay_inactive_ratings(client, guild_id)
+                    if report.players:
+                        print(f"Decayed {report.players} inactive rating(s) in guild {guild_id} "
+                              f"in {report.chunks} chunk(s), {report.seconds:.2f}s.")
+            except Exception as e:
+                print(f"Rating maintenance failed for guild {guild_id}: {e}")
+
+@rating_maintenance.before_loop
+async def before_rating_maintenance():
+    await client.wait_until_ready()
+
 
+# --- MATCH EXPIRY ---
 
-@check_stale_matches.before_loop
-async def before_check_stale_matches():
-    """Waits for the bot to be ready before starting the task loop."""
+async def resolve_expired_match(client: MyClient, match_id: str) -> Optional[ExpiredMatch]:
+    """
+    Resolves a match whose report deadline has passed and returns what to post.
+    Makes no Discord requests of its own; `client.cleanup` sends the results.
+    """
     await client.wait_until_ready()
+    match_data = await client.db.get_match(match_id)
+    if not match_data or match_data['status'] != 'pending':
+        return None
+
+    guild = client.get_guild(match_data['guild_id'])
+    if not guild:
+        print(f"Could not find guild {match_data['guild_id']}. Expiry of match {match_id} skipped.")
+        return None
+
+    # Tournament pairings share one message, so its menu stays for the other matches.
+    message_id = None if match_id in client.tournaments else match_data['message_id']
+    # Use the central logic handler to resolve the match
+    result_message, _ = await _resolve_match_logic(client, guild, match_data)
+    if not result_message:
+        return None
+    return ExpiredMatch(match_data['channel_id'], message_id, result_message)
+
+async def send_to_channel(client: MyClient, channel_id: int, content: str):
+    channel = client.get_channel(channel_id)
+    if not channel:
+        print(f"Could not find channel {channel_id}. Message skipped.")
+        return
+    await channel.send(content)
+
+async def clear_match_buttons(client: MyClient, channel_id: int, message_id: int):
+    """Removes the report buttons from a match message without fetching it first."""
+    channel = client.get_channel(channel_id)
+    if not channel:
+        return
+    try:
+        await channel.get_partial_message(message_id).edit(view=None)
+    except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+        print(f"Could not edit original message {message_id} in channel {channel_id}.")
 
 
 # --- MAIN ENTRY POINT ---
 
 if __name__ == "__main__":
-    if not BOT_TOKEN or GUILD_ID == 0 or CHANNEL_ID == 0:
-        print("CRITICAL ERROR: BOT_TOKEN, GUILD_ID, or CHANNEL_ID are not configured in Replit Secrets.")
+    if not BOT_TOKEN:
+        print("CRITICAL ERROR: BOT_TOKEN is not configured in Replit Secrets.")
     else:
         client.run(BOT_TOKEN)
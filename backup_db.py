@@ -0,0 +1,72 @@
+# ==============================================================================
+#           DATABASE BACKUPS
+# ==============================================================================
+# Lists, creates, verifies and restores the gzipped snapshots the bot writes to
+# BACKUP_DIR (see the BACKUPS section of BotELOCOWT.py). `create` and `verify`
+# are safe while the bot is running; stop the bot before `restore`.
+#
+#   python backup_db.py list
+#   python backup_db.py create
+#   python backup_db.py verify backups/elo_bot-20261017-060000-000000.db.gz
+#   python backup_db.py restore backups/elo_bot-20261017-060000-000000.db.gz
+
+import argparse
+import os
+import time
+
+import BotELOCOWT as bot
+
+
+def list_command(args):
+    backups = bot.list_backups(args.backup_dir)
+    if not backups:
+        print(f"No backups in {args.backup_dir}.")
+    for path in backups:
+        stat = path.stat()
+        print(f"  {path.name:<32} {stat.st_size / 1e6:>9.1f}MB  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime))}")
+
+
+def create_command(args):
+    result = bot.backup_database(args.database, args.backup_dir, None if args.keep_all else bot.BACKUP_KEEP)
+    print(f"Backup written to {result.path}: {result.pages} pages in {result.steps} steps, copied in "
+          f"{result.copy_seconds:.1f}s, {result.total_seconds:.1f}s in total, "
+          f"{result.database_bytes / 1e6:.1f}MB -> {result.backup_bytes / 1e6:.1f}MB.")
+
+
+def verify_command(args):
+    version = bot.verify_backup(args.backup)
+    print(f"{args.backup} is intact (schema version {version}).")
+
+
+def restore_command(args):
+    version = bot.verify_backup(args.backup)
+    if os.path.exists(args.database):
+        # Keep what is being replaced. The pre_restore- prefix keeps this copy out of rotation.
+        safety = bot.backup_database(args.database, args.backup_dir, None, prefix="pre_restore")
+        print(f"Current database saved to {safety.path}.")
+    pages = bot.restore_database(args.backup, args.database)
+    print(f"Restored {args.database} from {args.backup} ({pages} pages, schema version {version}). "
+          "Newer migrations are applied when the bot starts.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage backups of the bot database.")
+    parser.add_argument("--database", default=bot.DATABASE_FILE)
+    parser.add_argument("--backup-dir", default=bot.BACKUP_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List backups, oldest first.").set_defaults(run=list_command)
+    create = commands.add_parser("create", help="Back up the database now. Safe while the bot is running.")
+    create.add_argument("--keep-all", action="store_true", help=f"Don't delete backups beyond the newest {bot.BACKUP_KEEP}.")
+    create.set_defaults(run=create_command)
+    verify = commands.add_parser("verify", help="Check that a backup decompresses and passes an integrity check.")
+    verify.add_argument("backup")
+    verify.set_defaults(run=verify_command)
+    restore = commands.add_parser("restore", help="Replace the database with a backup. Stop the bot first.")
+    restore.add_argument("backup")
+    restore.set_defaults(run=restore_command)
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
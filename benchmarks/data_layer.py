@@ -0,0 +1,272 @@
+# ==============================================================================
+#           DATA LAYER BENCHMARK
+# ==============================================================================
+# Times the database helpers the bot calls on every command against synthetic
+# `elo_bot.db` files, from 1k players / 10k matches up to 500k players / 10M
+# matches. Runs offline; no Discord connection is needed. Generated databases
+# are cached in --data-dir and reused by later runs with the same size and seed.
+#
+#   python benchmarks/data_layer.py --sizes small medium --output results.json
+#   python benchmarks/data_layer.py --compare baseline.json results.json
+
+import argparse
+import json
+import platform
+import shutil
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import BotELOCOWT as bot
+
+# name -> (players, matches)
+SIZES = {
+    "small": (1_000, 10_000),
+    "medium": (50_000, 1_000_000),
+    "large": (500_000, 10_000_000),
+}
+PENDING_FRACTION = 0.01
+DISPUTED_FRACTION = 0.002
+HISTORY_SECONDS = 365 * 24 * 3600
+# Every synthetic player and match belongs to this guild; a second, smaller guild
+# shares the tables so guild-scoped queries have rows to skip.
+GUILD_ID = 1
+OTHER_GUILD_ID = 2
+OTHER_GUILD_FRACTION = 0.1
+INSERT_CHUNK = 200_000
+
+
+def generate_database(path: Path, num_players: int, num_matches: int, seed: int):
+    """Writes a fully migrated database with synthetic players and match history."""
+    rng = np.random.default_rng(seed)
+    db_conn = bot.open_connection(str(path))
+    bot.init_db(db_conn)
+    c = db_conn.cursor()
+    now = int(time.time())
+
+    ratings = np.clip(rng.normal(bot.INITIAL_ELO, 200, num_players), 100, 3000).astype(np.int64)
+    user_ids = np.arange(1, num_players + 1, dtype=np.int64) + 10**17
+    c.execute("BEGIN")
+    c.executemany("INSERT INTO players (guild_id, user_id, user_name, elo_rating, wins, losses, games_played) VALUES (?, ?, ?, ?, 0, 0, 0)",
+                  ((GUILD_ID, uid, f"player{i}", rating) for i, (uid, rating) in enumerate(zip(user_ids.tolist(), ratings.tolist()))))
+    other = user_ids[:int(num_players * OTHER_GUILD_FRACTION)]
+    c.executemany("INSERT INTO players (guild_id, user_id, user_name, elo_rating, wins, losses, games_played) VALUES (?, ?, ?, ?, 0, 0, 0)",
+                  ((OTHER_GUILD_ID, uid, f"other{i}", bot.INITIAL_ELO) for i, uid in enumerate(other.tolist())))
+    db_conn.commit()
+
+    for start in range(0, num_matches, INSERT_CHUNK):
+        count = min(INSERT_CHUNK, num_matches - start)
+        p1 = rng.integers(0, num_players, count)
+        p2 = (p1 + rng.integers(1, num_players, count)) % num_players
+        timestamps = np.sort(rng.integers(now - HISTORY_SECONDS, now, count))
+        roll = rng.random(count)
+        statuses = np.where(roll < PENDING_FRACTION, "pending",
+                            np.where(roll < PENDING_FRACTION + DISPUTED_FRACTION, "disputed", "confirmed"))
+        # Pending matches are split between fresh ones and ones past their deadline.
+        pending = statuses == "pending"
+        timestamps[pending] = now - rng.integers(0, 2 * bot.REPORT_TIMEOUT_HOURS * 3600, pending.sum())
+        winners = user_ids[np.where(rng.random(count) < 0.5, p1, p2)].tolist()
+        rows = (
+            (f"{start + i:08x}", GUILD_ID, a, b, 10**18 + start + i, 1, ts, status, w if status == "confirmed" else None)
+            for i, (a, b, ts, status, w) in enumerate(zip(user_ids[p1].tolist(), user_ids[p2].tolist(),
+                                                          timestamps.tolist(), statuses.tolist(), winners))
+        )
+        c.execute("BEGIN")
+        c.executemany('''
+            INSERT INTO matches (match_id, guild_id, player1_id, player2_id, message_id, channel_id, timestamp, status, winner_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        db_conn.commit()
+        print(f"  {start + count:,}/{num_matches:,} matches", end="\r", flush=True)
+
+    # The generated history bypasses `apply_match_result`, so the aggregates are built in one pass.
+    c.execute("BEGIN")
+    c.execute('''
+        INSERT INTO head_to_head (guild_id, player_id, opponent_id, wins, losses, last_played)
+        SELECT guild_id, player_id, opponent_id, SUM(won), SUM(1 - won), MAX(timestamp) FROM (
+            SELECT guild_id, player1_id AS player_id, player2_id AS opponent_id, winner_id = player1_id AS won, timestamp
+            FROM matches WHERE status = 'confirmed'
+            UNION ALL
+            SELECT guild_id, player2_id, player1_id, winner_id = player2_id, timestamp
+            FROM matches WHERE status = 'confirmed'
+        )
+        GROUP BY guild_id, player_id, opponent_id
+    ''')
+    db_conn.commit()
+    # ...and so is the rating history: one point per confirmed match, wandering around the player's rating.
+    c.execute("BEGIN")
+    points = db_conn.cursor().execute('''
+        SELECT m.guild_id, m.user_id, m.timestamp, p.elo_rating + m.seq % 61 - 30 FROM (
+            SELECT guild_id, player1_id AS user_id, timestamp, rowid AS seq FROM matches WHERE status = 'confirmed'
+            UNION ALL
+            SELECT guild_id, player2_id, timestamp, rowid FROM matches WHERE status = 'confirmed'
+        ) m
+        JOIN players p ON p.guild_id = m.guild_id AND p.user_id = m.user_id
+        ORDER BY m.guild_id, m.user_id, m.timestamp
+    ''')
+    bot.bulk_load_rating_history(db_conn, points)
+    db_conn.commit()
+    c.execute("ANALYZE")
+    db_conn.commit()
+    db_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_conn.close()
+    print()
+
+
+def template_database(data_dir: Path, size: str, seed: int) -> Path:
+    num_players, num_matches = SIZES[size]
+    # Templates are tied to the schema they were generated with.
+    path = data_dir / f"elo_bot-{size}-{seed}-v{bot.MIGRATIONS[-1][0]}.db"
+    if not path.exists():
+        print(f"Generating {size} database ({num_players:,} players, {num_matches:,} matches)...")
+        partial = path.with_suffix(".partial")
+        for leftover in data_dir.glob(partial.name + "*"):
+            leftover.unlink()
+        generate_database(partial, num_players, num_matches, seed)
+        partial.rename(path)
+    return path
+
+
+def summarize(samples: list[float]) -> dict:
+    values = np.array(samples)
+    return {
+        "runs": len(values),
+        "mean_ms": round(float(values.mean()) * 1000, 4),
+        "p50_ms": round(float(np.percentile(values, 50)) * 1000, 4),
+        "p95_ms": round(float(np.percentile(values, 95)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(values, 99)) * 1000, 4),
+        "ops_per_second": round(len(values) / float(values.sum()), 1),
+    }
+
+
+def timed(func, args_list: list[tuple]) -> dict:
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def bench_database(path: Path, scratch: Path, runs: int, batch: int, seed: int) -> dict:
+    """Runs every benchmark against a scratch copy of `path`."""
+    shutil.copyfile(path, scratch)
+    rng = np.random.default_rng(seed + 1)
+    db_conn = bot.open_connection(str(scratch))
+    c = db_conn.cursor()
+    user_ids = [row[0] for row in c.execute("SELECT user_id FROM players WHERE guild_id = ?", (GUILD_ID,))]
+    sample_users = rng.choice(user_ids, runs).tolist()
+    deep_after = c.execute("SELECT elo_rating, user_id FROM players WHERE guild_id = ? ORDER BY elo_rating DESC, user_id DESC LIMIT 1 OFFSET ?",
+                           (GUILD_ID, len(user_ids) // 2)).fetchone()
+    pending = [row[0] for row in c.execute("SELECT match_id FROM matches WHERE status = 'pending'")]
+
+    results = {
+        "get_leaderboard": timed(bot.get_leaderboard, [(db_conn, GUILD_ID, 10)] * runs),
+        "get_leaderboard_page (middle)": timed(bot.get_leaderboard_page, [(db_conn, GUILD_ID, tuple(deep_after), 10)] * runs),
+        "get_pending_matches_for_user": timed(bot.get_pending_matches_for_user, [(db_conn, GUILD_ID, uid) for uid in sample_users]),
+        "get_stale_matches": timed(bot.get_stale_matches, [(db_conn,)] * max(1, runs // 10)),
+        "get_head_to_head": timed(bot.get_head_to_head, [(db_conn, GUILD_ID, a, b) for a, b in rng.choice(user_ids, (runs, 2)).tolist()]),
+        "get_top_opponents": timed(bot.get_top_opponents, [(db_conn, GUILD_ID, uid, 3) for uid in sample_users]),
+        "get_rating_history": timed(bot.get_rating_history, [(db_conn, GUILD_ID, uid, 0, bot.SPARKLINE_POINTS) for uid in sample_users]),
+        "get_peak_rating": timed(bot.get_peak_rating, [(db_conn, GUILD_ID, uid) for uid in sample_users]),
+        "get_match": timed(bot.get_match, [(db_conn, match_id) for match_id in rng.choice(pending, runs).tolist()]),
+    }
+
+    # Match IDs in the generated history are sequential, so new ones start after the last.
+    next_id = c.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+    def new_matches(count: int) -> list[tuple]:
+        nonlocal next_id
+        pairs = [(a, b) for a, b in rng.choice(user_ids, (count * 2, 2)).tolist() if a != b][:count]
+        created = [(f"{next_id + i:08x}", GUILD_ID, a, b, 10**18 + next_id + i, 1) for i, (a, b) in enumerate(pairs)]
+        next_id += len(created)
+        return created
+
+    results["create_match_record"] = timed(bot.create_match_record, [(db_conn, *row) for row in new_matches(runs)])
+
+    # Finalizing one match per commit, as a lone report does...
+    to_finalize = new_matches(runs * (1 + batch))
+    for row in to_finalize:
+        bot.create_match_record(db_conn, *row)
+    finalizations = [(guild_id, match_id, p1_id, p2_id) for match_id, guild_id, p1_id, p2_id, _, _ in to_finalize]
+    singles, grouped = finalizations[:runs], finalizations[runs:]
+    results["finalize (1 per commit)"] = timed(bot.finalize_match_results, [(db_conn, [row]) for row in singles])
+    # ...and in group commits, as bursts of reports do.
+    summary = timed(bot.finalize_match_results, [(db_conn, grouped[i:i + batch]) for i in range(0, len(grouped), batch)])
+    summary["matches_per_second"] = round(summary["ops_per_second"] * batch, 1)
+    results[f"finalize ({batch} per commit)"] = summary
+
+    db_conn.close()
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{scratch}{suffix}").unlink(missing_ok=True)
+    return results
+
+
+def compare(baseline_path: str, current_path: str, threshold: float, min_delta_ms: float) -> int:
+    """
+    Prints p50 changes between two result files; returns the number of regressions.
+    A benchmark regresses when its p50 grows by more than `threshold` and by at least `min_delta_ms`.
+    """
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    current = json.loads(Path(current_path).read_text())["results"]
+    regressions = 0
+    for size, benches in current.items():
+        if size not in baseline:
+            continue
+        print(size)
+        for name, result in benches.items():
+            before = baseline[size].get(name)
+            if not before:
+                print(f"  {name:<34} {result['p50_ms']:>10.3f}ms  (new)")
+                continue
+            change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+            flag = ""
+            if change > threshold and result["p50_ms"] - before["p50_ms"] >= min_delta_ms:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"  {name:<34} {before['p50_ms']:>10.3f}ms -> {result['p50_ms']:>10.3f}ms  {change:+7.1%}{flag}")
+    print(f"{regressions} regression(s) above {threshold:.0%}.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's database helpers on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["small"])
+    parser.add_argument("--runs", type=int, default=200, help="Timed calls per benchmark.")
+    parser.add_argument("--batch", type=int, default=32, help="Matches per group commit in the batched finalize benchmark.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", type=Path, default=Path(__file__).resolve().parent / "data")
+    parser.add_argument("--output", type=Path, help="Write results as JSON to this file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files and exit.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Slowdown in p50 that counts as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Ignore p50 slowdowns smaller than this, which are usually timer noise.")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold, args.min_delta_ms) else 0)
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for size in args.sizes:
+        template = template_database(args.data_dir, size, args.seed)
+        results[size] = bench_database(template, args.data_dir / f"scratch-{size}.db", args.runs, args.batch, args.seed)
+        print(f"{size}: {SIZES[size][0]:,} players, {SIZES[size][1]:,} matches")
+        for name, r in results[size].items():
+            print(f"  {name:<34} p50 {r['p50_ms']:>9.3f}ms  p99 {r['p99_ms']:>9.3f}ms  {r['ops_per_second']:>10,.1f} ops/s")
+
+    if args.output:
+        report = {
+            "meta": {"timestamp": int(time.time()), "python": platform.python_version(),
+                     "sqlite": sqlite3.sqlite_version, "runs": args.runs, "seed": args.seed},
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# ==============================================================================
+#           RATING ENGINE BENCHMARK
+# ==============================================================================
+# Measures rating updates per second for each rating engine on synthetic
+# matches. Runs offline; no Discord connection or database is needed.
+#
+#   python benchmarks/rating_engines.py --players 10000 --matches 200000
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import BotELOCOWT as bot
+
+
+def synthetic_matches(num_players: int, num_matches: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Random (winner, loser) index pairs with no self-matches."""
+    rng = np.random.default_rng(seed)
+    winners = rng.integers(0, num_players, num_matches)
+    losers = (winners + rng.integers(1, num_players, num_matches)) % num_players
+    return winners, losers
+
+
+def bench_elo_per_match(winners: np.ndarray, losers: np.ndarray) -> float:
+    """One `rate_match` call per match, as the live bot does."""
+    engine = bot.EloEngine()
+    ratings: dict[int, int] = {}
+    started = time.perf_counter()
+    for w, l in zip(winners.tolist(), losers.tolist()):
+        ratings[w], ratings[l] = engine.rate_match(ratings.get(w, bot.INITIAL_ELO), ratings.get(l, bot.INITIAL_ELO))
+    return time.perf_counter() - started
+
+
+def bench_elo_replay(winners: np.ndarray, losers: np.ndarray) -> float:
+    """The vectorized wave replay used by /admin_replay_ratings."""
+    started = time.perf_counter()
+    bot.replay_ratings(winners, losers)
+    return time.perf_counter() - started
+
+
+def _glicko2_state(num_players: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return (np.full(num_players, float(bot.INITIAL_ELO)),
+            np.full(num_players, bot.GLICKO2_INITIAL_RD),
+            np.full(num_players, bot.GLICKO2_INITIAL_VOLATILITY))
+
+
+def bench_glicko2_batched(winners: np.ndarray, losers: np.ndarray, num_players: int, periods: int) -> float:
+    """One vectorized `rate_period` call per rating period."""
+    engine = bot.Glicko2Engine()
+    ratings, rds, volatilities = _glicko2_state(num_players)
+    started = time.perf_counter()
+    for period_winners, period_losers in zip(np.array_split(winners, periods), np.array_split(losers, periods)):
+        players = np.concatenate([period_winners, period_losers])
+        opponents = np.concatenate([period_losers, period_winners])
+        scores = np.concatenate([np.ones(len(period_winners)), np.zeros(len(period_losers))])
+        ratings, rds, volatilities = engine.rate_period(ratings, rds, volatilities, players, opponents, scores)
+    return time.perf_counter() - started
+
+
+def bench_glicko2_per_match(winners: np.ndarray, losers: np.ndarray) -> float:
+    """Baseline: every match rated as its own one-game period for both players."""
+    engine = bot.Glicko2Engine()
+    ones, zeros = np.ones(1), np.zeros(1)
+    state: dict[int, tuple[float, float, float]] = {}
+    started = time.perf_counter()
+    for w, l in zip(winners.tolist(), losers.tolist()):
+        default = (float(bot.INITIAL_ELO), bot.GLICKO2_INITIAL_RD, bot.GLICKO2_INITIAL_VOLATILITY)
+        pair = [state.get(w, default), state.get(l, default)]
+        ratings, rds, volatilities = (np.array(column) for column in zip(*pair))
+        new = engine.rate_period(ratings, rds, volatilities, np.array([0, 1]), np.array([1, 0]), np.concatenate([ones, zeros]))
+        state[w] = (new[0][0], new[1][0], new[2][0])
+        state[l] = (new[0][1], new[1][1], new[2][1])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rating engine throughput.")
+    parser.add_argument("--players", type=int, default=10_000)
+    parser.add_argument("--matches", type=int, default=200_000)
+    parser.add_argument("--periods", type=int, default=30, help="Glicko-2 rating periods to split the matches into.")
+    parser.add_argument("--baseline-matches", type=int, default=5_000,
+                        help="Matches used for the slow per-match Glicko-2 baseline.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    winners, losers = synthetic_matches(args.players, args.matches, args.seed)
+    baseline = min(args.baseline_matches, args.matches)
+    runs = [
+        ("elo (per match)", args.matches, bench_elo_per_match(winners, losers)),
+        ("elo (vectorized replay)", args.matches, bench_elo_replay(winners, losers)),
+        ("glicko2 (per match)", baseline, bench_glicko2_per_match(winners[:baseline], losers[:baseline])),
+        (f"glicko2 (batched, {args.periods} periods)", args.matches,
+         bench_glicko2_batched(winners, losers, args.players, args.periods)),
+    ]
+
+    # Every match updates two players.
+    results = [{"engine": name, "matches": matches, "seconds": round(seconds, 4),
+                "updates_per_second": round(2 * matches / seconds)} for name, matches, seconds in runs]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.players} players, {args.matches} matches")
+    for r in results:
+        print(f"  {r['engine']:<34} {r['matches']:>9} matches {r['seconds']:>9.3f}s {r['updates_per_second']:>12,} updates/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# ==============================================================================
+#           DATA EXPORT
+# ==============================================================================
+# Streams players, matches and rating history out of `elo_bot.db` for offline
+# analysis, as CSV or newline-delimited JSON. Safe to run while the bot is up:
+# everything is read from one read-only snapshot, so the export never takes the
+# write lock and never blocks match reporting. Rows are streamed in batches, so
+# memory use does not grow with the size of the tables.
+#
+#   python export_data.py --output-dir export/
+#   python export_data.py --output-dir export/ --format ndjson --gzip --since 1760000000
+#
+# Each run writes `manifest.json` with the row counts and the `--since` value
+# for the next incremental run. Incremental runs overlap slightly so rows
+# committed while the snapshot was taken are never missed; deduplicate on
+# (guild_id, user_id) for players, match_id for matches and
+# (guild_id, user_id, timestamp) for rating history.
+
+import argparse
+import csv
+import gzip
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+import BotELOCOWT as bot
+
+EXPORT_BATCH_ROWS = 5000
+# Seconds the next incremental export reaches back past this snapshot. Covers
+# write transactions that stamped their rows before the snapshot but committed after.
+SINCE_OVERLAP_SECONDS = 60
+MIN_SCHEMA_VERSION = 10
+
+PLAYER_COLUMNS = ["guild_id", "user_id", "user_name", "elo_rating", "wins", "losses", "games_played",
+                  "glicko_rating", "glicko_rd", "glicko_volatility", "updated_at"]
+MATCH_COLUMNS = ["match_id", "guild_id", "player1_id", "player2_id", "message_id", "channel_id", "timestamp",
+                 "status", "player1_report", "player2_report", "winner_id", "updated_at"]
+HISTORY_COLUMNS = ["guild_id", "user_id", "timestamp", "rating"]
+
+
+def open_snapshot(path: str) -> sqlite3.Connection:
+    """Opens a read-only connection and pins one consistent snapshot of the database."""
+    db_conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None, timeout=bot.DB_BUSY_TIMEOUT_SECONDS)
+    # A read transaction in WAL mode sees the database as of its first read until it ends.
+    db_conn.execute("BEGIN")
+    version = bot.get_schema_version(db_conn)
+    if version < MIN_SCHEMA_VERSION:
+        raise SystemExit(f"{path} is at schema version {version}; start the bot once to migrate it to {MIN_SCHEMA_VERSION}.")
+    return db_conn
+
+
+def _where(since: int, guild_id: int | None, time_column: str) -> tuple[str, list]:
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{time_column} >= ?")
+        params.append(since)
+    if guild_id is not None:
+        clauses.append("guild_id = ?")
+        params.append(guild_id)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def stream_rows(db_conn: sqlite3.Connection, query: str, params: list):
+    """Yields rows in batches of EXPORT_BATCH_ROWS."""
+    c = db_conn.execute(query, params)
+    while batch := c.fetchmany(EXPORT_BATCH_ROWS):
+        yield from batch
+
+
+def stream_players(db_conn: sqlite3.Connection, since: int, guild_id: int | None):
+    where, params = _where(since, guild_id, "updated_at")
+    return stream_rows(db_conn, f"SELECT {', '.join(PLAYER_COLUMNS)} FROM players{where}", params)
+
+
+def stream_matches(db_conn: sqlite3.Connection, since: int, guild_id: int | None):
+    where, params = _where(since, guild_id, "updated_at")
+    return stream_rows(db_conn, f"SELECT {', '.join(MATCH_COLUMNS)} FROM matches{where}", params)
+
+
+def stream_rating_history(db_conn: sqlite3.Connection, since: int, guild_id: int | None):
+    """Decodes the packed history chunks one at a time into (guild_id, user_id, timestamp, rating) rows."""
+    where, params = _where(since, guild_id, "last_timestamp")
+    chunks = stream_rows(db_conn, f"SELECT guild_id, user_id, chunk_start, data FROM rating_history{where}", params)
+    for guild, user_id, chunk_start, data in chunks:
+        points = np.frombuffer(data, dtype=bot.RATING_POINT)
+        timestamps = chunk_start + points['offset'].astype(np.int64)
+        keep = timestamps >= since
+        for timestamp, rating in zip(timestamps[keep].tolist(), points['rating'][keep].tolist()):
+            yield guild, user_id, timestamp, rating
+
+
+def write_table(path: Path, fmt: str, compress: bool, columns: list[str], rows) -> int:
+    """Writes rows to `path` as they arrive and returns how many were written."""
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+TABLES = {
+    "players": (PLAYER_COLUMNS, stream_players),
+    "matches": (MATCH_COLUMNS, stream_matches),
+    "rating_history": (HISTORY_COLUMNS, stream_rating_history),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export players, matches and rating history from a live bot database.")
+    parser.add_argument("--database", default=bot.DATABASE_FILE)
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Compress each output file.")
+    parser.add_argument("--since", type=int, default=0,
+                        help="Only export rows changed at or after this Unix timestamp (see manifest.json).")
+    parser.add_argument("--guild", type=int, help="Only export one guild.")
+    parser.add_argument("--tables", nargs="+", choices=TABLES, default=list(TABLES))
+    args = parser.parse_args()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    started_at = int(time.time())
+    db_conn = open_snapshot(args.database)
+    extension = ("csv" if args.format == "csv" else "ndjson") + (".gz" if args.gzip else "")
+    counts = {}
+    try:
+        for table in args.tables:
+            columns, stream = TABLES[table]
+            table_started = time.perf_counter()
+            counts[table] = write_table(args.output_dir / f"{table}.{extension}", args.format, args.gzip,
+                                        columns, stream(db_conn, args.since, args.guild))
+            print(f"  {table:<16} {counts[table]:>12,} rows in {time.perf_counter() - table_started:.1f}s")
+    finally:
+        db_conn.close()
+
+    manifest = {"snapshot_at": started_at, "since": args.since, "guild": args.guild, "format": args.format,
+                "rows": counts, "next_since": started_at - SINCE_OVERLAP_SECONDS}
+    (args.output_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    print(f"Export written to {args.output_dir}. Next incremental run: --since {manifest['next_since']}")
+
+
+if __name__ == "__main__":
+    main()
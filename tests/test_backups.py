@@ -0,0 +1,17 @@
+import BotELOCOWT as bot
+
+
+def test_pre_restore_snapshots_survive_rotation(tmp_path):
+    database, backup_dir = str(tmp_path / "elo.db"), str(tmp_path / "backups")
+    conn = bot.open_connection(database)
+    bot.init_db(conn)
+    version = bot.get_schema_version(conn)
+    conn.close()
+
+    safety = bot.backup_database(database, backup_dir, None, pause=0, prefix="pre_restore")
+    for _ in range(3):
+        bot.backup_database(database, backup_dir, 1, pause=0)
+
+    assert len(bot.list_backups(backup_dir)) == 1
+    assert safety.path.exists()
+    assert bot.verify_backup(str(safety.path)) == version
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+def playable(slots, states, results):
+    """The slots the bot would create matches for next, as in `TournamentService.advance`."""
+    return [slot.name for slot in slots
+            if states[slot.name].winner is None and slot.name not in results
+            and states[slot.name].player1 not in (None, bot.BYE) and states[slot.name].player2 not in (None, bot.BYE)]
+
+
+def play_out(fmt, seeds, pick_winner):
+    """Plays a bracket round by round. Returns (champion, number of matches played)."""
+    slots = bot.build_bracket(fmt, len(seeds))
+    results = {}
+    while True:
+        states = bot.resolve_bracket(slots, seeds, results)
+        champion = states[slots[-1].name].winner
+        if champion is not None:
+            return champion, len(results)
+        names = playable(slots, states, results)
+        assert names, "bracket stalled without a champion"
+        for name in names:
+            results[name] = pick_winner(states[name].player1, states[name].player2)
+
+
+@pytest.mark.parametrize("num_players", [2, 3, 5, 8, 13, 32])
+def test_single_elimination_crowns_the_top_seed_with_byes(num_players):
+    seeds = list(range(101, 101 + num_players))
+    champion, matches = play_out("single", seeds, min)
+    assert champion == seeds[0]
+    # Every player but the champion loses exactly once; byes are not matches.
+    assert matches == num_players - 1
+
+
+@pytest.mark.parametrize("num_players", [3, 4, 6, 9, 16, 23])
+def test_double_elimination_eliminates_everyone_else_twice(num_players):
+    seeds = list(range(101, 101 + num_players))
+    rng = random.Random(num_players)
+    champion, matches = play_out("double", seeds, lambda a, b: rng.choice((a, b)))
+    assert champion in seeds
+    # With a single grand final the total number of losses is always 2n - 2.
+    assert matches == 2 * num_players - 2
+
+
+def test_walkovers_advance_the_bracket(tmp_path):
+    conn = bot.open_connection(str(tmp_path / "elo.db"))
+    bot.init_db(conn)
+    bot.create_tournament(conn, "cup", GUILD, 10, "Cup", "single")
+    for user_id in (101, 102, 103):
+        bot.toggle_tournament_entry(conn, "cup", user_id, max_players=8)
+    assert bot.start_tournament(conn, "cup") == 3
+
+    tournament, entries, played = bot.get_tournament_bracket(conn, "cup")
+    seeds = [entry['user_id'] for entry in entries]
+    slots = bot.build_bracket(tournament['format'], len(seeds))
+    states = bot.resolve_bracket(slots, seeds, {})
+    # The top seed has a bye, so only one first-round match is played.
+    assert playable(slots, states, {}) == ["W1-1"]
+    assert states["W1-0"].winner == seeds[0]
+
+    bot.create_tournament_round(conn, "cup", GUILD, 10, 1, [("W1-1", "m1", states["W1-1"].player1, states["W1-1"].player2)])
+    assert bot.walkover_match(conn, "m1", seeds[2])
+    assert not bot.walkover_match(conn, "m1", seeds[1])
+
+    _, _, played = bot.get_tournament_bracket(conn, "cup")
+    results = {row['slot']: row['winner_id'] for row in played if row['winner_id'] is not None}
+    assert results == {"W1-1": seeds[2]}
+    states = bot.resolve_bracket(slots, seeds, results)
+    assert (states["W2-0"].player1, states["W2-0"].player2) == (seeds[0], seeds[2])
+    assert playable(slots, states, results) == ["W2-0"]
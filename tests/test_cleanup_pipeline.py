@@ -0,0 +1,32 @@
+import asyncio
+
+import BotELOCOWT as bot
+
+
+async def drain_twice():
+    sent, cleared = [], []
+
+    async def resolve(match_id):
+        # Matches named "gone-*" were already resolved by a report or an admin.
+        return None if match_id.startswith("gone") else bot.ExpiredMatch(10, 100, f"Match {match_id} expired.")
+
+    async def send(channel_id, text):
+        sent.append(text)
+
+    async def clear_buttons(channel_id, message_id):
+        cleared.append(message_id)
+
+    pipeline = bot.MatchCleanupPipeline(resolve, send, clear_buttons)
+    await asyncio.gather(*(pipeline.expire(f"m{n}") for n in range(5)))
+    while pipeline.outstanding:
+        await asyncio.sleep(0.01)
+    backlog = pipeline.last_drain
+
+    await asyncio.gather(*(pipeline.expire(f"gone-{n}") for n in range(3)))
+    return backlog, pipeline.last_drain, sent, cleared
+
+
+def test_empty_drain_keeps_the_last_backlog_report():
+    backlog, last_drain, sent, cleared = asyncio.run(drain_twice())
+    assert backlog.matches == 5 and backlog.messages == len(sent) >= 1 and backlog.edits == len(cleared) == 5
+    assert last_drain is backlog
@@ -0,0 +1,40 @@
+import asyncio
+
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+async def confirm_batch_with_a_cancelled_waiter(path: str):
+    db = bot.AsyncDatabase(path)
+    await db.open()
+    try:
+        for user_id in range(1, 7):
+            await db.write(bot.add_player_if_not_exists, GUILD, user_id, f"player{user_id}")
+        for n in range(3):
+            await db.write(bot.create_match_record, f"m{n}", GUILD, 2 * n + 1, 2 * n + 2, None, 10)
+
+        notified = []
+        def failing_listener(guild_id, user_id, rating):
+            if user_id == 1:
+                raise RuntimeError("listener failed")
+        db.rating_listeners += [failing_listener, lambda guild_id, user_id, rating: notified.append(user_id)]
+
+        waiters = [asyncio.create_task(db.apply_match_result(GUILD, f"m{n}", 2 * n + 1, 2 * n + 2)) for n in range(3)]
+        await asyncio.sleep(0)
+        # All three results are queued for the same commit; one caller gives up.
+        waiters[1].cancel()
+        first, third = await asyncio.wait_for(asyncio.gather(waiters[0], waiters[2]), timeout=5)
+        assert first[0] > first[1] and third[0] > third[1]
+        assert waiters[1].cancelled()
+
+        # The results after the failing listener were still published, the cancelled caller's included.
+        assert sorted(notified) == [3, 4, 5, 6]
+        statuses = [(await db.read(bot.get_match, f"m{n}"))['status'] for n in range(3)]
+        assert statuses == ['confirmed'] * 3
+    finally:
+        await db.close()
+
+
+def test_cancelled_waiter_does_not_strand_the_batch(tmp_path):
+    asyncio.run(confirm_batch_with_a_cancelled_waiter(str(tmp_path / "elo.db")))
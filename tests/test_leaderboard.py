@@ -0,0 +1,45 @@
+import asyncio
+import random
+
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+def set_rating(db_conn, user_id: int, rating: int):
+    db_conn.execute('''
+        INSERT INTO players (guild_id, user_id, user_name, elo_rating) VALUES (?, ?, ?, ?)
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET elo_rating = excluded.elo_rating
+    ''', (GUILD, user_id, f"player{user_id}", rating))
+    db_conn.commit()
+
+
+async def check_cached_pages_match_fresh_reads(path: str):
+    db = bot.AsyncDatabase(path)
+    await db.open()
+    try:
+        rank_index = bot.RankIndex()
+        service = bot.LeaderboardService(db, rank_index, GUILD, page_size=5, max_pages=100)
+        rng = random.Random(7)
+        for step in range(300):
+            user_id = rng.randint(1, 40)
+            # Few distinct ratings, so ties across page boundaries are common.
+            rating = rng.choice(range(900, 1100, 10))
+            await db.write(set_rating, user_id, rating)
+            # The same order the bot's rating listener uses.
+            service.on_rating_change(user_id, rating)
+            rank_index.update(user_id, rating)
+
+            # Warm a few pages, then compare every cached page with a fresh read.
+            for number in rng.sample(range(service.page_count()), min(3, service.page_count())):
+                await service.get_page(number)
+            fresh = bot.LeaderboardService(db, rank_index, GUILD, page_size=5)
+            for number, cached in list(service._pages.items()):
+                assert cached == await fresh.get_page(number), f"stale page {number} after step {step}"
+        assert service.hits > 0
+    finally:
+        await db.close()
+
+
+def test_cached_pages_match_fresh_reads_as_ratings_change(tmp_path):
+    asyncio.run(check_cached_pages_match_fresh_reads(str(tmp_path / "elo.db")))
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import BotELOCOWT as bot
+
+
+def make_queue():
+    return bot.MatchmakingQueue(base_window=50, growth_per_second=1, max_window=400)
+
+
+def test_join_pairs_with_the_nearest_rated_neighbour():
+    queue = make_queue()
+    assert queue.join(1, 1000, now=0) is None
+    assert queue.join(2, 1090, now=0) is None
+    # 1050 is within the window of both, but 1090 is closer.
+    assert queue.join(3, 1050, now=0) == (3, 2)
+    assert 1 in queue and len(queue) == 1
+
+
+def test_windows_widen_until_the_gap_fits():
+    queue = make_queue()
+    queue.join(1, 1000, now=0)
+    queue.join(2, 1080, now=10)
+    # The gap of 80 fits once the later player has waited 30 seconds.
+    assert queue.pop_ready(now=39) == []
+    assert queue.next_ready_at() == 40
+    assert queue.pop_ready(now=40) == [(1, 2)]
+    assert len(queue) == 0
+
+
+def test_gaps_beyond_the_max_window_never_pair():
+    queue = make_queue()
+    queue.join(1, 1000, now=0)
+    queue.join(2, 1500, now=0)
+    assert queue.next_ready_at() is None
+    assert queue.pop_ready(now=10_000) == []
+
+
+def test_leaving_makes_the_outer_players_neighbours():
+    queue = make_queue()
+    queue.join(1, 1000, now=0)
+    queue.join(2, 1100, now=0)
+    queue.join(3, 1200, now=0)
+    assert queue.leave(2)
+    assert not queue.leave(2)
+    # 1 and 3 are 200 apart now, so they pair after 150 seconds; the stale
+    # candidates that involved player 2 are skipped.
+    assert queue.pop_ready(now=149) == []
+    assert queue.pop_ready(now=150) == [(1, 3)]
+
+
+def test_requeued_player_keeps_their_wait():
+    async def scenario():
+        pairs = []
+        matchmaker = None
+
+        async def on_pair(p1_id, p2_id):
+            pairs.append((p1_id, p2_id))
+            if len(pairs) == 1:
+                # Player 2 left the server before the match could start.
+                matchmaker.requeue(1, 1000)
+
+        matchmaker = bot.Matchmaker(on_pair)
+        matchmaker.start()
+        waited = time.time() - 600
+        # Players 1 and 3 are 100 apart, which fits the window of anyone who has waited ten minutes.
+        matchmaker.join(3, 1100, joined_at=waited)
+        matchmaker.join(1, 1000, joined_at=waited)
+        assert matchmaker.join(2, 1010)
+        for _ in range(50):
+            if len(pairs) == 2:
+                break
+            await asyncio.sleep(0.01)
+        matchmaker.stop()
+        return pairs
+
+    assert asyncio.run(scenario()) == [(1, 2), (1, 3)]
@@ -0,0 +1,35 @@
+import random
+
+import BotELOCOWT as bot
+
+
+def leaderboard_order(ratings: dict[int, int]) -> list[tuple[int, int]]:
+    """(user_id, rating) in the order the SQL leaderboard returns them."""
+    return sorted(ratings.items(), key=lambda item: (item[1], item[0]), reverse=True)
+
+
+def test_positions_and_ranks_match_the_leaderboard_past_the_clamped_range():
+    rng = random.Random(3)
+    index = bot.RankIndex(max_rating=100)
+    ratings = {}
+    for _ in range(3000):
+        user_id = rng.randint(1, 200)
+        if rng.random() < 0.1:
+            index.remove(user_id)
+            ratings.pop(user_id, None)
+        else:
+            ratings[user_id] = rng.randint(-50, 160)
+            index.update(user_id, ratings[user_id])
+
+    order = leaderboard_order(ratings)
+    assert [index.entry_at(position) for position in range(len(order))] == order
+    for position, (user_id, rating) in enumerate(order):
+        assert index.position(user_id) == position
+        assert index.rank(user_id) == 1 + sum(1 for other in ratings.values() if other > rating)
+
+
+def test_equal_ratings_share_a_rank_and_order_by_user_id():
+    index = bot.RankIndex()
+    index.load([(1, 1200), (2, 1200), (3, 1300)])
+    assert [index.rank(user_id) for user_id in (3, 2, 1)] == [1, 2, 2]
+    assert index.top(3) == [(1, 3, 1300), (2, 2, 1200), (2, 1, 1200)]
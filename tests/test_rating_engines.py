@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+import BotELOCOWT as bot
+
+
+def one_game(winner: float, loser: float):
+    """Arguments for `rate_period` with a single game between players 0 and 1."""
+    return (np.array([winner, loser]), np.full(2, bot.GLICKO2_INITIAL_RD), np.full(2, bot.GLICKO2_INITIAL_VOLATILITY),
+            np.array([0, 1]), np.array([1, 0]), np.array([1.0, 0.0]))
+
+
+@pytest.mark.parametrize("engine", [bot.EloEngine(), bot.Glicko2Engine()], ids=lambda engine: engine.name)
+def test_every_engine_rates_a_match_and_a_period(engine):
+    new_winner, new_loser = engine.rate_match(1500, 1500)
+    assert new_winner > 1500 > new_loser
+
+    ratings, rds, volatilities = engine.rate_period(*one_game(1500.0, 1500.0))
+    assert ratings[0] > 1500 > ratings[1]
+    assert rds.shape == volatilities.shape == (2,)
+
+
+def test_elo_period_with_one_game_matches_rate_match():
+    engine = bot.EloEngine(k_factor=32)
+    ratings, _, _ = engine.rate_period(*one_game(1200.0, 1000.0))
+    assert tuple(np.round(ratings).astype(int)) == engine.rate_match(1200, 1000)
+
+
+def test_glicko2_match_is_a_one_game_period_from_initial_state():
+    engine = bot.Glicko2Engine()
+    ratings, _, _ = engine.rate_period(*one_game(1600.0, 1400.0))
+    assert engine.rate_match(1600, 1400) == (round(ratings[0]), round(ratings[1]))
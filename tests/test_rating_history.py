@@ -0,0 +1,76 @@
+import numpy as np
+
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+def make_db(tmp_path):
+    conn = bot.open_connection(str(tmp_path / "elo.db"))
+    bot.init_db(conn)
+    return conn
+
+
+def test_points_round_trip_across_chunks(tmp_path):
+    conn = make_db(tmp_path)
+    rng = np.random.default_rng(5)
+    count = 2 * bot.RATING_HISTORY_CHUNK_POINTS + 40
+    # Several points share a second, and the two players' points interleave.
+    timestamps = 1_000_000 + np.cumsum(rng.integers(0, 3, count))
+    ratings = 1000 + np.cumsum(rng.integers(-20, 21, count))
+    series = {1: list(zip(timestamps.tolist(), ratings.tolist())), 2: list(zip(timestamps.tolist(), (-ratings).tolist()))}
+    for start in range(0, count, 37):
+        batch = [(user_id, *points[i]) for i in range(start, min(start + 37, count)) for user_id, points in series.items()]
+        bot.append_rating_history(conn, GUILD, batch)
+    conn.commit()
+
+    for user_id, points in series.items():
+        assert bot.get_rating_history(conn, GUILD, user_id, max_points=count) == points
+        chunks = conn.execute("SELECT points, min_rating, max_rating, last_rating FROM rating_history "
+                              "WHERE guild_id = ? AND user_id = ? ORDER BY chunk_start", (GUILD, user_id)).fetchall()
+        assert [row['points'] for row in chunks] == [bot.RATING_HISTORY_CHUNK_POINTS] * 2 + [40]
+        assert max(row['max_rating'] for row in chunks) == bot.get_peak_rating(conn, GUILD, user_id) == max(r for _, r in points)
+        assert chunks[-1]['last_rating'] == points[-1][1]
+
+
+def test_incremental_appends_match_a_bulk_load(tmp_path):
+    conn = make_db(tmp_path)
+    points = [(7, 500 + i // 3, 1000 + (i * 37) % 200) for i in range(bot.RATING_HISTORY_CHUNK_POINTS + 10)]
+    for point in points:
+        bot.append_rating_history(conn, GUILD, [point])
+    bot.bulk_load_rating_history(conn, [(GUILD + 1, user_id, t, r) for user_id, t, r in points])
+    conn.commit()
+    query = "SELECT chunk_start, last_timestamp, points, min_rating, max_rating, last_rating, data FROM rating_history WHERE guild_id = ? ORDER BY chunk_start"
+    assert [tuple(row) for row in conn.execute(query, (GUILD,))] == [tuple(row) for row in conn.execute(query, (GUILD + 1,))]
+
+
+def test_lttb_keeps_the_ends_and_the_spikes():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[400], y[700] = 500, -500
+    indices = bot.downsample_lttb(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert {400, 700} <= set(indices.tolist())
+    assert bot.downsample_lttb(x[:10], y[:10], 50).tolist() == list(range(10))
+
+
+def test_long_histories_are_sampled_from_chunk_summaries(tmp_path):
+    conn = make_db(tmp_path)
+    count = 200 * bot.RATING_HISTORY_CHUNK_POINTS
+    timestamps = np.arange(count) * 60
+    ratings = 1000 + (np.arange(count) // 100) % 300
+    bot.bulk_load_rating_history(conn, [(GUILD, 7, t, r) for t, r in zip(timestamps.tolist(), ratings.tolist())])
+    conn.commit()
+    closings = {tuple(row) for row in conn.execute("SELECT last_timestamp, last_rating FROM rating_history WHERE user_id = 7")}
+
+    history = bot.get_rating_history(conn, GUILD, 7, max_points=24)
+    assert len(history) == 24
+    assert set(history) <= closings
+    assert history[-1] == (int(timestamps[-1]), int(ratings[-1]))
+    assert [t for t, _ in history] == sorted(t for t, _ in history)
+
+    since = int(timestamps[count // 2])
+    recent = bot.get_rating_history(conn, GUILD, 7, since=since, max_points=24)
+    assert len(recent) == 24 and recent[0][0] >= since and recent[-1] == history[-1]
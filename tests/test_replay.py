@@ -0,0 +1,35 @@
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+def confirm(conn, match_id: str, winner_id: int, loser_id: int):
+    bot.create_match_record(conn, match_id, GUILD, winner_id, loser_id, None, 10)
+    return bot.finalize_match_results(conn, [(GUILD, match_id, winner_id, loser_id)])[0]
+
+
+def apply(conn, replay) -> bool:
+    return bot.apply_replayed_ratings(conn, GUILD, replay["last_entry_id"], replay["user_ids"].tolist(),
+                                      replay["ratings"].tolist(), replay["wins"].tolist(), replay["losses"].tolist())
+
+
+def test_replay_is_not_applied_over_newer_results(tmp_path):
+    conn = bot.open_connection(str(tmp_path / "elo.db"))
+    bot.init_db(conn)
+    for user_id in (1, 2, 3):
+        bot.add_player_if_not_exists(conn, GUILD, user_id, f"player{user_id}")
+    confirm(conn, "m1", 1, 2)
+    confirm(conn, "m2", 2, 3)
+
+    replay = bot.replay_ratings_from_ledger(conn, GUILD)
+    # A result confirmed after the replay read the ledger.
+    winner_rating, loser_rating = confirm(conn, "m3", 3, 1)
+
+    assert not apply(conn, replay)
+    assert bot.get_player(conn, GUILD, 3)['elo_rating'] == winner_rating
+    assert bot.get_player(conn, GUILD, 1)['losses'] == 1
+
+    replay = bot.replay_ratings_from_ledger(conn, GUILD)
+    assert replay["matches"] == 3
+    assert apply(conn, replay)
+    assert bot.get_player(conn, GUILD, 1)['elo_rating'] == loser_rating
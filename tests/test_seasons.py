@@ -0,0 +1,27 @@
+import BotELOCOWT as bot
+
+GUILD = 1
+
+
+def test_rollover_resets_glicko2_deviation_and_volatility(tmp_path):
+    conn = bot.open_connection(str(tmp_path / "elo.db"))
+    bot.init_db(conn)
+    conn.execute('''
+        INSERT INTO players (guild_id, user_id, user_name, elo_rating, wins, losses, games_played,
+                             glicko_rating, glicko_rd, glicko_volatility)
+        VALUES (?, 1, 'veteran', 1400, 30, 10, 40, 1400.0, 60.0, 0.09)
+    ''', (GUILD,))
+    conn.commit()
+
+    season = bot.begin_season_rollover(conn, GUILD, now=1000)
+    finished = False
+    while not finished:
+        finished, _ = bot.roll_over_season_chunk(conn, GUILD, season, now=1000)
+
+    row = conn.execute("SELECT elo_rating, glicko_rating, glicko_rd, glicko_volatility, games_played FROM players").fetchone()
+    carried = bot.INITIAL_ELO + (1400 - bot.INITIAL_ELO) * bot.SEASON_RATING_CARRYOVER
+    assert row['elo_rating'] == round(carried)
+    assert row['glicko_rating'] == carried
+    assert row['glicko_rd'] == bot.GLICKO2_INITIAL_RD
+    assert row['glicko_volatility'] == bot.GLICKO2_INITIAL_VOLATILITY
+    assert row['games_played'] == 0